@@ -0,0 +1,65 @@
+import asyncio
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from metrics import metrics
+
+
+class AsyncDBManage:
+    # Writes the operations DBManage builds through the motor driver. They
+    # are built on a worker thread since DBManage reads the stored records
+    # to compare them with the new ones
+    def __init__(self, db_manage, db_instance=None):
+        self.__db_manage = db_manage
+        self.__db_instance = db_instance
+
+    async def insert_stock(self, dto):
+        print(f'Start insert ticker : {dto.ticker}')
+        timer_start = time.time()
+        with metrics.timer('db_write', ticker=dto.ticker):
+            await self.execute(await asyncio.to_thread(
+                self.__db_manage.get_insert_stock_operations, dto))
+        timer_end = time.time()
+        pass_time = Decimal(timer_end - timer_start).quantize(
+            Decimal('.1'), rounding=ROUND_HALF_UP)
+        print(f'Insert {dto.ticker} completed ({pass_time} s)')
+
+    async def update_pricevolume(self, dto):
+        print(f'Start update ticker : {dto.ticker}')
+        timer_start = time.time()
+        with metrics.timer('db_write', ticker=dto.ticker):
+            await self.execute(await asyncio.to_thread(
+                self.__db_manage.get_pricevolume_operations, dto))
+
+        timer_end = time.time()
+        pass_time = Decimal(timer_end - timer_start).quantize(
+            Decimal('.1'), rounding=ROUND_HALF_UP)
+        print(f'Update {dto.ticker} completed ({pass_time} s)')
+
+    async def update_income_statements(self, dto):
+        print(f'Start update ticker : {dto.ticker}')
+        timer_start = time.time()
+        with metrics.timer('db_write', ticker=dto.ticker):
+            await self.execute(await asyncio.to_thread(
+                self.__db_manage.get_income_statements_operations, dto))
+
+        timer_end = time.time()
+        pass_time = Decimal(timer_end - timer_start).quantize(
+            Decimal('.1'), rounding=ROUND_HALF_UP)
+        print(f'Update {dto.ticker} income statements completed '
+              f'({pass_time} s)')
+
+    async def execute(self, operations):
+        # Created on first use so the client belongs to the running loop
+        if self.__db_instance is None:
+            self.__db_instance = self.__db_manage.create_async_db_instance()
+
+        grouped_operations = {}
+        for [collection_name, operation] in operations:
+            grouped_operations.setdefault(collection_name, []) \
+                .append(operation)
+
+        for collection_name, collection_operations \
+                in grouped_operations.items():
+            await self.__db_instance[collection_name].bulk_write(
+                collection_operations, ordered=False)
@@ -0,0 +1,83 @@
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from metrics import metrics
+
+
+class AsyncHttpResponse:
+    # The parts of requests.Response StockCrawler's parse methods use
+    def __init__(self, status_code, headers, content, encoding):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncHttpSession:
+    # Like HttpSession only connection errors are retried here
+    def __init__(self, max_connections_per_host=10, connect_timeout=5,
+                 read_timeout=30, max_retries=3, backoff_factor=1,
+                 url_rewrites=None):
+        self.__max_connections_per_host = max_connections_per_host
+        self.__timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.__max_retries = max_retries
+        self.__backoff_factor = backoff_factor
+        # Same as HttpSession's url_rewrites
+        self.__url_rewrites = url_rewrites or {}
+        self.__session = None
+
+    async def get(self, url, headers=None):
+        host = urlsplit(url).netloc
+        for retry in range(0, self.__max_retries + 1):
+            try:
+                async with self.__get_session().get(
+                        self.__rewrite_url(url), headers=headers) as response:
+                    content = await response.read()
+                    metrics.increment('http_requests', host=host,
+                                      status=response.status)
+                    metrics.increment('http_bytes', len(content), host=host)
+                    return AsyncHttpResponse(
+                        response.status, response.headers, content,
+                        response.get_encoding())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if retry >= self.__max_retries:
+                    raise
+
+            metrics.increment('http_retries', host=host)
+            await asyncio.sleep(self.__backoff_factor * (2 ** retry))
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __get_session(self):
+        # Created on first use so it belongs to the running event loop
+        if self.__session is None:
+            # The connector queues requests over the per host limit
+            # instead of opening more connections
+            connector = aiohttp.TCPConnector(
+                limit=0, limit_per_host=self.__max_connections_per_host)
+            self.__session = aiohttp.ClientSession(
+                connector=connector, timeout=self.__timeout,
+                headers={'Accept-Encoding': 'gzip, deflate'})
+        return self.__session
+
+    def __rewrite_url(self, url):
+        split_url = urlsplit(url)
+        origin = f'{split_url.scheme}://{split_url.netloc}'
+        if origin not in self.__url_rewrites:
+            return url
+
+        return self.__url_rewrites[origin] + url[len(origin):]
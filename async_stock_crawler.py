@@ -0,0 +1,80 @@
+import asyncio
+
+from async_http_session import AsyncHttpSession
+from metrics import metrics
+from rate_limiter import ProviderUnavailable
+
+
+class AsyncStockCrawler:
+    # Fetches with asyncio and leaves building the URLs, parsing and the
+    # DTOs to StockCrawler, so both return the same records
+    __MAX_STATUS_RETRIES = 3
+
+    def __init__(self, stock_crawler, http_session=None):
+        self.__stock_crawler = stock_crawler
+        self.__http_session = http_session if http_session \
+            else AsyncHttpSession()
+        self.stocks_list = stock_crawler.stocks_list
+
+    async def get_price_and_vol(self, ticker, start_date, end_date):
+        fetch_range = self.__stock_crawler.get_price_and_vol_fetch_range(
+            ticker, start_date, end_date)
+        response = None
+        if fetch_range:
+            [target_url, headers] = self.__stock_crawler \
+                .get_price_and_vol_request(ticker, *fetch_range)
+            response = await self.__get(target_url, headers=headers,
+                                        ticker=ticker)
+
+        # CSV parsing and raw data cache writes would stall every request
+        # in flight if they ran on the event loop
+        return await asyncio.to_thread(
+            self.__stock_crawler.parse_price_and_vol,
+            ticker, response, [start_date, end_date], fetch_range)
+
+    async def get_income_statements_dto(self, ticker, start_year,
+                                        start_season, end_year, end_season):
+        fetch_range = self.__stock_crawler.get_income_statements_fetch_range(
+            ticker, start_year, start_season, end_year, end_season)
+        response = None
+        try:
+            if fetch_range:
+                response = await self.__get(
+                    self.__stock_crawler.get_income_statements_url(
+                        ticker, *fetch_range),
+                    ticker=ticker)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            raise Exception(f'Ticker: {ticker}, Error: {e}')
+
+        return await asyncio.to_thread(
+            self.__stock_crawler.parse_income_statements_dto,
+            ticker, response,
+            [start_year, start_season, end_year, end_season], fetch_range)
+
+    async def close(self):
+        await self.__http_session.close()
+
+    async def __get(self, url, headers=None, **labels):
+        # Shares StockCrawler's provider throttles, so a provider parked
+        # by either crawler is parked for both. 429 and 5xx are retried
+        # here the same way as StockCrawler does
+        throttle = self.__stock_crawler.get_throttle(url)
+        for retry in range(0, self.__MAX_STATUS_RETRIES + 1):
+            if throttle:
+                with metrics.timer('throttle_wait', **labels):
+                    await asyncio.sleep(throttle.reserve())
+                # The provider may have been parked while waiting
+                throttle.check()
+
+            with metrics.timer('http_fetch', **labels):
+                response = await self.__http_session.get(
+                    url, headers=headers)
+
+            is_retried = throttle.record_response(
+                response.status_code, response.headers) if throttle \
+                else False
+            if not is_retried or retry >= self.__MAX_STATUS_RETRIES:
+                return response
+            metrics.increment('http_retries', host=throttle.name)
@@ -0,0 +1,117 @@
+import asyncio
+from functools import partial
+
+from metrics import metrics
+from rate_limiter import ProviderUnavailable
+
+
+class AsyncTickerUpdater:
+    __MAX_ATTEMPTS = 3
+
+    def __init__(self, async_stock_crawler, db_manage, async_db_manage,
+                 watermarks, bulk_writer=None):
+        self.__async_stock_crawler = async_stock_crawler
+        self.__db_manage = db_manage
+        self.__async_db_manage = async_db_manage
+        self.__watermarks = watermarks
+        self.__bulk_writer = bulk_writer
+
+    def update(self, jobs):
+        # jobs is job type -> [ranges, checkpoint], same as
+        # UpdatePipeline.run. Failed tickers go to the job's checkpoint's
+        # dead letters instead of stopping the run when there is one
+        asyncio.run(self.__run(jobs))
+
+    async def __run(self, jobs):
+        # Every ticker of every job is in flight at once, the HTTP
+        # session's per host connection limit decides how many requests
+        # are really sent
+        update_tickers = {
+            'pricevolume': self.__update_pricevolume,
+            'income_statements': self.__update_income_statements
+        }
+        try:
+            await asyncio.gather(*[
+                self.__update_with_retry(
+                    ticker, ticker_range, update_tickers[job_type],
+                    checkpoint)
+                for job_type, [ranges, checkpoint] in jobs.items()
+                for ticker, ticker_range in ranges.items()])
+        finally:
+            await self.__async_stock_crawler.close()
+
+    async def __update_with_retry(self, ticker, ticker_range,
+                                  update_ticker, checkpoint):
+        attempt = 0
+        while attempt < self.__MAX_ATTEMPTS:
+            try:
+                await update_ticker(ticker, ticker_range, checkpoint)
+                return
+            except ProviderUnavailable as e:
+                # Parked, only this ticker waits and it keeps its attempts
+                await asyncio.sleep(e.wait_seconds)
+                continue
+            except ValueError as v:
+                print(v)
+            except Exception as e:
+                print(f'Error: {e}')
+                print(f'Ticker {ticker} retry')
+            metrics.increment('ticker_retries', ticker=ticker)
+            attempt += 1
+
+        if not checkpoint:
+            raise Exception('Retried 3 times still fail')
+        checkpoint.record(ticker, Exception('Retried 3 times still fail'))
+
+    async def __update_pricevolume(self, ticker, date_range, checkpoint):
+        watermark = self.__watermarks.get(ticker)
+        [start_date, end_date] = date_range
+
+        dto = await self.__async_stock_crawler.get_price_and_vol(
+            ticker, start_date, end_date)
+
+        if self.__bulk_writer:
+            await self.__add_to_bulk_writer(
+                ticker, checkpoint, await asyncio.to_thread(
+                    self.__db_manage.get_pricevolume_operations
+                    if watermark
+                    else self.__db_manage.get_insert_stock_operations, dto))
+            return
+
+        if watermark:
+            await self.__async_db_manage.update_pricevolume(dto)
+        else:
+            await self.__async_db_manage.insert_stock(dto)
+        if checkpoint:
+            checkpoint.record(ticker)
+
+    async def __update_income_statements(self, ticker, season_range,
+                                         checkpoint):
+        watermark = self.__watermarks.get(ticker)
+        [start_year, start_season, end_year, end_season] = season_range
+
+        dto = await self.__async_stock_crawler.get_income_statements_dto(
+            ticker, start_year, start_season, end_year, end_season)
+
+        if self.__bulk_writer:
+            await self.__add_to_bulk_writer(
+                ticker, checkpoint, await asyncio.to_thread(
+                    self.__db_manage.get_income_statements_operations
+                    if watermark
+                    else self.__db_manage.get_insert_stock_operations, dto))
+            return
+
+        if watermark:
+            await self.__async_db_manage.update_income_statements(dto)
+        else:
+            await self.__async_db_manage.insert_stock(dto)
+        if checkpoint:
+            checkpoint.record(ticker)
+
+    async def __add_to_bulk_writer(self, ticker, checkpoint, operations):
+        # add() flushes in place when the batch is full, keep that off the
+        # event loop. The ticker is completed once its batch is written
+        on_complete = partial(checkpoint.record, ticker) \
+            if checkpoint else None
+        await asyncio.to_thread(
+            self.__bulk_writer.add, ticker, operations, on_complete)
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from pymongo import MongoClient
+
+from benchmarks.stub_server import serve
+from db_manage import DBManage
+from http_session import HttpSession
+from income_statements_bulk import IncomeStatementsBulkUpdater
+from market_snapshot import MarketSnapshotUpdater
+from stock_crawler import StockCrawler
+
+
+PROVIDER_ORIGINS = [
+    'https://query1.finance.yahoo.com',
+    'https://api.finmindtrade.com',
+    'http://isin.twse.com.tw',
+    'https://isin.twse.com.tw',
+    'https://www.twse.com.tw',
+    'https://www.tpex.org.tw'
+]
+SCENARIOS = ['backfill', 'daily', 'snapshot', 'income', 'income-by-date']
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'scenario',
+        choices=SCENARIOS,
+        help='backfill: 10 years of price per ticker, '
+        'daily: one new day per ticker (-l), '
+        'snapshot: one new day from market-wide quotes, '
+        'income: one earnings season per ticker, '
+        'income-by-date: one earnings season for all tickers by date'
+    )
+    parser.add_argument('-n', '--tickers', dest='tickers', type=int,
+                        default=100, help='Number of tickers')
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+                        default=1, help='Tickers updated concurrently')
+    parser.add_argument('--latency', dest='latency', type=float,
+                        default=0.05, help='Stub server latency in seconds')
+    parser.add_argument('--jitter', dest='jitter', type=float, default=0.02,
+                        help='Random +/- seconds added to the latency')
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0, help='Ratio of requests answered with 503')
+    parser.add_argument('--finmind-quota', dest='finmind_quota', type=int,
+                        default=None,
+                        help='FinMind calls allowed before status 402')
+    parser.add_argument('--port', dest='port', type=int, default=8765,
+                        help='Port of the stub provider server')
+    parser.add_argument('--mongo-uri', dest='mongo_uri', type=str,
+                        default=None,
+                        help='Local mongod to write to, mongomock is used '
+                        'when not set')
+    parser.add_argument('--json', dest='as_json', action='store_true',
+                        default=False, help='Print the report as JSON')
+    parser.add_argument('-v', '--verbose', dest='verbose',
+                        action='store_true', default=False,
+                        help='Keep crawler and db output')
+
+    return parser.parse_args()
+
+
+def start_stub_server(arg_options):
+    # Separate process so the server does not count in the crawler's
+    # CPU time and peak RSS
+    server_process = multiprocessing.Process(
+        target=serve, args=(arg_options.port,),
+        kwargs={
+            'tickers': arg_options.tickers,
+            'latency': arg_options.latency,
+            'jitter': arg_options.jitter,
+            'error_rate': arg_options.error_rate,
+            'finmind_quota': arg_options.finmind_quota
+        },
+        daemon=True
+    )
+    server_process.start()
+
+    base_url = f'http://127.0.0.1:{arg_options.port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{base_url}/__stats', timeout=1)
+            return [server_process, base_url]
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    raise Exception('Stub provider server did not start')
+
+
+def connect_db(arg_options):
+    if arg_options.mongo_uri:
+        db_instance = MongoClient(arg_options.mongo_uri)['crawler_benchmark']
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('Install mongomock or pass --mongo-uri')
+        db_instance = mongomock.MongoClient()['crawler_benchmark']
+
+    db_instance.drop_collection('benchmark')
+    db_instance.drop_collection('benchmark_buckets')
+    return DBManage(credential={'collection_name': 'benchmark'},
+                    db_instance=db_instance)
+
+
+def build_crawler(base_url, cache_dir, workers):
+    http_session = HttpSession(
+        pool_maxsize=max(workers, 10), backoff_factor=0.1,
+        url_rewrites={origin: base_url for origin in PROVIDER_ORIGINS})
+    return StockCrawler(http_session=http_session, api_config={
+        'finmind_api_token': 'benchmark',
+        'stocks_list_cache_path': os.path.join(cache_dir, 'stocks.cache'),
+        'stocks_list_cache_ttl_seconds': 0,
+        # Measure the crawler, not the providers' rate limits
+        'rate_limits': {urlsplit(origin).netloc: 1000
+                        for origin in PROVIDER_ORIGINS}
+    })
+
+
+def run_per_ticker(tickers, update_ticker, workers):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def timed_update(ticker):
+        timer_start = time.perf_counter()
+        try:
+            update_ticker(ticker)
+        except Exception as e:
+            with lock:
+                failures.append([ticker, str(e)])
+            return
+        with lock:
+            latencies.append(time.perf_counter() - timer_start)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed_update, tickers))
+
+    return [latencies, failures]
+
+
+def run_scenario(scenario, stock_crawler, db_manage, workers):
+    tickers = list(stock_crawler.stocks_list)
+
+    if scenario == 'backfill':
+        return run_per_ticker(tickers, lambda ticker: db_manage.insert_stock(
+            stock_crawler.get_price_and_vol(
+                ticker, '2011-01-01', '2021-06-30')), workers)
+    elif scenario == 'daily':
+        return run_per_ticker(
+            tickers, lambda ticker: db_manage.update_pricevolume(
+                stock_crawler.get_price_and_vol(
+                    ticker, '2021-06-29', '2021-06-30')), workers)
+    elif scenario == 'income':
+        return run_per_ticker(
+            tickers, lambda ticker: db_manage.update_income_statements(
+                stock_crawler.get_income_statements_dto(
+                    ticker, 2021, 1, 2021, 3)), workers)
+    elif scenario == 'snapshot':
+        MarketSnapshotUpdater(stock_crawler, db_manage).update(
+            {ticker: ['2021-06-29', '2021-06-30'] for ticker in tickers})
+    elif scenario == 'income-by-date':
+        IncomeStatementsBulkUpdater(stock_crawler, db_manage).update(
+            {ticker: [2021, 1, 2021, 3] for ticker in tickers}, {})
+
+    return [[], []]
+
+
+def percentile(values, ratio):
+    if len(values) <= 0:
+        return None
+    sorted_values = sorted(values)
+    return sorted_values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def print_report(report):
+    print(f'Scenario        : {report["scenario"]}')
+    print(f'Tickers         : {report["tickers"]} '
+          f'({report["failed_tickers"]} failed)')
+    print(f'Startup         : {report["startup_seconds"]:.2f} s')
+    print(f'Run             : {report["run_seconds"]:.2f} s')
+    print(f'Throughput      : {report["tickers_per_second"]:.1f} tickers/s')
+    if report['p50_ms'] is not None:
+        print(f'Ticker latency  : p50 {report["p50_ms"]:.1f} ms, '
+              f'p99 {report["p99_ms"]:.1f} ms')
+    print(f'Peak RSS        : {report["peak_rss_mb"]:.1f} MB')
+    for endpoint, endpoint_stats in sorted(report['api_calls'].items()):
+        print(f'API {endpoint:<12}: {endpoint_stats["calls"]} calls, '
+              f'{endpoint_stats["bytes"] / 1024:.0f} KB')
+
+
+if __name__ == '__main__':
+    arg_options = arg_parse()
+    [server_process, base_url] = start_stub_server(arg_options)
+    output = contextlib.nullcontext() if arg_options.verbose \
+        else contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as cache_dir, output:
+        db_manage = connect_db(arg_options)
+
+        timer_start = time.perf_counter()
+        stock_crawler = build_crawler(
+            base_url, cache_dir, arg_options.workers)
+        startup_seconds = time.perf_counter() - timer_start
+
+        timer_start = time.perf_counter()
+        [latencies, failures] = run_scenario(
+            arg_options.scenario, stock_crawler, db_manage,
+            arg_options.workers)
+        run_seconds = time.perf_counter() - timer_start
+
+    api_calls = requests.get(f'{base_url}/__stats').json()
+    api_calls.pop('finmind_quota', None)
+    server_process.terminate()
+
+    ticker_count = len(stock_crawler.stocks_list)
+    report = {
+        'scenario': arg_options.scenario,
+        'tickers': ticker_count,
+        'failed_tickers': len(failures),
+        'startup_seconds': startup_seconds,
+        'run_seconds': run_seconds,
+        'tickers_per_second': ticker_count / run_seconds,
+        'p50_ms': None if len(latencies) <= 0
+        else percentile(latencies, 0.5) * 1000,
+        'p99_ms': None if len(latencies) <= 0
+        else percentile(latencies, 0.99) * 1000,
+        'peak_rss_mb':
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'api_calls': api_calls
+    }
+
+    if arg_options.as_json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+    for [ticker, error] in failures[:10]:
+        print(f'## Warning: Ticker {ticker} is failed! {error}')
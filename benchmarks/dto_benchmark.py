@@ -0,0 +1,113 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from dto import DateInfoDTO, IncomeStatementDTO, StockDTO, \
+    IncomeStatementRecord, StockRecords
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--rows',
+        dest='rows',
+        type=int,
+        default=2500,
+        help='Number of rows per ticker, default is a 10 years backfill'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        dest='repeat',
+        type=int,
+        default=5,
+        help='Number of runs, the fastest one is reported'
+    )
+
+    return parser.parse_args()
+
+
+def build_rows(count):
+    rows = []
+    for i in range(count):
+        price = round(random.uniform(10, 1000), 2)
+        rows.append({
+            'date': f'{2011 + i // 250}-01-01',
+            'open': price,
+            'close': price,
+            'high': price,
+            'low': price,
+            'volume': random.randint(0, 100000)
+        })
+    return rows
+
+
+def date_info_with_models(rows):
+    stock_dto = StockDTO(ticker='2330', stock_name='台積電')
+    for row in rows:
+        stock_dto.date_info.append(DateInfoDTO(**row))
+    return [date_info.dict() for date_info in stock_dto.date_info]
+
+
+def date_info_with_records(rows):
+    stock_records = StockRecords(ticker='2330', stock_name='台積電')
+    for row in rows:
+        stock_records.date_info.append(dict(row))
+    return stock_records.dict()['date_info']
+
+
+def income_statements_with_models(rows):
+    stock_dto = StockDTO(ticker='2330', stock_name='台積電')
+    for row in rows:
+        income_statement_dto = IncomeStatementDTO(year=2021, season=1)
+        income_statement_dto.revenue = row['volume']
+        income_statement_dto.cost = row['volume']
+        income_statement_dto.gp = row['volume']
+        income_statement_dto.oi = row['volume']
+        income_statement_dto.eps = row['close']
+        stock_dto.income_statements.append(income_statement_dto)
+    return [income_statement.dict()
+            for income_statement in stock_dto.income_statements]
+
+
+def income_statements_with_records(rows):
+    stock_records = StockRecords(ticker='2330', stock_name='台積電')
+    for row in rows:
+        income_statement_record = IncomeStatementRecord(year=2021, season=1)
+        income_statement_record.revenue = row['volume']
+        income_statement_record.cost = row['volume']
+        income_statement_record.gp = row['volume']
+        income_statement_record.oi = row['volume']
+        income_statement_record.eps = row['close']
+        stock_records.income_statements.append(income_statement_record)
+    return stock_records.dict()['income_statements']
+
+
+def measure(func, rows, repeat):
+    best_time = None
+    for _ in range(repeat):
+        timer_start = time.perf_counter()
+        func(rows)
+        pass_time = time.perf_counter() - timer_start
+        best_time = pass_time if best_time is None \
+            else min(best_time, pass_time)
+
+    tracemalloc.start()
+    func(rows)
+    [_, peak_bytes] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return [best_time / len(rows) * 1e6, peak_bytes / len(rows)]
+
+
+arg_options = arg_parse()
+rows = build_rows(arg_options.rows)
+
+print(f'{"case":<32}{"us/row":>10}{"bytes/row":>12}')
+for [name, func] in [
+        ['date_info pydantic', date_info_with_models],
+        ['date_info records', date_info_with_records],
+        ['income_statements pydantic', income_statements_with_models],
+        ['income_statements records', income_statements_with_records]]:
+    [us_per_row, bytes_per_row] = measure(func, rows, arg_options.repeat)
+    print(f'{name:<32}{us_per_row:>10.2f}{bytes_per_row:>12.0f}')
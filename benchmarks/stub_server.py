@@ -0,0 +1,265 @@
+import argparse
+from datetime import datetime, date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+
+FINMIND_TYPES = [
+    'Revenue', 'CostOfGoodsSold', 'GrossProfit', 'OperatingExpenses',
+    'OperatingIncome', 'TotalNonoperatingIncomeAndExpense',
+    'IncomeBeforeTaxFromContinuingOperations', 'NetIncome', 'EPS'
+]
+SEASON_ENDS = ['03-31', '06-30', '09-30', '12-31']
+
+
+def build_tickers(count):
+    # Even index tickers are listed on TWSE, odd ones on OTC
+    return [f'{1101 + i}' for i in range(count)]
+
+
+class StubProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tickers=100, latency=0.0, jitter=0.0,
+                 error_rate=0.0, finmind_quota=None, seed=0):
+        super().__init__(address, StubProviderHandler)
+        self.tickers = build_tickers(tickers)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.finmind_quota = finmind_quota
+        self.random = random.Random(seed)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def count(self, endpoint, sent_bytes=0):
+        with self.stats_lock:
+            endpoint_stats = self.stats.setdefault(
+                endpoint, {'calls': 0, 'bytes': 0})
+            endpoint_stats['calls'] += 1
+            endpoint_stats['bytes'] += sent_bytes
+            return endpoint_stats['calls']
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        split_url = urlsplit(self.path)
+        query = {key: values[0]
+                 for key, values in parse_qs(split_url.query).items()}
+
+        if split_url.path == '/__stats':
+            self.__send(200, 'application/json',
+                        json.dumps(self.server.stats))
+            return
+
+        delay = self.server.latency + self.server.random.uniform(
+            -self.server.jitter, self.server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if split_url.path.startswith('/v7/finance/download/'):
+            [endpoint, body, content_type] = \
+                ['yahoo', self.__yahoo_csv(split_url.path, query), 'text/csv']
+        elif split_url.path == '/api/v4/data':
+            [endpoint, body, content_type] = \
+                ['finmind', self.__finmind_json(query), 'application/json']
+        elif split_url.path == '/isin/C_public.jsp':
+            [endpoint, body, content_type] = \
+                ['isin', self.__isin_html(query), 'text/html; charset=utf-8']
+        elif split_url.path == '/exchangeReport/MI_INDEX':
+            [endpoint, body, content_type] = \
+                ['twse', self.__twse_json(query), 'application/json']
+        elif split_url.path.endswith('/stk_quote_result.php'):
+            [endpoint, body, content_type] = \
+                ['tpex', self.__tpex_json(query), 'application/json']
+        else:
+            self.__send(404, 'text/plain', 'Not found')
+            return
+
+        if self.server.random.random() < self.server.error_rate:
+            self.server.count(f'{endpoint}_error')
+            self.__send(503, 'text/plain', 'Service unavailable')
+            return
+
+        encoded_body = body.encode('utf-8')
+        self.server.count(endpoint, len(encoded_body))
+        self.__send(200, content_type, encoded_body)
+
+    def __send(self, status, content_type, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __yahoo_csv(self, path, query):
+        ticker = path.rsplit('/', 1)[1].split('.')[0]
+        start_date = datetime.fromtimestamp(int(query['period1'])).date()
+        end_date = datetime.fromtimestamp(int(query['period2'])).date()
+
+        lines = ['Date,Open,High,Low,Close,Adj Close,Volume']
+        for cur_date in self.__business_days(start_date, end_date):
+            day_random = random.Random(f'{ticker}{cur_date}')
+            close = day_random.uniform(10, 1000)
+            open_price = close * day_random.uniform(0.97, 1.03)
+            high = max(open_price, close) * day_random.uniform(1, 1.02)
+            low = min(open_price, close) * day_random.uniform(0.98, 1)
+            volume = day_random.randint(0, 50000000)
+            lines.append(f'{cur_date},{open_price!r},{high!r},{low!r},'
+                         f'{close!r},{close!r},{volume}')
+
+        return '\n'.join(lines)
+
+    def __finmind_json(self, query):
+        if self.server.finmind_quota is not None \
+                and self.server.count('finmind_quota') \
+                > self.server.finmind_quota:
+            return json.dumps({'status': 402, 'msg': 'Requests reach limit'})
+
+        start_date = query['start_date']
+        end_date = query.get('end_date', start_date)
+        tickers = [query['data_id']] if 'data_id' in query \
+            else self.server.tickers
+
+        data = []
+        for year in range(int(start_date[:4]), int(end_date[:4]) + 1):
+            for season_end in SEASON_ENDS:
+                report_date = f'{year}-{season_end}'
+                if not start_date <= report_date <= end_date:
+                    continue
+                for ticker in tickers:
+                    data.extend(self.__finmind_rows(ticker, report_date))
+
+        return json.dumps({'msg': 'success', 'status': 200, 'data': data})
+
+    def __finmind_rows(self, ticker, report_date):
+        report_random = random.Random(f'{ticker}{report_date}')
+        rows = []
+        for finmind_type in FINMIND_TYPES:
+            value = report_random.uniform(-10, 50) \
+                if finmind_type == 'EPS' \
+                else float(report_random.randint(0, 10 ** 11))
+            rows.append({
+                'date': report_date,
+                'stock_id': ticker,
+                'type': finmind_type,
+                'value': value,
+                'origin_name': finmind_type
+            })
+        return rows
+
+    def __isin_html(self, query):
+        is_twse = query.get('strMode') == '2'
+        rows = ['<tr><td>有價證券代號及名稱</td><td>國際證券辨識號碼</td>'
+                '<td>上市日</td><td>市場別</td><td>產業別</td>'
+                '<td>CFICode</td><td>備註</td></tr>',
+                '<tr><td>股票</td><td>股票</td><td>股票</td><td>股票</td>'
+                '<td>股票</td><td>股票</td><td>股票</td></tr>']
+        for i, ticker in enumerate(self.server.tickers):
+            if (i % 2 == 0) != is_twse:
+                continue
+            rows.append(f'<tr><td>{ticker}　股票{ticker}</td>'
+                        f'<td>TW000{ticker}004</td><td>2000/01/01</td>'
+                        f'<td>{"上市" if is_twse else "上櫃"}</td>'
+                        '<td>其他業</td><td>ESVUFR</td><td></td></tr>')
+
+        return f'<html><body><table>{"".join(rows)}</table></body></html>'
+
+    def __twse_json(self, query):
+        cur_date = datetime.strptime(query['date'], '%Y%m%d').date()
+        if cur_date.weekday() >= 5:
+            return json.dumps({'stat': '很抱歉，沒有符合條件的資料!'})
+
+        fields = ['證券代號', '證券名稱', '成交股數', '成交筆數', '成交金額',
+                  '開盤價', '最高價', '最低價', '收盤價']
+        data = []
+        for i, ticker in enumerate(self.server.tickers):
+            if i % 2 != 0:
+                continue
+            quote = self.__quote(ticker, cur_date)
+            data.append([ticker, f'股票{ticker}', quote['volume'], '1', '1',
+                         quote['open'], quote['high'], quote['low'],
+                         quote['close']])
+
+        return json.dumps(
+            {'stat': 'OK', 'tables': [{'fields': fields, 'data': data}]},
+            ensure_ascii=False)
+
+    def __tpex_json(self, query):
+        [roc_year, month, day] = query['d'].split('/')
+        cur_date = date(int(roc_year) + 1911, int(month), int(day))
+        if cur_date.weekday() >= 5:
+            return json.dumps({'aaData': []})
+
+        data = []
+        for i, ticker in enumerate(self.server.tickers):
+            if i % 2 == 0:
+                continue
+            quote = self.__quote(ticker, cur_date)
+            data.append([ticker, f'股票{ticker}', quote['close'], '0',
+                         quote['open'], quote['high'], quote['low'],
+                         quote['close'], quote['volume']])
+
+        return json.dumps({'aaData': data}, ensure_ascii=False)
+
+    def __quote(self, ticker, cur_date):
+        day_random = random.Random(f'{ticker}{cur_date}')
+        close = day_random.uniform(10, 1000)
+        return {
+            'open': f'{close * 0.99:,.2f}',
+            'high': f'{close * 1.01:,.2f}',
+            'low': f'{close * 0.98:,.2f}',
+            'close': f'{close:,.2f}',
+            'volume': f'{day_random.randint(0, 50000000):,}'
+        }
+
+    def __business_days(self, start_date, end_date):
+        cur_date = start_date
+        while cur_date <= end_date:
+            if cur_date.weekday() < 5:
+                yield cur_date
+            cur_date += timedelta(days=1)
+
+
+def serve(port, **kwargs):
+    server = StubProviderServer(('127.0.0.1', port), **kwargs)
+    server.serve_forever()
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', dest='port', type=int, default=8000,
+                        help='Port to listen on')
+    parser.add_argument('-n', '--tickers', dest='tickers', type=int,
+                        default=100, help='Number of listed tickers')
+    parser.add_argument('--latency', dest='latency', type=float, default=0,
+                        help='Seconds added to every response')
+    parser.add_argument('--jitter', dest='jitter', type=float, default=0,
+                        help='Random +/- seconds added to the latency')
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0, help='Ratio of requests answered with 503')
+    parser.add_argument('--finmind-quota', dest='finmind_quota', type=int,
+                        default=None,
+                        help='FinMind calls allowed before status 402')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arg_options = arg_parse()
+    print(f'Stub provider server listening on port {arg_options.port}')
+    serve(arg_options.port, tickers=arg_options.tickers,
+          latency=arg_options.latency, jitter=arg_options.jitter,
+          error_rate=arg_options.error_rate,
+          finmind_quota=arg_options.finmind_quota)
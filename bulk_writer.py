@@ -0,0 +1,102 @@
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from pymongo.errors import BulkWriteError
+
+from metrics import metrics
+
+
+class BulkWriter:
+    def __init__(self, db_manage, max_batch_size=500, max_wait_seconds=5):
+        self.__db_manage = db_manage
+        self.__max_batch_size = max_batch_size
+        self.__max_wait_seconds = max_wait_seconds
+        self.failed_tickers = {}
+
+        # [ticker, operations, on_complete] waiting for the next flush
+        self.__buffer = []
+        self.__buffer_size = 0
+        self.__buffer_lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+
+        self.__closed = threading.Event()
+        self.__flush_thread = threading.Thread(
+            target=self.__flush_periodically, daemon=True)
+        self.__flush_thread.start()
+
+    def add(self, ticker, operations, on_complete=None):
+        with self.__buffer_lock:
+            self.__buffer.append([ticker, operations, on_complete])
+            self.__buffer_size += len(operations)
+            is_full = self.__buffer_size >= self.__max_batch_size
+
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        with self.__flush_lock:
+            with self.__buffer_lock:
+                batch = self.__buffer
+                self.__buffer = []
+                self.__buffer_size = 0
+            if len(batch) <= 0:
+                return
+
+            timer_start = time.time()
+            with metrics.timer('db_write', tickers=len(batch)):
+                errors = self.__write(batch)
+            timer_end = time.time()
+            metrics.increment('db_write_errors', len(errors))
+            pass_time = Decimal(timer_end - timer_start).quantize(
+                Decimal('.1'), rounding=ROUND_HALF_UP)
+            print(f'Flush {len(batch)} tickers completed, '
+                  f'{len(errors)} failed ({pass_time} s)')
+
+            for [ticker, _, on_complete] in batch:
+                error = errors.get(ticker)
+                if error is not None:
+                    print(f'## Warning: Ticker {ticker} write failed: {error}')
+                    self.failed_tickers.update({ticker: error})
+                else:
+                    self.failed_tickers.pop(ticker, None)
+
+                if on_complete:
+                    on_complete(error)
+
+    def close(self):
+        self.__closed.set()
+        self.__flush_thread.join()
+        self.flush()
+
+    def __flush_periodically(self):
+        while not self.__closed.wait(self.__max_wait_seconds):
+            self.flush()
+
+    def __write(self, batch):
+        grouped_operations = {}
+        for [ticker, operations, _] in batch:
+            for [collection_name, operation] in operations:
+                grouped_operations.setdefault(collection_name, []) \
+                    .append([ticker, operation])
+
+        # Unordered so one failing ticker does not stop the rest, errors
+        # are mapped back to tickers through the operation index
+        errors = {}
+        for collection_name, entries in grouped_operations.items():
+            collection = self.__db_manage.get_collection(collection_name)
+            try:
+                collection.bulk_write(
+                    [operation for [_, operation] in entries], ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details['writeErrors']:
+                    ticker = entries[write_error['index']][0]
+                    errors.update({ticker: Exception(write_error['errmsg'])})
+                if e.details['writeConcernErrors']:
+                    for [ticker, _] in entries:
+                        errors.setdefault(ticker, e)
+            except Exception as e:
+                for [ticker, _] in entries:
+                    errors.setdefault(ticker, e)
+
+        return errors
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+
+class RunCheckpoint:
+    # Journal of an update run: the first line is the planned range of
+    # every ticker, each following line the outcome of one ticker. Lines
+    # are only appended so recording a ticker costs the same at any point
+    # of the run
+    def __init__(self, path):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__journal_file = None
+        self.dead_letters = {}
+
+    def start(self, ranges):
+        self.__write_plan(ranges)
+        return ranges
+
+    def resume(self):
+        # Ranges of the tickers the last run did not complete, failed ones
+        # included, or None when there is no run to resume, i.e. no
+        # journal or every ticker of it completed
+        if not os.path.exists(self.__path):
+            return None
+
+        ranges = None
+        completed = set()
+        with open(self.__path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Half written last line of an interrupted run
+                    break
+                if entry['type'] == 'plan':
+                    ranges = entry['ranges']
+                elif entry['status'] == 'completed':
+                    completed.add(entry['ticker'])
+                else:
+                    completed.discard(entry['ticker'])
+
+        if ranges is None:
+            return None
+
+        remaining_ranges = {ticker: ticker_range
+                            for ticker, ticker_range in ranges.items()
+                            if ticker not in completed}
+        if len(remaining_ranges) <= 0:
+            print(f'Nothing to resume from {self.__path}, plan a new run')
+            return None
+
+        print(f'Resume {len(remaining_ranges)} of {len(ranges)} tickers '
+              f'from {self.__path}')
+        self.__write_plan(remaining_ranges)
+        return remaining_ranges
+
+    def record(self, ticker, error=None):
+        # Also the on_complete callback of BulkWriter.add
+        with self.__lock:
+            if error is None:
+                self.dead_letters.pop(ticker, None)
+                entry = {'type': 'ticker', 'ticker': ticker,
+                         'status': 'completed'}
+            else:
+                print(f'## Warning: Ticker {ticker} moved to dead letters: '
+                      f'{error}')
+                self.dead_letters.update({ticker: str(error)})
+                entry = {'type': 'ticker', 'ticker': ticker,
+                         'status': 'failed', 'error': str(error)}
+
+            self.__journal_file.write(json.dumps(entry) + '\n')
+            self.__journal_file.flush()
+
+    def close(self):
+        with self.__lock:
+            if self.__journal_file:
+                self.__journal_file.close()
+                self.__journal_file = None
+
+    def __write_plan(self, ranges):
+        # Write to a temp file first so a crash never leaves half a plan
+        temp_path = f'{self.__path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as output_file:
+            output_file.write(
+                json.dumps({'type': 'plan', 'ranges': ranges}) + '\n')
+        os.replace(temp_path, self.__path)
+
+        self.close()
+        self.__journal_file = open(self.__path, 'a', encoding='utf-8')
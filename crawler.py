@@ -0,0 +1,208 @@
+import argparse
+
+from db_manage import DBManage
+from update_runner import UpdateRunner, add_common_arguments, \
+    add_pricevolume_arguments, add_income_statements_arguments
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run',
+        help='Update price and volume and / or income statements in one '
+        'run, sharing the stock list, Mongo connection and fetch workers'
+    )
+    run_parser.add_argument(
+        '--prices',
+        dest='update_pricevolume',
+        action='store_true',
+        default=False,
+        help='Update price and volume'
+    )
+    run_parser.add_argument(
+        '--income',
+        dest='update_income_statements',
+        action='store_true',
+        default=False,
+        help='Update income statements'
+    )
+    run_parser.add_argument(
+        '-s', '--start',
+        dest='start_date',
+        type=str,
+        help='The start date of price and volume you want to search from, '
+        'format should be "yyyy-mm-dd"'
+    )
+    run_parser.add_argument(
+        '-e', '--end',
+        dest='end_date',
+        type=str,
+        help='The end date of price and volume you want to search to, '
+        'format should be "yyyy-mm-dd"'
+    )
+    run_parser.add_argument(
+        '--start-season',
+        dest='start_season',
+        type=str,
+        help='The start year and season of income statements you want to '
+        'search from, format should be "Y-S"'
+    )
+    run_parser.add_argument(
+        '--end-season',
+        dest='end_season',
+        type=str,
+        help='The end year and season of income statements you want to '
+        'search to, format should be "Y-S"'
+    )
+    run_parser.add_argument(
+        '--pricevolume-checkpoint',
+        dest='pricevolume_checkpoint_path',
+        type=str,
+        default='.\\update_pricevolume.checkpoint',
+        help='File the price and volume run state is saved to for --resume'
+    )
+    run_parser.add_argument(
+        '--income-statements-checkpoint',
+        dest='income_statements_checkpoint_path',
+        type=str,
+        default='.\\update_income_statements.checkpoint',
+        help='File the income statements run state is saved to for '
+        '--resume'
+    )
+    add_pricevolume_arguments(run_parser)
+    add_income_statements_arguments(run_parser)
+    add_common_arguments(run_parser)
+
+    explain_parser = subparsers.add_parser(
+        'explain',
+        help='Show the query plan of the queries run for every ticker and '
+        'warn about the ones not using an index'
+    )
+    explain_parser.add_argument(
+        '-t', '--ticker',
+        dest='ticker',
+        type=str,
+        default=None,
+        help='Ticker the queries are planned for, default: the first one '
+        'in db'
+    )
+    explain_parser.add_argument(
+        '-b', '--buckets',
+        dest='use_buckets',
+        action='store_true',
+        default=False,
+        help='Price and volume are stored in yearly bucket documents'
+    )
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Copy price and volume and income statements into year '
+        'partitioned Parquet or Arrow files (needs pyarrow)'
+    )
+    export_parser.add_argument(
+        '-o', '--output',
+        dest='export_path',
+        type=str,
+        default='.\\export',
+        help='Directory of the exported files and their manifest'
+    )
+    export_parser.add_argument(
+        '-f', '--format',
+        dest='export_format',
+        choices=['parquet', 'arrow'],
+        default='parquet',
+        help='File format, default: parquet'
+    )
+    export_parser.add_argument(
+        '--full',
+        dest='export_full',
+        action='store_true',
+        default=False,
+        help='Export every stored day and season and replace the files of '
+        'the previous exports, default: only the ones added since the last '
+        'export'
+    )
+    export_parser.add_argument(
+        '-w', '--workers',
+        dest='workers',
+        type=int,
+        default=4,
+        help='Number of tickers batches read and written in parallel'
+    )
+    export_parser.add_argument(
+        '--batch-size',
+        dest='export_batch_size',
+        type=int,
+        default=100,
+        help='Number of consecutive tickers read by one cursor and written '
+        'to one set of files'
+    )
+    export_parser.add_argument(
+        '-b', '--buckets',
+        dest='use_buckets',
+        action='store_true',
+        default=False,
+        help='Price and volume are stored in yearly bucket documents'
+    )
+
+    arg_options = parser.parse_args()
+    if arg_options.command == 'run' \
+            and not arg_options.update_pricevolume \
+            and not arg_options.update_income_statements:
+        run_parser.error('one of --prices or --income is required')
+    return arg_options
+
+
+def explain(arg_options):
+    db_manage = DBManage(pricevolume_buckets=arg_options.use_buckets)
+    warning_count = 0
+    for [name, collection_name, stages, index_names, is_covered] \
+            in db_manage.explain_hot_queries(arg_options.ticker):
+        plan = ' <- '.join(stages)
+        if index_names:
+            plan += f', index: {", ".join(index_names)}'
+        if is_covered:
+            plan += ', covered'
+        print(f'{name} ({collection_name}): {plan}')
+        if 'COLLSCAN' in stages:
+            warning_count += 1
+            print(f'## Warning: {name} scans the whole {collection_name} '
+                  'collection, run an update to create its indexes')
+        elif name == 'watermarks' and not is_covered:
+            warning_count += 1
+            print('## Warning: watermarks are read from the documents '
+                  'instead of the ticker_watermarks index')
+
+    print(f'{warning_count} queries need attention')
+
+
+def export(arg_options):
+    # pyarrow is only needed here
+    from stock_exporter import StockExporter
+
+    db_manage = DBManage(pricevolume_buckets=arg_options.use_buckets)
+    db_manage.ensure_schema()
+    [day_count, season_count] = StockExporter(
+        db_manage, arg_options.export_path,
+        file_format=arg_options.export_format,
+        pricevolume_buckets=arg_options.use_buckets,
+        workers=arg_options.workers,
+        batch_size=arg_options.export_batch_size
+    ).export(full=arg_options.export_full)
+    print(f'Export completed, {day_count} days, {season_count} seasons')
+
+
+arg_options = arg_parse()
+if arg_options.command == 'explain':
+    explain(arg_options)
+elif arg_options.command == 'export':
+    export(arg_options)
+else:
+    job_types = []
+    if arg_options.update_pricevolume:
+        job_types.append('pricevolume')
+    if arg_options.update_income_statements:
+        job_types.append('income_statements')
+    UpdateRunner(arg_options, job_types).run()
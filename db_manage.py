@@ -1,67 +1,115 @@
 import json
+import math
+from datetime import datetime
+import threading
 import time
 from decimal import Decimal, ROUND_HALF_UP
+from typing import Union
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
 
-from dto import StockDTO
+from dto import StockDTO, StockRecords
+from metrics import metrics
 
 
 class DBManage:
     __CREDENTIAL_FILE_PATH = '.\dbCredential.config'
 
-    def __init__(self):
-        input_file = open(self.__CREDENTIAL_FILE_PATH)
-        self.__credential = json.load(input_file)
-        self.collection_name = self.__credential['collection_name']
-        self.__db_uri = self.__create_db_connection_url()
-        self.__db_instance = self.__connect_db(self.__db_uri)
+    # Summary fields kept on every ticker document so range planning does
+    # not need to load date_info / income_statements. Seasons are encoded
+    # as year * 10 + season, e.g. 20213 for 2021 Q3
+    __WATERMARK_FIELDS = ['first_date', 'last_date',
+                          'first_season', 'last_season']
+    # Collection name attribute -> [index fields, index name, is unique]
+    # of every index the update and read paths rely on
+    __INDEXES = {
+        'collection_name': [
+            [['ticker'], 'ticker', True],
+            [['ticker'] + __WATERMARK_FIELDS, 'ticker_watermarks', False]
+        ],
+        'bucket_collection_name': [
+            [['ticker', 'year'], 'ticker_year', True]
+        ],
+        'indicator_collection_name': [
+            [['ticker', 'year'], 'ticker_year', True]
+        ],
+        'work_queue_collection_name': [
+            [['run', 'ticker'], 'run_ticker', True],
+            [['run', 'status', 'lease_until'], 'run_status_lease', False],
+            [['claim_id'], 'claim_id', False]
+        ]
+    }
+    # Collection name attribute -> names of indexes no query uses any
+    # more, dropped so writes stop maintaining them
+    __DROPPED_INDEXES = {
+        'collection_name': ['date_range', 'season_range']
+    }
+    __SEASON_KEY_EXPRESSION = {
+        '$add': [{'$multiply': ['$$this.year', 10]}, '$$this.season']}
 
-    def insert_stock(self, dto: StockDTO):
-        collection = self.__db_instance[self.collection_name]
+    def __init__(self, pricevolume_buckets=False, credential=None,
+                 db_instance=None):
+        if credential is None:
+            input_file = open(self.__CREDENTIAL_FILE_PATH)
+            credential = json.load(input_file)
+        self.__credential = credential
+        self.collection_name = self.__credential['collection_name']
+        # Price and volume are stored one document per ticker per year in
+        # the bucket collection instead of the ticker's date_info array
+        self.bucket_collection_name = self.__credential.get(
+            'bucket_collection_name', f'{self.collection_name}_buckets')
+        # Derived series of each ticker, see IndicatorUpdater
+        self.indicator_collection_name = self.__credential.get(
+            'indicator_collection_name',
+            f'{self.collection_name}_indicators')
+        # Tickers shared out to crawler nodes, see WorkQueue
+        self.work_queue_collection_name = self.__credential.get(
+            'work_queue_collection_name',
+            f'{self.collection_name}_work_queue')
+        self.__pricevolume_buckets = pricevolume_buckets
+        # Records the get_*_operations methods compared against the stored
+        # ones, see get_write_counts
+        self.__write_counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        # ticker -> first_date / first_season of the records they wrote,
+        # see get_earliest_writes
+        self.__earliest_writes = {}
+        # ticker -> number of writes which changed its days, see
+        # get_write_version
+        self.__write_versions = {}
+        self.__write_counts_lock = threading.Lock()
+        if db_instance is not None:
+            self.__db_instance = db_instance
+        else:
+            self.__db_uri = self.__create_db_connection_url()
+            self.__db_instance = self.__connect_db(self.__db_uri)
 
+    def insert_stock(self, dto: Union[StockDTO, StockRecords]):
         print(f'Start insert ticker : {dto.ticker}')
         timer_start = time.time()
-        collection.insert_one(dto.dict())
+        with metrics.timer('db_write', ticker=dto.ticker):
+            self.execute(self.get_insert_stock_operations(dto))
         timer_end = time.time()
         pass_time = Decimal(timer_end - timer_start).quantize(
             Decimal('.1'), rounding=ROUND_HALF_UP)
         print(f'Insert {dto.ticker} completed ({pass_time} s)')
 
-    def update_pricevolume(self, dto: StockDTO):
-        collection = self.__db_instance[self.collection_name]
-
+    def update_pricevolume(self, dto: Union[StockDTO, StockRecords]):
         print(f'Start update ticker : {dto.ticker}')
         timer_start = time.time()
-        date_info_list = []
-        for date_info in dto.date_info:
-            date_info_list.append(date_info.dict())
-        collection.update_one(
-            {'ticker': dto.ticker},
-            {'$addToSet': {'date_info': {'$each': date_info_list}}},
-            upsert=True
-        )
+        with metrics.timer('db_write', ticker=dto.ticker):
+            self.execute(self.get_pricevolume_operations(dto))
 
         timer_end = time.time()
         pass_time = Decimal(timer_end - timer_start).quantize(
             Decimal('.1'), rounding=ROUND_HALF_UP)
         print(f'Update {dto.ticker} completed ({pass_time} s)')
 
-    def update_income_statements(self, dto: StockDTO):
-        collection = self.__db_instance[self.collection_name]
-
+    def update_income_statements(self, dto: Union[StockDTO, StockRecords]):
         print(f'Start update ticker : {dto.ticker}')
         timer_start = time.time()
-        income_statements = []
-        for income_statement in dto.income_statements:
-            income_statements.append(income_statement.dict())
-        collection.update_one(
-            {'ticker': dto.ticker},
-            {'$addToSet':
-                {'income_statements': {'$each': income_statements}}
-             },
-            upsert=True
-        )
+        with metrics.timer('db_write', ticker=dto.ticker):
+            self.execute(self.get_income_statements_operations(dto))
 
         timer_end = time.time()
         pass_time = Decimal(timer_end - timer_start).quantize(
@@ -69,20 +117,535 @@ class DBManage:
         print(f'Update {dto.ticker} income statements completed '
               f'({pass_time} s)')
 
+    # The get_*_operations methods return [collection name, operation]
+    # pairs. All of them are upserts keyed by ticker and date or season so
+    # they can be retried, or batched with other tickers by BulkWriter,
+    # without duplicating data. Records equal to the stored ones are left
+    # out, no operation is returned when nothing changed
+    def get_insert_stock_operations(self, dto: Union[StockDTO, StockRecords]):
+        document = dto.dict()
+        return self.__build_stock_operations(
+            dto.ticker, dto.stock_name,
+            date_info_list=document['date_info'],
+            income_statements=document['income_statements'])
+
+    def get_pricevolume_operations(self, dto: Union[StockDTO, StockRecords]):
+        return self.__build_stock_operations(
+            dto.ticker, dto.stock_name,
+            date_info_list=dto.dict()['date_info'])
+
+    def get_income_statements_operations(
+            self, dto: Union[StockDTO, StockRecords]):
+        return self.__build_stock_operations(
+            dto.ticker, dto.stock_name,
+            income_statements=dto.dict()['income_statements'])
+
+    def get_write_counts(self):
+        # Records inserted, updated and left unchanged so far
+        with self.__write_counts_lock:
+            return dict(self.__write_counts)
+
+    def get_earliest_writes(self):
+        # ticker -> {'first_date', 'first_season'} of the earliest new or
+        # changed day and season get_*_operations wrote so far, so derived
+        # data can be computed again from there
+        with self.__write_counts_lock:
+            return {ticker: dict(earliest_write)
+                    for ticker, earliest_write
+                    in self.__earliest_writes.items()}
+
+    def get_write_version(self, ticker):
+        # Changes whenever get_*_operations writes new or changed days of
+        # ticker, so readers can tell their cached days are stale
+        with self.__write_counts_lock:
+            return self.__write_versions.get(ticker, 0)
+
+    def ensure_watermarks(self):
+        collection = self.__db_instance[self.collection_name]
+
+        # Backfill documents written before the summary fields existed,
+        # computed on the server so no array leaves the database
+        collection.update_many(
+            {'first_date': {'$exists': False},
+             'date_info.0': {'$exists': True}},
+            [{'$set': {
+                'first_date': {'$min': '$date_info.date'},
+                'last_date': {'$max': '$date_info.date'}
+            }}]
+        )
+        encoded_seasons = {'$map': {
+            'input': '$income_statements',
+            'in': {'$add': [{'$multiply': ['$$this.year', 10]},
+                            '$$this.season']}
+        }}
+        collection.update_many(
+            {'first_season': {'$exists': False},
+             'income_statements.0': {'$exists': True}},
+            [{'$set': {
+                'first_season': {'$min': encoded_seasons},
+                'last_season': {'$max': encoded_seasons}
+            }}]
+        )
+
+        self.__ensure_indexes('collection_name')
+
+    def get_watermarks(self):
+        collection = self.__db_instance[self.collection_name]
+
+        projection = {field: 1 for field in self.__WATERMARK_FIELDS}
+        projection.update({'ticker': 1, '_id': 0})
+        watermarks = {}
+        with metrics.timer('db_read', query='watermarks'):
+            for document in collection.find({}, projection) \
+                    .hint('ticker_watermarks'):
+                watermarks.update({document['ticker']: document})
+
+        return watermarks
+
+    def ensure_pricevolume_buckets(self):
+        self.__ensure_indexes('bucket_collection_name')
+
+    def ensure_indicators(self):
+        self.__ensure_indexes('indicator_collection_name')
+
+    def ensure_work_queue(self):
+        self.__ensure_indexes('work_queue_collection_name')
+
+    def ensure_schema(self):
+        # Run at startup: watermarks and the indexes of every collection in
+        # use, the bucket collection once pricevolume_buckets is set
+        self.ensure_watermarks()
+        collection_names = self.__db_instance.list_collection_names()
+        if self.__pricevolume_buckets \
+                or self.bucket_collection_name in collection_names:
+            self.ensure_pricevolume_buckets()
+        if self.indicator_collection_name in collection_names:
+            self.ensure_indicators()
+        if self.work_queue_collection_name in collection_names:
+            self.ensure_work_queue()
+
+    def explain_hot_queries(self, ticker=None):
+        # [query name, collection name, winning plan stages, index names,
+        # is covered] of the queries the update and read paths run for
+        # every ticker, on the collections which exist
+        collection_names = self.__db_instance.list_collection_names()
+        collection = self.__db_instance[self.collection_name]
+        if ticker is None:
+            document = collection.find_one({}, {'ticker': 1, '_id': 0})
+            ticker = document['ticker'] if document else '2330'
+
+        watermark_projection = {field: 1 for field in self.__WATERMARK_FIELDS}
+        watermark_projection.update({'ticker': 1, '_id': 0})
+        queries = [
+            ['watermarks', self.collection_name,
+             collection.find({}, watermark_projection)
+             .hint('ticker_watermarks').explain()
+             if 'ticker_watermarks' in collection.index_information()
+             else collection.find({}, watermark_projection).explain()],
+            ['ticker', self.collection_name,
+             collection.find({'ticker': ticker}).explain()],
+            ['stored records', self.collection_name,
+             self.__db_instance.command(
+                 'aggregate', self.collection_name,
+                 pipeline=[{'$match': {'ticker': {'$in': [ticker]}}}],
+                 explain=True)]
+        ]
+        if self.bucket_collection_name in collection_names:
+            queries.append([
+                'price buckets', self.bucket_collection_name,
+                self.__db_instance[self.bucket_collection_name].find(
+                    {'ticker': ticker, 'year': {'$gte': 2011, '$lte': 2021}})
+                .explain()])
+        if self.indicator_collection_name in collection_names:
+            queries.append([
+                'indicators', self.indicator_collection_name,
+                self.__db_instance[self.indicator_collection_name].find(
+                    {'ticker': ticker, 'year': {'$gte': 2011, '$lte': 2021}})
+                .explain()])
+        if self.work_queue_collection_name in collection_names:
+            work_queue = self.__db_instance[self.work_queue_collection_name]
+            queries.extend([
+                ['work queue claim', self.work_queue_collection_name,
+                 work_queue.find(
+                     {'run': '', '$or': [
+                         {'status': 'pending'},
+                         {'status': 'leased',
+                          'lease_until': {'$lt': datetime.utcnow()}}]},
+                     {'_id': 1}).explain()],
+                ['work queue claimed', self.work_queue_collection_name,
+                 work_queue.find({'claim_id': ''}).explain()]
+            ])
+
+        plans = []
+        for [name, collection_name, explain] in queries:
+            [stages, index_names] = self.__get_winning_plan(explain)
+            plans.append([name, collection_name, stages, index_names,
+                          'FETCH' not in stages
+                          and 'COLLSCAN' not in stages])
+
+        return plans
+
+    def write_pricevolume_buckets(self, ticker, date_info_list):
+        self.execute(
+            self.__build_bucket_operations(ticker, date_info_list))
+
+    def get_pricevolume(self, ticker, start_date, end_date):
+        bucket_collection = self.__db_instance[self.bucket_collection_name]
+
+        date_info_list = []
+        with metrics.timer('db_read', ticker=ticker):
+            buckets = list(bucket_collection.find(
+                {'ticker': ticker,
+                 'year': {'$gte': int(start_date[:4]),
+                          '$lte': int(end_date[:4])}},
+                {'days': 1, '_id': 0}))
+        for bucket in buckets:
+            for date, day in bucket['days'].items():
+                if date < start_date or date > end_date:
+                    continue
+                date_info = {'date': date}
+                date_info.update(day)
+                date_info_list.append(date_info)
+
+        date_info_list.sort(key=lambda x: x['date'])
+        return date_info_list
+
     def create_index_for_collection(self, collection,
                                     index_fields, index_name,
-                                    is_accending=True):
+                                    is_accending=True, is_unique=False):
         index_to_add = []
         for field in index_fields:
             index_to_add.append((field, 1 if is_accending else -1))
 
         self.__db_instance[collection] \
-            .create_index(index_to_add, name=index_name)
+            .create_index(index_to_add, name=index_name, unique=is_unique)
+
+    def create_async_db_instance(self):
+        # Motor is only needed by the asyncio updaters
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        if 'certificate_file_path' not in self.__credential:
+            return AsyncIOMotorClient(self.__create_db_connection_url())[
+                self.__credential['db_name']]
+
+        client = AsyncIOMotorClient(
+            self.__create_db_connection_url(), tls=True,
+            tlsCertificateKeyFile=self.__credential['certificate_file_path'])
+        return client[self.__credential['db_name']]
+
+    def execute(self, operations):
+        # Writes [collection name, operation] pairs of get_*_operations
+        grouped_operations = {}
+        for [collection_name, operation] in operations:
+            grouped_operations.setdefault(collection_name, []) \
+                .append(operation)
+
+        for collection_name, collection_operations \
+                in grouped_operations.items():
+            self.__db_instance[collection_name].bulk_write(
+                collection_operations, ordered=False)
 
     def get_collection(self, collection):
         return self.__db_instance[collection]
 
+    def __ensure_indexes(self, collection_attribute):
+        collection_name = getattr(self, collection_attribute)
+        index_names = self.__db_instance[collection_name].index_information()
+        for index_name in self.__DROPPED_INDEXES.get(collection_attribute, []):
+            if index_name in index_names:
+                self.__db_instance[collection_name].drop_index(index_name)
+
+        for [index_fields, index_name, is_unique] \
+                in self.__INDEXES[collection_attribute]:
+            try:
+                self.create_index_for_collection(
+                    collection_name, index_fields, index_name,
+                    is_unique=is_unique)
+            except OperationFailure as e:
+                # 11000: documents written before the unique index existed
+                # share a key
+                if e.code != 11000:
+                    raise
+                duplicates = self.__db_instance[collection_name].aggregate([
+                    {'$group': {
+                        '_id': {field: f'${field}' for field in index_fields},
+                        'count': {'$sum': 1}}},
+                    {'$match': {'count': {'$gt': 1}}},
+                    {'$limit': 10}
+                ])
+                keys = [str(duplicate['_id']) for duplicate in duplicates]
+                raise Exception(
+                    f'{collection_name} has more than one document for '
+                    f'{", ".join(keys)}, merge them before index '
+                    f'{index_name} can be created')
+
+    def __get_winning_plan(self, explain):
+        # [stage names, index names] of every winning plan in an explain
+        # output, find and aggregate outputs nest them differently
+        stages = []
+        index_names = []
+        plans = []
+        nodes = [explain]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, list):
+                nodes.extend(node)
+            elif isinstance(node, dict):
+                for key, value in node.items():
+                    if key == 'winningPlan':
+                        plans.append(value)
+                    elif key != 'rejectedPlans':
+                        nodes.append(value)
+
+        while plans:
+            plan = plans.pop()
+            if isinstance(plan, list):
+                plans.extend(plan)
+            elif isinstance(plan, dict):
+                if 'stage' in plan:
+                    stages.append(plan['stage'])
+                if 'indexName' in plan:
+                    index_names.append(plan['indexName'])
+                plans.extend(value for key, value in plan.items()
+                             if key in ['inputStage', 'inputStages',
+                                        'queryPlan', 'shards', 'winningPlan'])
+
+        return [stages, index_names]
+
+    def __build_stock_operations(self, ticker, stock_name,
+                                 date_info_list=None,
+                                 income_statements=None):
+        # Only the records which are new or changed are written, each
+        # replacing every stored record of its date or season, so a revised
+        # day or float noise on the overlapping day never adds a duplicate
+        [is_stored, stored_days, stored_seasons] = self.__get_stored_records(
+            ticker, date_info_list, income_statements)
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        operations = []
+        fields = {'stock_name': {'$ifNull': ['$stock_name', stock_name]}}
+        watermarks = {}
+
+        if date_info_list is not None:
+            date_info_list = self.__get_changed_records(
+                date_info_list, stored_days,
+                lambda date_info: date_info['date'], counts)
+            watermarks.update(self.__get_date_watermarks(date_info_list))
+            if self.__pricevolume_buckets:
+                operations.extend(
+                    self.__build_bucket_operations(ticker, date_info_list))
+                fields.update({'date_info': {'$ifNull': ['$date_info', []]}})
+            elif len(date_info_list) > 0:
+                fields.update({'date_info': self.__build_replace_records(
+                    '$date_info', '$$this.date',
+                    [date_info['date'] for date_info in date_info_list],
+                    date_info_list)})
+        if income_statements is not None:
+            income_statements = self.__get_changed_records(
+                income_statements, stored_seasons, self.__get_season_key,
+                counts)
+            watermarks.update(self.__get_season_watermarks(income_statements))
+            if len(income_statements) > 0:
+                fields.update({
+                    'income_statements': self.__build_replace_records(
+                        '$income_statements', self.__SEASON_KEY_EXPRESSION,
+                        [self.__get_season_key(income_statement)
+                         for income_statement in income_statements],
+                        income_statements)})
+        self.__record_counts(ticker, counts, watermarks)
+
+        if is_stored and not watermarks:
+            return operations
+
+        fields.update(self.__build_watermark_fields(watermarks))
+        operations.append([
+            self.collection_name,
+            UpdateOne({'ticker': ticker}, [{'$set': fields}], upsert=True)
+        ])
+        return operations
+
+    def __get_stored_records(self, ticker, date_info_list,
+                             income_statements):
+        # [is the ticker stored, date -> stored days, year * 10 + season ->
+        # stored income statements] of the records about to be written.
+        # Days and seasons are filtered on the server
+        projection = {'_id': 0, 'ticker': 1}
+        if date_info_list and not self.__pricevolume_buckets:
+            projection.update({'date_info': self.__build_filter_records(
+                '$date_info', '$$this.date',
+                [date_info['date'] for date_info in date_info_list])})
+        if income_statements:
+            projection.update({
+                'income_statements': self.__build_filter_records(
+                    '$income_statements', self.__SEASON_KEY_EXPRESSION,
+                    [self.__get_season_key(income_statement)
+                     for income_statement in income_statements])})
+
+        collection = self.__db_instance[self.collection_name]
+        with metrics.timer('db_read', ticker=ticker):
+            documents = list(collection.aggregate([
+                {'$match': {'ticker': ticker}}, {'$project': projection}]))
+            document = documents[0] if documents else {}
+            stored_date_info_list = document.get('date_info') or []
+            if date_info_list and self.__pricevolume_buckets:
+                stored_date_info_list = self.__get_stored_bucket_days(
+                    ticker, date_info_list)
+
+        stored_days = {}
+        for date_info in stored_date_info_list:
+            stored_days.setdefault(date_info['date'], []).append(date_info)
+        stored_seasons = {}
+        for income_statement in document.get('income_statements') or []:
+            stored_seasons.setdefault(
+                self.__get_season_key(income_statement), []) \
+                .append(income_statement)
+
+        return [len(documents) > 0, stored_days, stored_seasons]
+
+    def __get_stored_bucket_days(self, ticker, date_info_list):
+        bucket_collection = self.__db_instance[self.bucket_collection_name]
+        dates = [date_info['date'] for date_info in date_info_list]
+        projection = {f'days.{date}': 1 for date in dates}
+        projection.update({'_id': 0})
+
+        stored_date_info_list = []
+        for bucket in bucket_collection.find(
+                {'ticker': ticker,
+                 'year': {'$in': sorted({int(date[:4]) for date in dates})}},
+                projection):
+            for date, day in bucket.get('days', {}).items():
+                date_info = {'date': date}
+                date_info.update(day)
+                stored_date_info_list.append(date_info)
+
+        return stored_date_info_list
+
+    def __get_changed_records(self, records, stored_records, get_key,
+                              counts):
+        # A key stored more than once is written again so its duplicates
+        # are dropped
+        changed_records = {}
+        for record in records:
+            key = get_key(record)
+            stored = stored_records.get(key, [])
+            if len(stored) == 1 and self.__is_same_record(stored[0], record):
+                counts['unchanged'] += 1
+                continue
+            counts['updated' if stored else 'inserted'] += 1
+            stored_records.update({key: [record]})
+            changed_records.update({key: record})
+
+        return list(changed_records.values())
+
+    def __is_same_record(self, stored_record, record):
+        if stored_record.keys() != record.keys():
+            return False
+
+        for field, value in record.items():
+            stored_value = stored_record[field]
+            if isinstance(value, float) \
+                    and isinstance(stored_value, (int, float)):
+                # NaN is never close to itself, a stored NaN is unchanged
+                if math.isnan(value) and math.isnan(stored_value):
+                    continue
+                if not math.isclose(value, stored_value,
+                                    rel_tol=1e-9, abs_tol=1e-9):
+                    return False
+            elif value != stored_value:
+                return False
+
+        return True
+
+    def __get_season_key(self, income_statement):
+        return income_statement['year'] * 10 + income_statement['season']
+
+    def __build_filter_records(self, field, key_expression, keys):
+        return {'$filter': {
+            'input': {'$ifNull': [field, []]},
+            'cond': {'$in': [key_expression, keys]}
+        }}
+
+    def __build_replace_records(self, field, key_expression, keys, records):
+        return {'$concatArrays': [
+            {'$filter': {
+                'input': {'$ifNull': [field, []]},
+                'cond': {'$not': {'$in': [key_expression, keys]}}
+            }},
+            {'$literal': records}
+        ]}
+
+    def __record_counts(self, ticker, counts, watermarks):
+        with self.__write_counts_lock:
+            for name, value in counts.items():
+                self.__write_counts[name] += value
+            if 'first_date' in watermarks:
+                self.__write_versions.update(
+                    {ticker: self.__write_versions.get(ticker, 0) + 1})
+            for field in ['first_date', 'first_season']:
+                if field not in watermarks:
+                    continue
+                earliest_write = self.__earliest_writes.setdefault(
+                    ticker, {})
+                earliest_write.update({field: min(
+                    watermarks[field],
+                    earliest_write.get(field, watermarks[field]))})
+        for name, value in counts.items():
+            metrics.increment(f'records_{name}', value, ticker=ticker)
+
+    def __build_bucket_operations(self, ticker, date_info_list):
+        # Days are keyed by date inside each bucket, so a write is a $set
+        # on a few keys instead of a compare against the whole history
+        buckets = {}
+        for date_info in date_info_list:
+            day = dict(date_info)
+            date = day.pop('date')
+            buckets.setdefault(int(date[:4]), {}) \
+                .update({f'days.{date}': day})
+
+        operations = []
+        for year, days in buckets.items():
+            dates = [key[len('days.'):] for key in days]
+            operations.append([
+                self.bucket_collection_name,
+                UpdateOne(
+                    {'ticker': ticker, 'year': year},
+                    {'$set': days,
+                     '$min': {'first_date': min(dates)},
+                     '$max': {'last_date': max(dates)}},
+                    upsert=True
+                )
+            ])
+        return operations
+
+    def __get_date_watermarks(self, date_info_list):
+        if len(date_info_list) <= 0:
+            return {}
+
+        dates = [date_info['date'] for date_info in date_info_list]
+        return {'first_date': min(dates), 'last_date': max(dates)}
+
+    def __get_season_watermarks(self, income_statements):
+        if len(income_statements) <= 0:
+            return {}
+
+        seasons = [income_statement['year'] * 10 + income_statement['season']
+                   for income_statement in income_statements]
+        return {'first_season': min(seasons), 'last_season': max(seasons)}
+
+    def __build_watermark_fields(self, watermarks):
+        # Set in the same update as the data so the summary fields never
+        # disagree with the arrays, $min / $max ignore a missing field
+        fields = {}
+        for field, value in watermarks.items():
+            operator = '$min' if field.startswith('first_') else '$max'
+            fields.update({field: {operator: [f'${field}', value]}})
+
+        return fields
+
     def __create_db_connection_url(self):
+        # A plain uri, e.g. of a local mongod, instead of the Atlas cluster
+        if 'uri' in self.__credential:
+            return self.__credential['uri']
+
         uri = f'mongodb+srv://{self.__credential["cluster_name"]}' \
               f'.1kypv.gcp.mongodb.net/{self.__credential["db_name"]}' \
             '?authSource=%24external&authMechanism=MONGODB-X509&' \
@@ -90,6 +653,9 @@ class DBManage:
         return uri
 
     def __connect_db(self, uri):
+        if 'certificate_file_path' not in self.__credential:
+            return MongoClient(uri)[self.__credential['db_name']]
+
         client = MongoClient(
             uri, tls=True,
             tlsCertificateKeyFile=f'{self.__credential["certificate_file_path"]}'
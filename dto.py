@@ -63,3 +63,91 @@ class FinMindFinancialStatementsDTO(BaseModel):
     type: Optional[str]
     value: Optional[float]
     origin_name: Optional[str]
+
+
+class IncomeStatementRecord:
+    __slots__ = ('year', 'season', 'revenue', 'cost', 'gp', 'oe', 'oi',
+                 'nie', 'btax', 'ni', 'eps')
+
+    def __init__(self, year=None, season=None):
+        self.year = year
+        self.season = season
+        self.revenue = None
+        self.cost = None
+        self.gp = None
+        self.oe = None
+        self.oi = None
+        self.nie = 0
+        self.btax = None
+        self.ni = None
+        self.eps = None
+
+    def dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class StockRecords:
+    # Hot path counterpart of StockDTO, date_info holds Mongo ready dicts
+    # and income_statements holds IncomeStatementRecord, both are only
+    # validated once per batch when dict() is called
+    __slots__ = ('ticker', 'stock_name', 'date_info', 'income_statements')
+
+    __DATE_INFO_TYPES = {
+        'date': str,
+        'open': float,
+        'close': float,
+        'high': float,
+        'low': float,
+        'volume': int
+    }
+    __INCOME_STATEMENT_TYPES = {
+        'year': int,
+        'season': int,
+        'revenue': int,
+        'cost': int,
+        'gp': int,
+        'oe': int,
+        'oi': int,
+        'nie': int,
+        'btax': int,
+        'ni': int,
+        'eps': float
+    }
+
+    def __init__(self, ticker, stock_name, date_info=None,
+                 income_statements=None):
+        self.ticker = ticker
+        self.stock_name = stock_name
+        self.date_info = date_info if date_info is not None else []
+        self.income_statements = income_statements \
+            if income_statements is not None else []
+
+    def dict(self):
+        if not isinstance(self.ticker, str) \
+                or not isinstance(self.stock_name, str):
+            raise ValueError(f'Invalid ticker {self.ticker}')
+
+        income_statements = [
+            income_statement.dict()
+            for income_statement in self.income_statements]
+        self.__validate_batch(self.date_info, self.__DATE_INFO_TYPES)
+        self.__validate_batch(
+            income_statements, self.__INCOME_STATEMENT_TYPES)
+
+        return {
+            'ticker': self.ticker,
+            'stock_name': self.stock_name,
+            'date_info': self.date_info,
+            'income_statements': income_statements
+        }
+
+    def __validate_batch(self, records, field_types):
+        for record in records:
+            if record.keys() != field_types.keys():
+                raise ValueError(
+                    f'Ticker {self.ticker} has invalid record: {record}')
+            for field, value in record.items():
+                if value is not None \
+                        and not isinstance(value, field_types[field]):
+                    raise ValueError(
+                        f'Ticker {self.ticker} has invalid {field}: {value}')
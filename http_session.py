@@ -0,0 +1,71 @@
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+
+
+class HttpSession:
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 connect_timeout=5, read_timeout=30,
+                 max_retries=3, backoff_factor=1, url_rewrites=None):
+        self.__timeout = (connect_timeout, read_timeout)
+        # Map of original host prefix (e.g. "https://api.finmindtrade.com")
+        # to the one requests should be sent to, used to point the crawler
+        # at a local stub server
+        self.__url_rewrites = url_rewrites or {}
+
+        # Only connection errors are retried here, 429 and 5xx responses
+        # are returned so the provider's throttle sees every one of them
+        # and schedules the retry, see StockCrawler
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            allowed_methods=['GET'],
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        # One connection pool per host, connections are kept alive and
+        # reused between requests to the same host
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry
+        )
+
+        self.__session = requests.Session()
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+
+    def get(self, url, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.__timeout)
+        response = self.__session.get(
+            self.__rewrite_url(url), headers=headers, **kwargs)
+
+        host = urlsplit(url).netloc
+        metrics.increment('http_requests', host=host,
+                          status=response.status_code)
+        metrics.increment('http_bytes', len(response.content), host=host)
+        # urllib3 keeps the retries it made for this response
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and len(retries.history) > 0:
+            metrics.increment('http_retries', len(retries.history),
+                              host=host)
+        return response
+
+    def close(self):
+        self.__session.close()
+
+    def __rewrite_url(self, url):
+        split_url = urlsplit(url)
+        origin = f'{split_url.scheme}://{split_url.netloc}'
+        if origin not in self.__url_rewrites:
+            return url
+
+        return self.__url_rewrites[origin] + url[len(origin):]
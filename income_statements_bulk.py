@@ -0,0 +1,109 @@
+from functools import partial
+import time
+
+from bulk_writer import BulkWriter
+from dto import StockRecords
+from metrics import metrics
+from rate_limiter import ProviderUnavailable
+
+
+class IncomeStatementsBulkUpdater:
+    __MAX_ATTEMPTS = 3
+
+    def __init__(self, stock_crawler, db_manage, bulk_writer=None,
+                 checkpoint=None):
+        self.__stock_crawler = stock_crawler
+        self.__db_manage = db_manage
+        self.__bulk_writer = bulk_writer
+        self.__checkpoint = checkpoint
+
+    def update(self, season_ranges, watermarks):
+        # season_ranges is ticker -> [start_year, start_season, end_year,
+        # end_season], the same ranges get_income_statements_dto takes
+        ticker_dates = {
+            ticker: set(self.__stock_crawler.get_income_statement_dates(
+                *season_range))
+            for ticker, season_range in season_ranges.items()
+        }
+        statement_dates = sorted(
+            set(date for dates in ticker_dates.values() for date in dates))
+
+        income_statements = {ticker: [] for ticker in season_ranges}
+        for [date, stock_dtos] in self.__iter_income_statements_dtos(
+                statement_dates):
+            for ticker, stock_dto in stock_dtos.items():
+                if ticker in ticker_dates and date in ticker_dates[ticker]:
+                    income_statements[ticker].extend(
+                        stock_dto.income_statements)
+
+        bulk_writer = self.__bulk_writer if self.__bulk_writer \
+            else BulkWriter(self.__db_manage)
+        for ticker, ticker_income_statements in income_statements.items():
+            if len(ticker_income_statements) <= 0:
+                # Nothing reported in the range yet
+                if self.__checkpoint:
+                    self.__checkpoint.record(ticker)
+                continue
+
+            # Parked dates may have been fetched after later ones
+            ticker_income_statements.sort(
+                key=lambda income_statement: [income_statement.year,
+                                              income_statement.season])
+            dto = StockRecords(
+                ticker=ticker,
+                stock_name=self.__stock_crawler.stocks_list[ticker]
+                .stock_name,
+                income_statements=ticker_income_statements
+            )
+            bulk_writer.add(
+                ticker,
+                self.__db_manage.get_income_statements_operations(dto)
+                if watermarks.get(ticker)
+                else self.__db_manage.get_insert_stock_operations(dto),
+                on_complete=partial(self.__checkpoint.record, ticker)
+                if self.__checkpoint else None)
+
+        if bulk_writer is not self.__bulk_writer:
+            bulk_writer.close()
+            # With a checkpoint failed tickers are in its dead letters
+            if bulk_writer.failed_tickers and not self.__checkpoint:
+                raise Exception('Write failed for tickers: '
+                                f'{", ".join(bulk_writer.failed_tickers)}')
+
+    def __iter_income_statements_dtos(self, dates):
+        # [date, ticker -> StockRecords] of every date. A date of a parked
+        # provider is put back until it is expected to be back and the
+        # other dates go on, the thread only waits when every date left is
+        # parked
+        # date -> [attempt, monotonic time it can be fetched again]
+        pending_dates = {date: [0, 0] for date in dates}
+        while len(pending_dates) > 0:
+            now = time.monotonic()
+            ready_dates = [date for date, [_, ready_at]
+                           in pending_dates.items() if ready_at <= now]
+            if len(ready_dates) <= 0:
+                time.sleep(min(ready_at for [_, ready_at]
+                               in pending_dates.values()) - now)
+                continue
+
+            for date in ready_dates:
+                print(f'Fetch income statements of {date}')
+                try:
+                    stock_dtos = self.__stock_crawler \
+                        .get_income_statements_dtos_by_date(date)
+                except ProviderUnavailable as e:
+                    print(e)
+                    pending_dates[date][1] = time.monotonic() \
+                        + e.wait_seconds
+                    continue
+                except Exception as e:
+                    print(f'Error: {e}')
+                    print(f'Date {date} retry')
+                    metrics.increment('date_retries', date=date)
+                    pending_dates[date][0] += 1
+                    if pending_dates[date][0] >= self.__MAX_ATTEMPTS:
+                        raise Exception('Retried 3 times still fail')
+                    continue
+
+                del pending_dates[date]
+                yield [date, stock_dtos]
@@ -0,0 +1,331 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pymongo import UpdateOne
+
+from metrics import metrics
+from stock_reader import StockReader
+
+
+class IndicatorUpdater:
+    # Derived series of each ticker, kept up to date after an update run.
+    # Only the days and seasons after the ones already computed are
+    # processed: the tail of history the windows still need is kept on the
+    # ticker document as rolling state, next to the latest values. Values
+    # of every day and season go to yearly bucket documents of the
+    # indicator collection
+    __MOVING_AVERAGE_WINDOWS = [5, 20, 60]
+    __VOLATILITY_WINDOW = 20
+    __TRADING_DAYS_PER_YEAR = 252
+    __TTM_SEASONS = 4
+    __FIRST_DATE = '1900-01-01'
+    __LAST_DATE = '9999-12-31'
+
+    def __init__(self, db_manage, pricevolume_buckets=False, batch_size=200):
+        self.__db_manage = db_manage
+        self.__batch_size = batch_size
+        self.__stock_reader = StockReader(
+            db_manage, pricevolume_buckets=pricevolume_buckets,
+            batch_size=batch_size, cache_max_bytes=0)
+        # Closes the windows need from before the new days, one more than
+        # the volatility window for its first return
+        self.__price_tail_length = max(
+            max(self.__MOVING_AVERAGE_WINDOWS), self.__VOLATILITY_WINDOW + 1)
+
+    def ensure_indicators(self):
+        self.__db_manage.ensure_indicators()
+
+    def update_pricevolume(self, tickers, earliest_writes=None):
+        # earliest_writes is DBManage.get_earliest_writes() of the run, days
+        # already computed are computed again from the first one written
+        earliest_writes = earliest_writes or {}
+        for i in range(0, len(tickers), self.__batch_size):
+            batch = tickers[i:i + self.__batch_size]
+            states = self.__get_states(batch, ['first_date'])
+
+            # Tickers are read together when they continue from the same
+            # day, which is all of them after a daily run
+            start_dates = {}
+            rewind_dates = {}
+            for ticker, [document, state] in states.items():
+                first_written_date = earliest_writes.get(ticker, {}) \
+                    .get('first_date')
+                # Older days were written since, compute them all again
+                if state.get('first_date') and document.get('first_date') \
+                        and document['first_date'] < state['first_date']:
+                    state.update({'first_date': None, 'last_date': None,
+                                  'closes': []})
+                elif first_written_date and state.get('last_date') \
+                        and first_written_date <= state['last_date']:
+                    rewind_dates.update({ticker: first_written_date})
+
+                if ticker in rewind_dates:
+                    start_date = self.__get_rewind_start_date(
+                        rewind_dates[ticker])
+                elif state.get('last_date'):
+                    start_date = self.__get_next_date(state['last_date'])
+                else:
+                    start_date = self.__FIRST_DATE
+                start_dates.setdefault(start_date, []).append(ticker)
+
+            operations = []
+            for start_date, start_date_tickers in start_dates.items():
+                prices = self.__stock_reader.get_prices(
+                    start_date_tickers, start_date, self.__LAST_DATE)
+                for ticker, columns in prices.items():
+                    state = states[ticker][1]
+                    if ticker in rewind_dates:
+                        [state, columns] = self.__rewind(
+                            ticker, states[ticker], columns, start_date,
+                            rewind_dates[ticker])
+                    if len(columns['date']) <= 0:
+                        continue
+                    operations.extend(self.__build_price_operations(
+                        ticker, state, columns))
+
+            self.__execute(operations)
+
+    def update_income_statements(self, tickers, earliest_writes=None):
+        # Same as update_pricevolume, all seasons are on the ticker document
+        # so they are all computed again when one already computed is
+        # written
+        earliest_writes = earliest_writes or {}
+        for i in range(0, len(tickers), self.__batch_size):
+            batch = tickers[i:i + self.__batch_size]
+            states = self.__get_states(
+                batch, ['first_season', 'income_statements'])
+
+            operations = []
+            for ticker, [document, state] in states.items():
+                first_written_season = earliest_writes.get(ticker, {}) \
+                    .get('first_season')
+                is_older_written = state.get('first_season') \
+                    and document.get('first_season') \
+                    and document['first_season'] < state['first_season']
+                is_computed_written = first_written_season \
+                    and state.get('last_season') \
+                    and first_written_season <= state['last_season']
+                if is_older_written or is_computed_written:
+                    state.update({'first_season': None, 'last_season': None,
+                                  'seasons': []})
+
+                last_season = state.get('last_season') or 0
+                income_statements = {
+                    (income_statement['year'], income_statement['season']):
+                    income_statement
+                    for income_statement in
+                    document.get('income_statements') or []
+                    if income_statement['year'] * 10
+                    + income_statement['season'] > last_season}
+                if len(income_statements) <= 0:
+                    continue
+                operations.extend(self.__build_season_operations(
+                    ticker, state,
+                    [income_statements[key]
+                     for key in sorted(income_statements)]))
+
+            self.__execute(operations)
+
+    def get_latest(self, tickers):
+        # ticker -> latest value of every indicator, without the rolling
+        # state
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.collection_name)
+        latest = {}
+        for document in collection.find(
+                {'ticker': {'$in': tickers}},
+                {'ticker': 1, 'indicators': 1, '_id': 0}):
+            indicators = dict(document.get('indicators', {}))
+            for field in ['first_date', 'closes', 'first_season', 'seasons']:
+                indicators.pop(field, None)
+            latest.update({document['ticker']: indicators})
+
+        return latest
+
+    def get_series(self, ticker, start_date, end_date):
+        # Daily indicators of a ticker sorted by date, both dates included
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.indicator_collection_name)
+        series = []
+        with metrics.timer('db_read', ticker=ticker):
+            for bucket in collection.find(
+                    {'ticker': ticker,
+                     'year': {'$gte': int(start_date[:4]),
+                              '$lte': int(end_date[:4])}},
+                    {'days': 1, '_id': 0}):
+                for date, day in bucket.get('days', {}).items():
+                    if start_date <= date <= end_date:
+                        day_indicators = {'date': date}
+                        day_indicators.update(day)
+                        series.append(day_indicators)
+
+        series.sort(key=lambda x: x['date'])
+        return series
+
+    def __get_states(self, tickers, fields):
+        # ticker -> [document, rolling state]
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.collection_name)
+        projection = {field: 1 for field in fields}
+        projection.update({'ticker': 1, 'indicators': 1, '_id': 0})
+
+        states = {}
+        with metrics.timer('db_read', query='indicators'):
+            for document in collection.find(
+                    {'ticker': {'$in': tickers}}, projection):
+                states.update({document['ticker']: [
+                    document, dict(document.get('indicators', {}))]})
+
+        return states
+
+    def __rewind(self, ticker, ticker_state, columns, start_date,
+                 rewind_date):
+        # [state, columns] to compute the days from rewind_date on, the
+        # closes before it replace the stored tail. Read again from the
+        # first day when the columns from start_date hold fewer closes than
+        # the windows need before rewind_date
+        [document, state] = ticker_state
+        split = np.searchsorted(columns['date'], np.datetime64(rewind_date))
+        if split < self.__price_tail_length \
+                and start_date > (document.get('first_date') or ''):
+            columns = self.__stock_reader.get_prices(
+                [ticker], self.__FIRST_DATE, self.__LAST_DATE)[ticker]
+            split = np.searchsorted(
+                columns['date'], np.datetime64(rewind_date))
+
+        state = dict(state)
+        state.update({'closes': columns['close'][:split][
+            -self.__price_tail_length:].tolist()})
+        return [state, {field: values[split:]
+                        for field, values in columns.items()}]
+
+    def __build_price_operations(self, ticker, state, columns):
+        closes = np.concatenate(
+            [np.array(state.get('closes') or [], dtype='float64'),
+             columns['close']])
+        new_count = len(columns['close'])
+
+        series = {}
+        for window in self.__MOVING_AVERAGE_WINDOWS:
+            moving_average = np.full(len(closes), np.nan)
+            if len(closes) >= window:
+                moving_average[window - 1:] = \
+                    sliding_window_view(closes, window).mean(axis=1)
+            series.update({f'ma_{window}': moving_average[-new_count:]})
+
+        # Annualized standard deviation of the daily log returns
+        volatility = np.full(len(closes), np.nan)
+        if len(closes) > self.__VOLATILITY_WINDOW:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns = np.log(closes[1:] / closes[:-1])
+            volatility[self.__VOLATILITY_WINDOW:] = sliding_window_view(
+                returns, self.__VOLATILITY_WINDOW).std(axis=1, ddof=1) \
+                * np.sqrt(self.__TRADING_DAYS_PER_YEAR)
+        series.update({f'volatility_{self.__VOLATILITY_WINDOW}':
+                       volatility[-new_count:]})
+
+        dates = np.datetime_as_string(columns['date']).tolist()
+        days = self.__build_days(series)
+        buckets = {}
+        for date, day in zip(dates, days):
+            buckets.setdefault(int(date[:4]), {}).update({f'days.{date}': day})
+
+        latest = {f'indicators.{field}': value
+                  for field, value in days[-1].items()}
+        latest.update({
+            'indicators.first_date': state.get('first_date') or dates[0],
+            'indicators.last_date': dates[-1],
+            'indicators.closes':
+                closes[-self.__price_tail_length:].tolist()
+        })
+        return self.__build_operations(ticker, buckets, latest)
+
+    def __build_season_operations(self, ticker, state, income_statements):
+        seasons = (state.get('seasons') or []) + [
+            [income_statement['year'], income_statement['season'],
+             income_statement.get('eps'), income_statement.get('revenue')]
+            for income_statement in income_statements]
+        [years, season_numbers, eps, revenue] = \
+            [np.array(values, dtype='float64') for values in zip(*seasons)]
+        new_count = len(income_statements)
+
+        # Sum of the last 4 seasons, only when they are consecutive
+        season_indexes = years * 4 + season_numbers
+        series = {}
+        for field, values in [['ttm_eps', eps], ['ttm_revenue', revenue]]:
+            ttm = np.full(len(values), np.nan)
+            if len(values) >= self.__TTM_SEASONS:
+                is_consecutive = season_indexes[self.__TTM_SEASONS - 1:] \
+                    - season_indexes[:1 - self.__TTM_SEASONS] \
+                    == self.__TTM_SEASONS - 1
+                ttm[self.__TTM_SEASONS - 1:] = np.where(
+                    is_consecutive,
+                    sliding_window_view(values, self.__TTM_SEASONS)
+                    .sum(axis=1), np.nan)
+            series.update({field: ttm[-new_count:]})
+        series.update({'ttm_eps': np.round(series['ttm_eps'], 2)})
+
+        days = self.__build_days(series)
+        days = [{field: int(value)
+                 if field == 'ttm_revenue' and value is not None else value
+                 for field, value in day.items()} for day in days]
+        buckets = {}
+        for income_statement, day in zip(income_statements, days):
+            buckets.setdefault(income_statement['year'], {}).update(
+                {f'seasons.{income_statement["season"]}': day})
+
+        last_season = income_statements[-1]['year'] * 10 \
+            + income_statements[-1]['season']
+        latest = {f'indicators.{field}': value
+                  for field, value in days[-1].items()}
+        latest.update({
+            'indicators.first_season': state.get('first_season')
+            or seasons[0][0] * 10 + seasons[0][1],
+            'indicators.last_season': last_season,
+            'indicators.seasons': seasons[1 - self.__TTM_SEASONS:]
+        })
+        return self.__build_operations(ticker, buckets, latest)
+
+    def __build_days(self, series):
+        # NumPy columns to one dict per day or season, NaN is stored as
+        # null
+        columns = {field: np.where(np.isnan(values), None, values).tolist()
+                   for field, values in series.items()}
+        return [dict(zip(columns.keys(), values))
+                for values in zip(*columns.values())]
+
+    def __build_operations(self, ticker, buckets, latest):
+        operations = [
+            [self.__db_manage.indicator_collection_name,
+             UpdateOne({'ticker': ticker, 'year': year}, {'$set': values},
+                       upsert=True)]
+            for year, values in buckets.items()]
+        operations.append([
+            self.__db_manage.collection_name,
+            UpdateOne({'ticker': ticker}, {'$set': latest})])
+        return operations
+
+    def __execute(self, operations):
+        # Buckets first, the state only moves on once they are written
+        for collection_name in [self.__db_manage.indicator_collection_name,
+                                self.__db_manage.collection_name]:
+            collection_operations = [
+                operation for [name, operation] in operations
+                if name == collection_name]
+            if len(collection_operations) <= 0:
+                continue
+            with metrics.timer('db_write', query='indicators'):
+                self.__db_manage.get_collection(collection_name).bulk_write(
+                    collection_operations, ordered=False)
+
+    def __get_rewind_start_date(self, date):
+        # About twice as many calendar days as the trading days the windows
+        # need before date
+        return (datetime.strptime(date, '%Y-%m-%d')
+                - timedelta(days=self.__price_tail_length * 2)) \
+            .strftime('%Y-%m-%d')
+
+    def __get_next_date(self, date):
+        return (datetime.strptime(date, '%Y-%m-%d')
+                + timedelta(days=1)).strftime('%Y-%m-%d')
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+from functools import partial
+import time
+
+from bulk_writer import BulkWriter
+from dto import StockRecords
+from rate_limiter import ProviderUnavailable
+
+
+class MarketSnapshotUpdater:
+    __DATE_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, stock_crawler, db_manage, bulk_writer=None,
+                 checkpoint=None):
+        self.__stock_crawler = stock_crawler
+        self.__db_manage = db_manage
+        self.__bulk_writer = bulk_writer
+        self.__checkpoint = checkpoint
+
+    def update(self, date_ranges):
+        # date_ranges is ticker -> [start_date, end_date], start_date is
+        # the last date already in db so only later days are written
+        if len(date_ranges) <= 0:
+            return
+
+        first_date = datetime.strptime(
+            min(start for [start, _] in date_ranges.values()),
+            self.__DATE_FORMAT) + timedelta(days=1)
+        last_date = datetime.strptime(
+            max(end for [_, end] in date_ranges.values()),
+            self.__DATE_FORMAT)
+
+        date_info = {ticker: [] for ticker in date_ranges}
+        cur_date = first_date
+        while cur_date <= last_date:
+            # Skip Saturday and Sunday, no market data on weekends
+            if cur_date.weekday() < 5:
+                date = cur_date.strftime(self.__DATE_FORMAT)
+                print(f'Fetch market snapshot of {date}')
+                snapshot = self.__get_market_snapshot(date)
+                for ticker, day in snapshot.items():
+                    if ticker not in date_ranges:
+                        continue
+                    [start_date, end_date] = date_ranges[ticker]
+                    if start_date < date <= end_date:
+                        date_info[ticker].append(day)
+            cur_date += timedelta(days=1)
+
+        # Every ticker gets the same few days, write them in bulk
+        bulk_writer = self.__bulk_writer if self.__bulk_writer \
+            else BulkWriter(self.__db_manage)
+        for ticker, date_info_list in date_info.items():
+            if len(date_info_list) <= 0:
+                # No trade in the range, nothing to write
+                if self.__checkpoint:
+                    self.__checkpoint.record(ticker)
+                continue
+
+            dto = StockRecords(
+                ticker=ticker,
+                stock_name=self.__stock_crawler.stocks_list[ticker]
+                .stock_name,
+                date_info=date_info_list
+            )
+            bulk_writer.add(
+                ticker, self.__db_manage.get_pricevolume_operations(dto),
+                on_complete=partial(self.__checkpoint.record, ticker)
+                if self.__checkpoint else None)
+
+        if bulk_writer is not self.__bulk_writer:
+            bulk_writer.close()
+            # With a checkpoint failed tickers are in its dead letters
+            if bulk_writer.failed_tickers and not self.__checkpoint:
+                raise Exception('Write failed for tickers: '
+                                f'{", ".join(bulk_writer.failed_tickers)}')
+
+    def __get_market_snapshot(self, date):
+        while True:
+            try:
+                return self.__stock_crawler.get_market_snapshot(date)
+            except ProviderUnavailable as e:
+                print(e)
+                time.sleep(e.wait_seconds)
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__enabled = False
+        self.__log_file = None
+        self.__prometheus_path = None
+        # name -> [count, total seconds, max seconds]
+        self.__timers = {}
+        # name -> value
+        self.__counters = {}
+
+    def configure(self, log_path=None, prometheus_path=None):
+        with self.__lock:
+            self.__enabled = True
+            self.__prometheus_path = prometheus_path
+            if log_path:
+                self.__log_file = open(log_path, 'a', encoding='utf-8')
+
+    @contextmanager
+    def timer(self, name, **labels):
+        if not self.__enabled:
+            yield
+            return
+
+        timer_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - timer_start,
+                             **labels)
+
+    def record_time(self, name, seconds, **labels):
+        if not self.__enabled:
+            return
+
+        with self.__lock:
+            timer = self.__timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            self.__log({'type': 'timer', 'name': name,
+                        'seconds': seconds, 'labels': labels})
+
+    def increment(self, name, value=1, **labels):
+        if not self.__enabled:
+            return
+
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+            self.__log({'type': 'counter', 'name': name,
+                        'value': value, 'labels': labels})
+
+    def get_summary(self):
+        with self.__lock:
+            return {
+                'timers': {name: {'count': count, 'seconds': total,
+                                  'max_seconds': max_seconds}
+                           for name, [count, total, max_seconds]
+                           in self.__timers.items()},
+                'counters': dict(self.__counters)
+            }
+
+    def close(self):
+        if not self.__enabled:
+            return
+
+        summary = self.get_summary()
+        self.__print_summary(summary)
+        if self.__prometheus_path:
+            self.__write_prometheus(summary)
+        with self.__lock:
+            if self.__log_file:
+                self.__log({'type': 'summary', 'summary': summary})
+                self.__log_file.close()
+                self.__log_file = None
+
+    def __log(self, event):
+        if not self.__log_file:
+            return
+
+        event.update({'ts': time.time()})
+        self.__log_file.write(json.dumps(event) + '\n')
+
+    def __print_summary(self, summary):
+        print('Run summary:')
+        for name, timer in sorted(summary['timers'].items()):
+            mean = timer['seconds'] / timer['count']
+            print(f'  {name:<20} {timer["count"]:>8} calls '
+                  f'{timer["seconds"]:>10.1f} s total '
+                  f'{mean * 1000:>8.1f} ms mean '
+                  f'{timer["max_seconds"] * 1000:>8.1f} ms max')
+        for name, value in sorted(summary['counters'].items()):
+            print(f'  {name:<20} {value:>8}')
+
+    def __write_prometheus(self, summary):
+        lines = []
+        for name, timer in sorted(summary['timers'].items()):
+            lines.append(f'stock_crawler_stage_seconds_total'
+                         f'{{stage="{name}"}} {timer["seconds"]}')
+            lines.append(f'stock_crawler_stage_calls_total'
+                         f'{{stage="{name}"}} {timer["count"]}')
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f'stock_crawler_{name}_total {value}')
+
+        # Node exporter may read the file at any time, replace it at once
+        temp_path = f'{self.__prometheus_path}.tmp'
+        with open(temp_path, 'w') as output_file:
+            output_file.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.__prometheus_path)
+
+
+metrics = Metrics()
@@ -0,0 +1,51 @@
+import argparse
+
+from db_manage import DBManage
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-t', '--tickers',
+        dest='tickers',
+        nargs='+',
+        help='Only migrate these tickers, migrate all tickers when not set'
+    )
+    parser.add_argument(
+        '-d', '--drop-source',
+        dest='drop_source',
+        action='store_true',
+        default=False,
+        help='Empty date_info of the ticker document once it is migrated'
+    )
+
+    return parser.parse_args()
+
+
+arg_options = arg_parse()
+db_manage = DBManage(pricevolume_buckets=True)
+
+# Watermarks are kept on the ticker document, make sure they are computed
+# from date_info before it can be dropped
+db_manage.ensure_schema()
+
+collection = db_manage.get_collection(db_manage.collection_name)
+query = {'ticker': {'$in': arg_options.tickers}} \
+    if arg_options.tickers else {}
+tickers = [document['ticker']
+           for document in collection.find(query, {'ticker': 1, '_id': 0})]
+
+for ticker in tickers:
+    document = collection.find_one(
+        {'ticker': ticker}, {'date_info': 1, '_id': 0})
+    date_info_list = document.get('date_info', [])
+    if len(date_info_list) <= 0:
+        continue
+
+    db_manage.write_pricevolume_buckets(ticker, date_info_list)
+    if arg_options.drop_source:
+        collection.update_one(
+            {'ticker': ticker}, {'$set': {'date_info': []}})
+    print(f'Migrate {ticker} completed ({len(date_info_list)} days)')
+
+print('All price volume migration completed')
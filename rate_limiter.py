@@ -0,0 +1,189 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import threading
+import time
+
+from metrics import metrics
+
+
+class ProviderUnavailable(Exception):
+    def __init__(self, provider, wait_seconds):
+        super().__init__(
+            f'{provider} is parked for another {wait_seconds:.0f} s')
+        self.provider = provider
+        self.wait_seconds = wait_seconds
+
+
+class RateLimiter:
+    # Token bucket. The rate is halved every time the provider throttles
+    # us and creeps back up to max_requests_per_second on each success
+    def __init__(self, max_requests_per_second, min_requests_per_second=None,
+                 burst=1, recovery_ratio=0.05):
+        self.__max_rate = max_requests_per_second
+        self.__min_rate = min_requests_per_second \
+            if min_requests_per_second else max_requests_per_second / 16
+        self.__rate = max_requests_per_second
+        self.__burst = burst
+        self.__recovery_step = max_requests_per_second * recovery_ratio
+        self.__tokens = burst
+        # Lies in the future while a Retry-After is being honored
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    @property
+    def requests_per_second(self):
+        return self.__rate
+
+    def acquire(self):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def reserve(self):
+        # Takes a token and returns the seconds to wait before using it,
+        # for callers which cannot block, e.g. on an event loop
+        with self.__lock:
+            now = time.monotonic()
+            self.__refill(now)
+            self.__tokens -= 1
+
+            wait_time = max(0, self.__updated_at - now)
+            if self.__tokens < 0:
+                wait_time += -self.__tokens / self.__rate
+            return wait_time
+
+    def on_success(self):
+        with self.__lock:
+            self.__rate = min(
+                self.__max_rate, self.__rate + self.__recovery_step)
+
+    def on_throttled(self, retry_after=None):
+        with self.__lock:
+            self.__rate = max(self.__min_rate, self.__rate / 2)
+            self.__delay(retry_after)
+
+    def on_unavailable(self, retry_after=None):
+        # A server error leaves the rate as it is, only Retry-After delays
+        # the next request
+        with self.__lock:
+            self.__delay(retry_after)
+
+    def __delay(self, retry_after):
+        if not retry_after:
+            return
+
+        now = time.monotonic()
+        self.__refill(now)
+        self.__tokens = min(self.__tokens, 0)
+        self.__updated_at = max(self.__updated_at, now + retry_after)
+
+    def __refill(self, now):
+        if now <= self.__updated_at:
+            return
+
+        self.__tokens = min(
+            self.__burst,
+            self.__tokens + (now - self.__updated_at) * self.__rate)
+        self.__updated_at = now
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, open_seconds=60):
+        self.__name = name
+        self.__failure_threshold = failure_threshold
+        self.__open_seconds = open_seconds
+        self.__failures = 0
+        self.__open_until = 0
+        self.__lock = threading.Lock()
+
+    def check(self):
+        with self.__lock:
+            wait_time = self.__open_until - time.monotonic()
+        if wait_time > 0:
+            raise ProviderUnavailable(self.__name, wait_time)
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            is_tripped = self.__failures >= self.__failure_threshold
+
+        if is_tripped:
+            self.open(self.__open_seconds)
+
+    def open(self, seconds):
+        with self.__lock:
+            self.__open_until = max(
+                self.__open_until, time.monotonic() + seconds)
+            # Half open once the time is up, the first failure opens it
+            # again
+            self.__failures = self.__failure_threshold - 1
+
+
+class ProviderThrottle:
+    # Rate limiter and circuit breaker of one provider (host)
+    def __init__(self, name, max_requests_per_second, failure_threshold=5,
+                 open_seconds=60):
+        self.name = name
+        self.__open_seconds = open_seconds
+        self.__rate_limiter = RateLimiter(max_requests_per_second)
+        self.__circuit_breaker = CircuitBreaker(
+            name, failure_threshold=failure_threshold,
+            open_seconds=open_seconds)
+
+    def acquire(self):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def reserve(self):
+        self.__circuit_breaker.check()
+        return self.__rate_limiter.reserve()
+
+    def check(self):
+        self.__circuit_breaker.check()
+
+    def record_response(self, status_code, headers):
+        # Returns whether the request should be sent again, the next
+        # acquire / reserve waits for the Retry-After of the response
+        retry_after = self.__parse_retry_after(headers.get('Retry-After'))
+        if status_code == 429:
+            metrics.increment('throttled', provider=self.name)
+            self.__rate_limiter.on_throttled(retry_after)
+            self.__circuit_breaker.record_failure()
+            return True
+        elif status_code in [401, 402, 403]:
+            # Disconnected or out of quota, retrying soon will not help
+            self.park(retry_after if retry_after else self.__open_seconds)
+        elif status_code >= 500:
+            self.__rate_limiter.on_unavailable(retry_after)
+            self.__circuit_breaker.record_failure()
+            return True
+        else:
+            self.__rate_limiter.on_success()
+            self.__circuit_breaker.record_success()
+        return False
+
+    def park(self, seconds):
+        print(f'## Warning: {self.name} parked for {seconds:.0f} s')
+        metrics.increment('provider_parked', provider=self.name)
+        self.__rate_limiter.on_throttled()
+        self.__circuit_breaker.open(seconds)
+
+    def __parse_retry_after(self, retry_after):
+        # Either delay seconds or an HTTP date
+        if not retry_after:
+            return None
+        if retry_after.strip().isdigit():
+            return int(retry_after)
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0, (retry_at - datetime.now(timezone.utc))
+                   .total_seconds())
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from metrics import metrics
+
+
+class RawDataCache:
+    # Parsed provider records of each ticker, one Parquet file per year
+    # named by the hash of its content. A manifest per ticker lists the
+    # year files and the key ranges already fetched, it is replaced
+    # atomically so a crash never leaves it pointing at half a file.
+    # Price and volume are keyed by date, income statements by
+    # [year, season], ranges are [start, end) in both
+    __SCHEMAS = {
+        'price_and_vol': pa.schema([
+            ('date', pa.string()),
+            ('open', pa.float64()),
+            ('close', pa.float64()),
+            ('high', pa.float64()),
+            ('low', pa.float64()),
+            ('volume', pa.int64())
+        ]),
+        'income_statements': pa.schema([
+            ('year', pa.int64()),
+            ('season', pa.int64()),
+            ('revenue', pa.int64()),
+            ('cost', pa.int64()),
+            ('gp', pa.int64()),
+            ('oe', pa.int64()),
+            ('oi', pa.int64()),
+            ('nie', pa.int64()),
+            ('btax', pa.int64()),
+            ('ni', pa.int64()),
+            ('eps', pa.float64())
+        ])
+    }
+
+    def __init__(self, path):
+        self.__path = path
+        self.__lock = threading.Lock()
+
+    def get_price_and_vol_gap(self, ticker, start_date, end_date):
+        return self.__get_gap('price_and_vol', ticker, start_date, end_date)
+
+    def get_price_and_vol(self, ticker, start_date, end_date):
+        return self.__read('price_and_vol', ticker, start_date, end_date)
+
+    def put_price_and_vol(self, ticker, start_date, end_date, records):
+        self.__write('price_and_vol', ticker, start_date, end_date, records)
+
+    def get_income_statements_gap(self, ticker, start_season, end_season):
+        return self.__get_gap(
+            'income_statements', ticker, start_season, end_season)
+
+    def get_income_statements(self, ticker, start_season, end_season):
+        return self.__read(
+            'income_statements', ticker, start_season, end_season)
+
+    def put_income_statements(self, ticker, start_season, end_season,
+                              records):
+        self.__write('income_statements', ticker, start_season, end_season,
+                     records)
+
+    def __get_gap(self, dataset, ticker, start, end):
+        # Smallest range covering every key of [start, end) not fetched
+        # yet, so it stays one provider request, None when all is cached
+        coverage = self.__load_manifest(dataset, ticker)['coverage']
+
+        missing = []
+        position = start
+        for [covered_start, covered_end] in coverage:
+            if covered_end <= position:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > position:
+                missing.append([position, covered_start])
+            position = max(position, covered_end)
+        if position < end:
+            missing.append([position, end])
+
+        if len(missing) <= 0:
+            metrics.increment('raw_cache_hits', dataset=dataset,
+                              ticker=ticker)
+            return None
+        return [missing[0][0], missing[-1][1]]
+
+    def __read(self, dataset, ticker, start, end):
+        manifest = self.__load_manifest(dataset, ticker)
+
+        records = []
+        with metrics.timer('raw_cache_read', dataset=dataset, ticker=ticker):
+            for year in range(self.__get_year(start),
+                              self.__get_year(end) + 1):
+                file_name = manifest['partitions'].get(str(year))
+                if not file_name:
+                    continue
+
+                records.extend(self.__read_partition(
+                    dataset, ticker, file_name, start, end))
+
+        return records
+
+    def __write(self, dataset, ticker, start, end, records):
+        if start >= end:
+            return
+
+        with self.__lock, \
+                metrics.timer('raw_cache_write', dataset=dataset,
+                              ticker=ticker):
+            manifest = self.__load_manifest(dataset, ticker)
+            partitions = dict(manifest['partitions'])
+
+            for year in range(self.__get_year(start),
+                              self.__get_year(end) + 1):
+                # Fetched records replace the cached ones of the range
+                year_records = [
+                    record for record in records
+                    if self.__get_year(self.__get_key(record)) == year
+                    and start <= self.__get_key(record) < end]
+                file_name = partitions.get(str(year))
+                if file_name:
+                    year_records.extend(self.__read_partition(
+                        dataset, ticker, file_name, start, end,
+                        is_in_range=False))
+                if len(year_records) <= 0:
+                    continue
+
+                year_records.sort(key=self.__get_key)
+                partitions.update({str(year): self.__write_partition(
+                    dataset, ticker, year_records)})
+
+            self.__save_manifest(dataset, ticker, {
+                'coverage': self.__merge_coverage(
+                    manifest['coverage'] + [[start, end]]),
+                'partitions': partitions
+            })
+
+            # Year files the manifest no longer points to
+            for file_name in set(manifest['partitions'].values()) \
+                    - set(partitions.values()):
+                os.remove(os.path.join(
+                    self.__get_ticker_path(dataset, ticker), file_name))
+
+    def __read_partition(self, dataset, ticker, file_name, start, end,
+                         is_in_range=True):
+        # Records of [start, end), or the ones out of it. The range is
+        # filtered on the memory mapped columns, only the records returned
+        # are turned into dicts
+        table = pq.read_table(
+            os.path.join(self.__get_ticker_path(dataset, ticker), file_name),
+            memory_map=True)
+        keys = self.__get_key_column(table)
+        mask = pc.and_(
+            pc.greater_equal(keys, self.__encode_key(start)),
+            pc.less(keys, self.__encode_key(end)))
+        return table.filter(
+            mask if is_in_range else pc.invert(mask)).to_pylist()
+
+    def __write_partition(self, dataset, ticker, records):
+        schema = self.__SCHEMAS[dataset]
+        columns = {name: [record[name] for record in records]
+                   for name in schema.names}
+        output_stream = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pydict(columns, schema=schema),
+                       output_stream)
+        content = output_stream.getvalue()
+
+        # Same content, same file, so rewriting an unchanged year is free
+        file_name = hashlib.sha256(content).hexdigest() + '.parquet'
+        file_path = os.path.join(
+            self.__get_ticker_path(dataset, ticker), file_name)
+        if os.path.exists(file_path):
+            return file_name
+
+        os.makedirs(self.__get_ticker_path(dataset, ticker), exist_ok=True)
+        temp_path = f'{file_path}.tmp'
+        with open(temp_path, 'wb') as output_file:
+            output_file.write(content)
+        os.replace(temp_path, file_path)
+        return file_name
+
+    def __merge_coverage(self, coverage):
+        merged = []
+        for [covered_start, covered_end] in sorted(coverage):
+            if merged and covered_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], covered_end)
+            else:
+                merged.append([covered_start, covered_end])
+        return merged
+
+    def __load_manifest(self, dataset, ticker):
+        manifest_path = os.path.join(
+            self.__get_ticker_path(dataset, ticker), 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {'coverage': [], 'partitions': {}}
+
+        try:
+            with open(manifest_path, encoding='utf-8') as input_file:
+                return json.load(input_file)
+        except ValueError:
+            print(f'## Warning: Raw data cache of ticker {ticker} is '
+                  f'broken!')
+            return {'coverage': [], 'partitions': {}}
+
+    def __save_manifest(self, dataset, ticker, manifest):
+        # Write to a temp file first so a crash never leaves half a
+        # manifest
+        os.makedirs(self.__get_ticker_path(dataset, ticker), exist_ok=True)
+        manifest_path = os.path.join(
+            self.__get_ticker_path(dataset, ticker), 'manifest.json')
+        temp_path = f'{manifest_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as output_file:
+            json.dump(manifest, output_file)
+        os.replace(temp_path, manifest_path)
+
+    def __get_ticker_path(self, dataset, ticker):
+        return os.path.join(self.__path, dataset, ticker)
+
+    def __get_key_column(self, table):
+        # Keys of the table comparable with __encode_key
+        if 'date' in table.column_names:
+            return table['date']
+        return pc.add(pc.multiply(table['year'], 10), table['season'])
+
+    def __encode_key(self, key):
+        return key if isinstance(key, str) else int(key[0]) * 10 + int(key[1])
+
+    def __get_key(self, record):
+        if 'date' in record:
+            return record['date']
+        return [record['year'], record['season']]
+
+    def __get_year(self, key):
+        return int(key[:4]) if isinstance(key, str) else int(key[0])
@@ -1,21 +1,25 @@
 from io import StringIO
-from datetime import datetime
-import math
+from datetime import datetime, timedelta
+import hashlib
 from decimal import Decimal, ROUND_HALF_UP
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 import json
 
-import requests
+import numpy as np
 import pandas as pd
 
-from dto import StockInfoDTO, StockDTO, IncomeStatementDTO, \
-    DateInfoDTO, FinMindFinancialStatementsDTO
+from http_session import HttpSession
+from metrics import metrics
+from rate_limiter import ProviderThrottle, ProviderUnavailable
+from stocks_list_cache import StocksListCache
+from dto import StockInfoDTO, StockRecords, IncomeStatementRecord
 
 
 class StockCrawler:
     __DATE_FORMAT = '%Y-%m-%d'
 
     __API_CONFIG_PATH = '.\\api.config'
+    __STOCKS_LIST_CACHE_PATH = '.\\stocks_list.cache'
 
     __TWSE_LISTED_STOCKS_URL = 'http://isin.twse.com.tw/isin/C_public.jsp' \
         '?strMode=2'
@@ -24,13 +28,101 @@ class StockCrawler:
     __YAHOO_FINANCE_API_URL = 'https://query1.finance.yahoo.com/v7/finance/' \
         'download/'
     __FINMIND_API_URL = 'https://api.finmindtrade.com/api/v4/data'
-
-    def __init__(self):
-        input_file = open(self.__API_CONFIG_PATH)
-        self.__api_config = json.load(input_file)
+    __TWSE_DAILY_QUOTES_URL = 'https://www.twse.com.tw/exchangeReport/' \
+        'MI_INDEX'
+    __TPEX_DAILY_QUOTES_URL = 'https://www.tpex.org.tw/web/stock/' \
+        'aftertrading/daily_close_quotes/stk_quote_result.php'
+
+    # Max requests per second to each provider, overridden by rate_limits
+    # in api.config. TWSE blocks clients sending more than 3 requests in
+    # 5 seconds
+    __DEFAULT_RATE_LIMITS = {
+        'query1.finance.yahoo.com': 3,
+        'api.finmindtrade.com': 1,
+        'isin.twse.com.tw': 0.5,
+        'www.twse.com.tw': 0.5,
+        'www.tpex.org.tw': 1
+    }
+    # 429 and 5xx responses sent again before giving the response back
+    __MAX_STATUS_RETRIES = 3
+    __YAHOO_DISCONNECTED_SECONDS = 120
+    # FinMind's request quota is reset every hour
+    __FINMIND_QUOTA_RESET_SECONDS = 3600
+    # Only records which can no longer change go to the raw data cache:
+    # prices older than a day, statements once the season's reports and
+    # their corrections are due
+    __PRICE_SETTLE_DAYS = 1
+    __INCOME_STATEMENT_SETTLE_DAYS = 150
+    # FinMind income statement type -> [IncomeStatementRecord field,
+    # aggregation, is the value stored in thousands]. 'set' keeps the last
+    # value of the season, 'add' / 'subtract' adjust it
+    __FINMIND_INCOME_STATEMENT_TYPES = {
+        'Revenue': ['revenue', 'set', True],
+        'CostOfGoodsSold': ['cost', 'set', True],
+        'GrossProfit': ['gp', 'set', True],
+        'OperatingExpenses': ['oe', 'set', True],
+        'OperatingIncome': ['oi', 'set', True],
+        'TotalNonoperatingIncomeAndExpense': ['nie', 'set', True],
+        'TotalNonbusinessIncome': ['nie', 'add', True],
+        'TotalnonbusinessExpenditure': ['nie', 'subtract', True],
+        'IncomeBeforeTaxFromContinuingOperations': ['btax', 'set', True],
+        'IncomeBeforeIncomeTax': ['btax', 'set', True],
+        'PreTaxIncome': ['btax', 'set', True],
+        'NetIncome': ['ni', 'set', True],
+        'IncomeAfterTaxes': ['ni', 'set', True],
+        'EPS': ['eps', 'set', False]
+    }
+
+    def __init__(self, http_session=None, api_config=None,
+                 rate_limits=None, raw_data_cache=None):
+        if api_config is None:
+            input_file = open(self.__API_CONFIG_PATH)
+            api_config = json.load(input_file)
+        self.__api_config = api_config
+        self.__http_session = http_session if http_session \
+            else HttpSession(**self.__api_config.get('http', {}))
+        self.__raw_data_cache = raw_data_cache
+
+        provider_rate_limits = dict(self.__DEFAULT_RATE_LIMITS)
+        provider_rate_limits.update(self.__api_config.get('rate_limits', {}))
+        provider_rate_limits.update(rate_limits or {})
+        self.__throttles = {
+            host: ProviderThrottle(host, max_requests_per_second)
+            for host, max_requests_per_second in provider_rate_limits.items()
+        }
+        self.__stocks_list_cache = StocksListCache(
+            self.__api_config.get(
+                'stocks_list_cache_path', self.__STOCKS_LIST_CACHE_PATH),
+            ttl_seconds=self.__api_config.get(
+                'stocks_list_cache_ttl_seconds', 86400))
         self.stocks_list = self.__get_tw_available_stocks_list()
 
     def get_price_and_vol(self, ticker, start_date, end_date):
+        fetch_range = self.get_price_and_vol_fetch_range(
+            ticker, start_date, end_date)
+        response = self.fetch_price_and_vol(ticker, *fetch_range) \
+            if fetch_range else None
+        return self.parse_price_and_vol(
+            ticker, response, [start_date, end_date], fetch_range)
+
+    def get_price_and_vol_fetch_range(self, ticker, start_date, end_date):
+        # Part of the range missing from the raw data cache, None when it
+        # is all cached. Both dates are included, the cache's end is not
+        if not self.__raw_data_cache:
+            return [start_date, end_date]
+
+        gap = self.__raw_data_cache.get_price_and_vol_gap(
+            ticker, start_date, self.__get_next_date(end_date))
+        return [gap[0], self.__get_next_date(gap[1], days=-1)] if gap \
+            else None
+
+    def fetch_price_and_vol(self, ticker, start_date, end_date):
+        [target_url, headers] = self.get_price_and_vol_request(
+            ticker, start_date, end_date)
+
+        return self.__get(target_url, headers=headers, ticker=ticker)
+
+    def get_price_and_vol_request(self, ticker, start_date, end_date):
         start_date_timestamp = self.__create_timestamp(start_date)
         end_date_timestamp = self.__create_timestamp(end_date)
 
@@ -38,47 +130,65 @@ class StockCrawler:
         target_url = self.__build_crawl_target_url(
             ticker, start_date_timestamp, end_date_timestamp, is_twse=is_twse)
 
+        return [target_url, {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+            'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/'
+            '91.0.4472.164 Safari/537.36'
+        }]
+
+    def parse_price_and_vol(self, ticker, response, date_range=None,
+                            fetch_range=None):
+        # With a raw data cache the response of fetch_range is cached and
+        # the rest of date_range is read from the cache
+        stock_dto = self.__parse_price_and_vol_response(ticker, response) \
+            if response is not None \
+            else StockRecords(ticker=ticker,
+                              stock_name=self.stocks_list[ticker].stock_name)
+        if not self.__raw_data_cache or not date_range or stock_dto is None:
+            return stock_dto
+
+        [start_date, end_date] = \
+            [date_range[0], self.__get_next_date(date_range[1])]
+        [fetch_start_date, fetch_end_date] = \
+            [fetch_range[0], self.__get_next_date(fetch_range[1])] \
+            if fetch_range else [end_date, end_date]
+        if fetch_range:
+            settled_date = str(datetime.today().date() - timedelta(
+                days=self.__PRICE_SETTLE_DAYS))
+            self.__raw_data_cache.put_price_and_vol(
+                ticker, fetch_start_date, min(fetch_end_date, settled_date),
+                stock_dto.date_info)
+
+        date_info = {
+            record['date']: record for record in
+            self.__raw_data_cache.get_price_and_vol(
+                ticker, start_date, fetch_start_date)
+            + self.__raw_data_cache.get_price_and_vol(
+                ticker, fetch_end_date, end_date)}
+        date_info.update(
+            {record['date']: record for record in stock_dto.date_info})
+        stock_dto.date_info = [date_info[key] for key in sorted(date_info)]
+        return stock_dto
+
+    def __parse_price_and_vol_response(self, ticker, response):
         try:
-            response = requests.get(
-                target_url,
-                headers={
-                    'Connection': 'close',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
-                    'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/'
-                    '91.0.4472.164 Safari/537.36'
-                }
-            )
-
-            stock_info_df = pd.read_csv(
-                StringIO(response.text), error_bad_lines=False)
-            stock_dto = StockDTO(
-                ticker=ticker, stock_name=self.stocks_list[ticker].stock_name)
-            for i in range(len(stock_info_df.index)):
-                open = Decimal(stock_info_df['Open'].iloc[i]) \
-                    .quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                close = Decimal(stock_info_df['Close'].iloc[i]) \
-                    .quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                high = Decimal(stock_info_df['High'].iloc[i]) \
-                    .quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                low = Decimal(stock_info_df['Low'].iloc[i]) \
-                    .quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
-                volume = \
-                    int(round(stock_info_df["Volume"].iloc[i], -3) / 1000) \
-                    if not math.isnan(stock_info_df["Volume"].iloc[i]) else 0
-                date_info_dto = DateInfoDTO(
-                    date=stock_info_df["Date"].iloc[i],
-                    open=open,
-                    close=close,
-                    high=high,
-                    low=low,
-                    volume=volume
+            with metrics.timer('csv_parse', ticker=ticker):
+                stock_info_df = pd.read_csv(
+                    StringIO(response.text), error_bad_lines=False)
+            with metrics.timer('dto_build', ticker=ticker):
+                stock_dto = StockRecords(
+                    ticker=ticker,
+                    stock_name=self.stocks_list[ticker].stock_name,
+                    date_info=self.__build_date_info_records(stock_info_df)
                 )
-                stock_dto.date_info.append(date_info_dto)
 
             return stock_dto
         except Exception as e:
             if response.json()['error'] \
                     and response.json()['error']['code'] == 'Unauthorized':
+                metrics.increment('yahoo_unauthorized', ticker=ticker)
+                self.get_throttle(self.__YAHOO_FINANCE_API_URL).park(
+                    self.__YAHOO_DISCONNECTED_SECONDS)
                 raise ValueError('Yahoo finance disconnected')
 
             print(f'Error: {e}')
@@ -86,42 +196,332 @@ class StockCrawler:
 
     def get_income_statements_dto(self, ticker, start_year, start_season,
                                   end_year, end_season):
+        fetch_range = self.get_income_statements_fetch_range(
+            ticker, start_year, start_season, end_year, end_season)
+        response = self.fetch_income_statements(ticker, *fetch_range) \
+            if fetch_range else None
+        return self.parse_income_statements_dto(
+            ticker, response,
+            [start_year, start_season, end_year, end_season], fetch_range)
+
+    def fetch_income_statements(self, ticker, start_year, start_season,
+                                end_year, end_season):
+        try:
+            return self.__get(
+                self.get_income_statements_url(
+                    ticker, start_year, start_season, end_year, end_season),
+                ticker=ticker)
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            raise Exception(f'Ticker: {ticker}, Error: {e}')
+
+    def get_income_statements_fetch_range(self, ticker, start_year,
+                                          start_season, end_year,
+                                          end_season):
+        # Seasons missing from the raw data cache, None when they are all
+        # cached. The end season is not included, same as the FinMind
+        # request of get_income_statements_url
+        if not self.__raw_data_cache:
+            return [start_year, start_season, end_year, end_season]
+
+        gap = self.__raw_data_cache.get_income_statements_gap(
+            ticker, [int(start_year), int(start_season)],
+            [int(end_year), int(end_season)])
+        return gap[0] + gap[1] if gap else None
+
+    def get_income_statements_url(self, ticker, start_year, start_season,
+                                  end_year, end_season):
+        return self.__build_income_statement_url(
+            ticker, int(start_year), int(start_season),
+            int(end_year), int(end_season))
+
+    def parse_income_statements_dto(self, ticker, response,
+                                    season_range=None, fetch_range=None):
+        # With a raw data cache the response of fetch_range is cached and
+        # the rest of season_range is read from the cache
+        stock_dto = self.__parse_income_statements_response(ticker, response) \
+            if response is not None \
+            else StockRecords(ticker=ticker,
+                              stock_name=self.stocks_list[ticker].stock_name)
+        if not self.__raw_data_cache or not season_range:
+            return stock_dto
 
         [start_year, start_season, end_year, end_season] = \
-            [int(start_year), int(start_season),
-             int(end_year), int(end_season)]
+            [int(value) for value in season_range]
+        [fetch_start, fetch_end] = \
+            [[int(fetch_range[0]), int(fetch_range[1])],
+             [int(fetch_range[2]), int(fetch_range[3])]] if fetch_range \
+            else [[end_year, end_season], [end_year, end_season]]
+        if fetch_range:
+            settled_date = datetime.today() - timedelta(
+                days=self.__INCOME_STATEMENT_SETTLE_DAYS)
+            self.__raw_data_cache.put_income_statements(
+                ticker, fetch_start,
+                min(fetch_end, [settled_date.year,
+                                self.__get_season(settled_date.month)]),
+                [income_statement.dict()
+                 for income_statement in stock_dto.income_statements])
+
+        income_statements = {}
+        for record in self.__raw_data_cache.get_income_statements(
+                ticker, [start_year, start_season], fetch_start) \
+                + self.__raw_data_cache.get_income_statements(
+                    ticker, fetch_end, [end_year, end_season]):
+            income_statement = IncomeStatementRecord(
+                year=record['year'], season=record['season'])
+            for field, value in record.items():
+                setattr(income_statement, field, value)
+            income_statements.update(
+                {(record['year'], record['season']): income_statement})
+        income_statements.update(
+            {(income_statement.year, income_statement.season):
+             income_statement
+             for income_statement in stock_dto.income_statements})
+        stock_dto.income_statements = [
+            income_statements[key] for key in sorted(income_statements)]
+        return stock_dto
 
+    def __parse_income_statements_response(self, ticker, response):
         try:
-            response = requests.get(
-                self.__build_income_statement_url(
-                    ticker, start_year, start_season, end_year, end_season),
-                headers={'Connection': 'close'}
-            ).json()
+            with metrics.timer('json_parse', ticker=ticker):
+                response = response.json()
 
             if response['status'] == 402:
+                metrics.increment('finmind_402', ticker=ticker)
+                self.get_throttle(self.__FINMIND_API_URL).park(
+                    self.__FINMIND_QUOTA_RESET_SECONDS)
                 raise Exception('Reach the FindMind limit')
         except Exception as e:
             raise Exception(f'Ticker: {ticker}, Error: {e}')
 
-        data_dict = {}
-        for item in response['data']:
-            find_mind_dto = FinMindFinancialStatementsDTO.parse_obj(item)
+        with metrics.timer('dto_build', ticker=ticker):
+            data_dict = self.__group_income_statements(response['data']) \
+                .get(ticker, {})
 
-            date = datetime.strptime(find_mind_dto.date, self.__DATE_FORMAT)
-            if(date not in data_dict):
-                income_statement_dto = IncomeStatementDTO(
-                    year=date.year, season=self.__get_season(date.month))
-                data_dict.update({date: income_statement_dto})
+            stock_dto = StockRecords(
+                ticker=ticker,
+                stock_name=self.stocks_list[ticker].stock_name)
+            for key in data_dict:
+                stock_dto.income_statements.append(data_dict[key])
 
-            self.__build_income_statement_dto_from_finmind_api(
-                data_dict[date], find_mind_dto)
+        return stock_dto
 
-        stock_dto = StockDTO(
-            ticker=ticker, stock_name=self.stocks_list[ticker].stock_name)
-        for key in data_dict:
-            stock_dto.income_statements.append(data_dict[key])
+    def get_income_statements_dtos_by_date(self, date):
+        # One request returns the statements of every ticker reported on
+        # this date, instead of one request per ticker
+        try:
+            response = self.__get(
+                self.__build_income_statement_by_date_url(date), date=date)
+            with metrics.timer('json_parse', date=date):
+                response = response.json()
 
-        return stock_dto
+            if response['status'] == 402:
+                metrics.increment('finmind_402', date=date)
+                self.get_throttle(self.__FINMIND_API_URL).park(
+                    self.__FINMIND_QUOTA_RESET_SECONDS)
+                raise Exception('Reach the FindMind limit')
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            raise Exception(f'Date: {date}, Error: {e}')
+
+        stock_dtos = {}
+        with metrics.timer('dto_build', date=date):
+            for ticker, data_dict in \
+                    self.__group_income_statements(response['data']).items():
+                if ticker not in self.stocks_list:
+                    continue
+
+                stock_dtos.update({ticker: StockRecords(
+                    ticker=ticker,
+                    stock_name=self.stocks_list[ticker].stock_name,
+                    income_statements=list(data_dict.values())
+                )})
+
+        return stock_dtos
+
+    def get_income_statement_dates(self, start_year, start_season,
+                                   end_year, end_season):
+        # Reporting dates (end of each season) get_income_statements_dto
+        # would cover for the same arguments
+        start_date = self.__get_date_from_season(
+            int(start_year), int(start_season))
+        end_date = self.__get_date_from_season(
+            int(end_year), int(end_season))
+
+        dates = []
+        for year in range(int(start_year), int(end_year) + 1):
+            for season_end in ['03-31', '06-30', '09-30', '12-31']:
+                date = f'{year}-{season_end}'
+                if start_date <= date <= end_date:
+                    dates.append(date)
+
+        return dates
+
+    def get_throttle(self, url):
+        return self.__throttles.get(urlsplit(url).netloc)
+
+    def get_market_snapshot(self, date):
+        snapshot = self.__get_twse_snapshot(date)
+        snapshot.update(self.__get_tpex_snapshot(date))
+        return snapshot
+
+    def __get_twse_snapshot(self, date):
+        date_time = datetime.strptime(date, self.__DATE_FORMAT)
+        query_str = urlencode({
+            'response': 'json',
+            'date': date_time.strftime('%Y%m%d'),
+            'type': 'ALLBUT0999'
+        })
+        response = self.__get(
+            self.__TWSE_DAILY_QUOTES_URL + '?' + query_str,
+            market='TWSE', date=date)
+        with metrics.timer('json_parse', market='TWSE', date=date):
+            response = response.json()
+        if response.get('stat') != 'OK':
+            return {}
+
+        # Older responses put each table in fieldsN / dataN pairs, newer
+        # ones in a tables list
+        tables = response.get('tables') or [
+            {'fields': response[f'fields{i}'], 'data': response[f'data{i}']}
+            for i in range(1, 10)
+            if f'fields{i}' in response and f'data{i}' in response]
+        for table in tables:
+            fields = table.get('fields') or []
+            if '證券代號' not in fields or '收盤價' not in fields:
+                continue
+
+            return self.__build_snapshot(
+                date, table['data'],
+                fields.index('證券代號'), fields.index('開盤價'),
+                fields.index('收盤價'), fields.index('最高價'),
+                fields.index('最低價'), fields.index('成交股數'))
+
+        return {}
+
+    def __get_tpex_snapshot(self, date):
+        date_time = datetime.strptime(date, self.__DATE_FORMAT)
+        query_str = urlencode({
+            'l': 'zh-tw',
+            'o': 'json',
+            'd': f'{date_time.year - 1911}/{date_time.month:02d}/'
+                 f'{date_time.day:02d}'
+        })
+        response = self.__get(
+            self.__TPEX_DAILY_QUOTES_URL + '?' + query_str,
+            market='OTC', date=date)
+        with metrics.timer('json_parse', market='OTC', date=date):
+            response = response.json()
+
+        rows = response.get('aaData')
+        if rows is None and response.get('tables'):
+            rows = response['tables'][0].get('data')
+        if not rows:
+            return {}
+
+        # 代號, 名稱, 收盤, 漲跌, 開盤, 最高, 最低, 均價, 成交股數, ...
+        return self.__build_snapshot(date, rows, 0, 4, 2, 5, 6, 8)
+
+    def __get(self, url, headers=None, **labels):
+        # Raises ProviderUnavailable right away when the provider is
+        # parked so callers can move on to other work. 429 and 5xx are
+        # retried here instead of in the HTTP session, so the throttle
+        # sees every response and decides when the retry is sent
+        throttle = self.get_throttle(url)
+        for retry in range(0, self.__MAX_STATUS_RETRIES + 1):
+            if throttle:
+                with metrics.timer('throttle_wait', **labels):
+                    throttle.acquire()
+
+            with metrics.timer('http_fetch', **labels):
+                response = self.__http_session.get(url, headers=headers)
+
+            is_retried = throttle.record_response(
+                response.status_code, response.headers) if throttle \
+                else False
+            if not is_retried or retry >= self.__MAX_STATUS_RETRIES:
+                return response
+            metrics.increment('http_retries', host=throttle.name)
+
+    def __build_snapshot(self, date, rows, ticker_index, open_index,
+                         close_index, high_index, low_index, volume_index):
+        snapshot = {}
+        for row in rows:
+            ticker = row[ticker_index].strip()
+            if ticker not in self.stocks_list:
+                continue
+
+            prices = [self.__parse_quote_price(row[i]) for i in
+                      [open_index, close_index, high_index, low_index]]
+            shares = row[volume_index].replace(',', '').strip()
+            # No trade on this day
+            if None in prices or not shares.isdigit():
+                continue
+
+            snapshot.update({ticker: {
+                'date': date,
+                'open': prices[0],
+                'close': prices[1],
+                'high': prices[2],
+                'low': prices[3],
+                'volume': int(round(int(shares), -3) / 1000)
+            }})
+
+        return snapshot
+
+    def __parse_quote_price(self, text):
+        text = text.replace(',', '').strip()
+        try:
+            return float(Decimal(text).quantize(
+                Decimal('.01'), rounding=ROUND_HALF_UP))
+        except ArithmeticError:
+            return None
+
+    def __build_date_info_records(self, stock_info_df):
+        # Yahoo sends null prices for days without a quote, drop them
+        # instead of storing NaN days
+        stock_info_df = stock_info_df.dropna(
+            subset=['Open', 'Close', 'High', 'Low'])
+        open = self.__round_price_column(stock_info_df['Open'])
+        close = self.__round_price_column(stock_info_df['Close'])
+        high = self.__round_price_column(stock_info_df['High'])
+        low = self.__round_price_column(stock_info_df['Low'])
+        volume = (np.round(stock_info_df['Volume'], -3) / 1000) \
+            .fillna(0).astype('int64')
+
+        return [
+            {
+                'date': date,
+                'open': open_price,
+                'close': close_price,
+                'high': high_price,
+                'low': low_price,
+                'volume': lots
+            }
+            for date, open_price, close_price, high_price, low_price, lots
+            in zip(stock_info_df['Date'].tolist(), open.tolist(),
+                   close.tolist(), high.tolist(), low.tolist(),
+                   volume.tolist())
+        ]
+
+    def __round_price_column(self, column):
+        # Round half up to 0.01 on the exact binary value, same as
+        # Decimal(value).quantize(Decimal('.01'), rounding=ROUND_HALF_UP)
+        values = column.to_numpy(dtype='float64')
+        cents = values * 100
+        floor_cents = np.floor(cents)
+        rounded = (floor_cents + (cents - floor_cents >= 0.5)) / 100
+
+        # values * 100 may land either side of a .xx5 tie, leave those
+        # few to Decimal so the result stays identical
+        near_tie = np.abs(cents - floor_cents - 0.5) < 1e-6
+        for i in np.flatnonzero(near_tie):
+            rounded[i] = float(Decimal(values[i]).quantize(
+                Decimal('.01'), rounding=ROUND_HALF_UP))
+
+        return rounded
 
     def __build_crawl_target_url(self, ticker, start_date_timestamp,
                                  end_date_timestamp, is_twse=True):
@@ -154,11 +554,109 @@ class StockCrawler:
 
         return self.__FINMIND_API_URL + '?' + query_str
 
+    def __build_income_statement_by_date_url(self, date):
+        query_str = urlencode({
+            'dataset': 'TaiwanStockFinancialStatements',
+            'start_date': date,
+            'end_date': date,
+            'token': self.__api_config['finmind_api_token']
+        })
+
+        return self.__FINMIND_API_URL + '?' + query_str
+
+    def __group_income_statements(self, finmind_data):
+        # stock_id -> date -> IncomeStatementRecord. The long FinMind rows of
+        # every ticker and season are pivoted at once into a season x field
+        # array through __FINMIND_INCOME_STATEMENT_TYPES
+        if len(finmind_data) <= 0:
+            return {}
+
+        frame = pd.DataFrame(
+            finmind_data, columns=['stock_id', 'date', 'type', 'value'])
+        # Seasons numbered in the order they first show up, also the ones
+        # without a known type
+        season_indexes = frame.groupby(
+            ['stock_id', 'date'], sort=False).ngroup().to_numpy()
+        seasons = frame[['stock_id', 'date']].drop_duplicates()
+
+        fields = list(dict.fromkeys(
+            [field for [field, _, _]
+             in self.__FINMIND_INCOME_STATEMENT_TYPES.values()]))
+        types = pd.DataFrame.from_dict(
+            {finmind_type: [fields.index(field),
+                            {'set': 0, 'add': 1, 'subtract': -1}[aggregation],
+                            in_thousands]
+             for finmind_type, [field, aggregation, in_thousands]
+             in self.__FINMIND_INCOME_STATEMENT_TYPES.items()},
+            orient='index', columns=['field', 'sign', 'in_thousands']) \
+            .reindex(frame['type'].to_numpy())
+        is_known = types['field'].notna().to_numpy()
+        field_indexes = types['field'].to_numpy()[is_known].astype(int)
+        signs = types['sign'].to_numpy()[is_known]
+        season_indexes = season_indexes[is_known]
+        values = frame['value'].to_numpy(dtype='float64')[is_known]
+        # Same as int(value / 1000) for the fields kept in thousands
+        values = np.where(
+            types['in_thousands'].to_numpy()[is_known].astype(bool),
+            np.trunc(values / 1000), values)
+        positions = np.arange(len(values))
+
+        # The last value set for each field of a season, 'add' / 'subtract'
+        # rows adjust it when they come after it, or 0 when nothing was set
+        shape = (len(seasons), len(fields))
+        is_set = signs == 0
+        last_set_positions = np.full(shape, -1)
+        np.maximum.at(
+            last_set_positions,
+            (season_indexes[is_set], field_indexes[is_set]),
+            positions[is_set])
+        # -1 picks the NaN appended for the fields never set
+        table = np.append(values, np.nan)[last_set_positions]
+
+        is_adjustment = ~is_set & (
+            positions > last_set_positions[season_indexes, field_indexes])
+        adjustment_indexes = (season_indexes[is_adjustment],
+                              field_indexes[is_adjustment])
+        adjustments = np.zeros(shape)
+        np.add.at(adjustments, adjustment_indexes,
+                  values[is_adjustment] * signs[is_adjustment])
+        is_adjusted = np.zeros(shape, dtype=bool)
+        is_adjusted[adjustment_indexes] = True
+        table = np.where(is_adjusted, np.nan_to_num(table) + adjustments,
+                         table)
+
+        in_thousands = {field: in_thousands for [field, _, in_thousands]
+                        in self.__FINMIND_INCOME_STATEMENT_TYPES.values()}
+        columns = {
+            field: [None if np.isnan(value)
+                    else int(value) if in_thousands[field] else float(value)
+                    for value in table[:, i].tolist()]
+            for i, field in enumerate(fields)}
+
+        years = seasons['date'].str[:4].astype(int).tolist()
+        months = seasons['date'].str[5:7].astype(int).tolist()
+        grouped = {}
+        for i, [stock_id, date] in enumerate(
+                seasons.itertuples(index=False)):
+            income_statement_record = IncomeStatementRecord(
+                year=years[i], season=self.__get_season(months[i]))
+            for field, column in columns.items():
+                if column[i] is not None:
+                    setattr(income_statement_record, field, column[i])
+            grouped.setdefault(stock_id, {}) \
+                .update({date: income_statement_record})
+
+        return grouped
+
     def __create_timestamp(self, date):
         date_time = datetime.strptime(date, self.__DATE_FORMAT)
         timestamp = datetime.timestamp(date_time)
         return int(timestamp)
 
+    def __get_next_date(self, date, days=1):
+        return (datetime.strptime(date, self.__DATE_FORMAT)
+                + timedelta(days=days)).strftime(self.__DATE_FORMAT)
+
     def __get_season(self, month):
         if month >= 1 and month <= 3:
             return 1
@@ -189,53 +687,64 @@ class StockCrawler:
 
     def __get_stocks_list(self, url):
         market = 'TWSE' if url == self.__TWSE_LISTED_STOCKS_URL else 'OTC'
-        unformatted_stocks_table = requests.get(url,
-                                                headers={'Connection': 'close'})
-        unformatted_stocks_df = pd.read_html(unformatted_stocks_table.text)[0]
+        cached_entry = self.__stocks_list_cache.get(url)
+        if cached_entry and self.__stocks_list_cache.is_fresh(cached_entry):
+            return self.__build_stock_info_dtos(cached_entry['stocks'])
+
+        headers = {}
+        if cached_entry and cached_entry['etag']:
+            headers.update({'If-None-Match': cached_entry['etag']})
+        if cached_entry and cached_entry['last_modified']:
+            headers.update(
+                {'If-Modified-Since': cached_entry['last_modified']})
+        unformatted_stocks_table = self.__get(url, headers=headers)
+        if cached_entry and unformatted_stocks_table.status_code == 304:
+            self.__stocks_list_cache.touch(url)
+            return self.__build_stock_info_dtos(cached_entry['stocks'])
+
+        # ISIN pages rarely send validators, compare the content instead
+        # and only parse the table when it really changed
+        content_hash = hashlib.sha256(
+            unformatted_stocks_table.content).hexdigest()
+        if cached_entry and cached_entry['content_hash'] == content_hash:
+            stocks = cached_entry['stocks']
+        else:
+            stocks = self.__parse_stocks_table(
+                unformatted_stocks_table.text, market)
+
+        self.__stocks_list_cache.put(
+            url, stocks,
+            etag=unformatted_stocks_table.headers.get('ETag'),
+            last_modified=unformatted_stocks_table.headers.get(
+                'Last-Modified'),
+            content_hash=content_hash)
+        return self.__build_stock_info_dtos(stocks)
+
+    def __parse_stocks_table(self, html, market):
+        unformatted_stocks_df = pd.read_html(html)[0]
         unformatted_stocks_df.columns = unformatted_stocks_df.iloc[0]
 
         # Remove none stock rows
+        stocks_df = unformatted_stocks_df[
+            unformatted_stocks_df['CFICode'] == 'ESVUFR']
+        ticker_and_name = stocks_df['有價證券代號及名稱'] \
+            .str.replace(u'\u3000', ' ').str.split(' ')
+        sectors = stocks_df['產業別'].astype(object) \
+            .where(stocks_df['產業別'].notna(), None)
+
         stocks = {}
-        for i in range(0, len(unformatted_stocks_df.index)):
-            if unformatted_stocks_df['CFICode'].iloc[i] != 'ESVUFR':
-                continue
-            ticker_and_name = (unformatted_stocks_df['有價證券代號及名稱']
-                               .iloc[i].replace(u'\u3000', ' ').split(' '))
-            stock_info_dto = StockInfoDTO()
-            stock_info_dto.stock_name = ticker_and_name[1]
-            stock_info_dto.sector = unformatted_stocks_df["產業別"].iloc[i]
-            stock_info_dto.market = market
-            stocks.update({f'{ticker_and_name[0]}': stock_info_dto})
+        for ticker, stock_name, sector in zip(
+                ticker_and_name.str[0].tolist(),
+                ticker_and_name.str[1].tolist(),
+                sectors.tolist()):
+            stocks.update({f'{ticker}': {
+                'stock_name': stock_name,
+                'sector': sector,
+                'market': market
+            }})
 
         return stocks
 
-    def __build_income_statement_dto_from_finmind_api(
-            self, income_statement_dto,
-            finmind_api_dto: FinMindFinancialStatementsDTO):
-
-        btax = ['IncomeBeforeTaxFromContinuingOperations',
-                'IncomeBeforeIncomeTax', 'PreTaxIncome']
-        ni = ['NetIncome', 'IncomeAfterTaxes']
-
-        if finmind_api_dto.type == 'Revenue':
-            income_statement_dto.revenue = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'CostOfGoodsSold':
-            income_statement_dto.cost = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'GrossProfit':
-            income_statement_dto.gp = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'OperatingExpenses':
-            income_statement_dto.oe = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'OperatingIncome':
-            income_statement_dto.oi = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'TotalNonoperatingIncomeAndExpense':
-            income_statement_dto.nie = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'TotalNonbusinessIncome':
-            income_statement_dto.nie += int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'TotalnonbusinessExpenditure':
-            income_statement_dto.nie -= int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type in btax:
-            income_statement_dto.btax = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type in ni:
-            income_statement_dto.ni = int(finmind_api_dto.value / 1000)
-        elif finmind_api_dto.type == 'EPS':
-            income_statement_dto.eps = finmind_api_dto.value
+    def __build_stock_info_dtos(self, stocks):
+        return {ticker: StockInfoDTO.construct(**stock_info)
+                for ticker, stock_info in stocks.items()}
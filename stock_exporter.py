@@ -0,0 +1,325 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from metrics import metrics
+
+
+class StockExporter:
+    # Copies the stock collection into hive partitioned Parquet or Arrow
+    # files, price and volume under price_and_vol/year=Y and income
+    # statements under income_statements/year=Y. Tickers are read in
+    # runs of batch_size consecutive tickers by parallel cursors and each
+    # run is written as its own files. The manifest keeps the watermarks
+    # exported so far, so a later run only moves the days and seasons
+    # added since, after the last ones or backfilled before the first
+    # ones, and the exports its files belong to, files of a run which did
+    # not finish are removed by the next one
+    __SCHEMAS = {
+        'price_and_vol': pa.schema([
+            ('ticker', pa.string()),
+            ('date', pa.string()),
+            ('open', pa.float64()),
+            ('close', pa.float64()),
+            ('high', pa.float64()),
+            ('low', pa.float64()),
+            ('volume', pa.int64()),
+            ('year', pa.int64())
+        ]),
+        'income_statements': pa.schema([
+            ('ticker', pa.string()),
+            ('year', pa.int64()),
+            ('season', pa.int64()),
+            ('revenue', pa.int64()),
+            ('cost', pa.int64()),
+            ('gp', pa.int64()),
+            ('oe', pa.int64()),
+            ('oi', pa.int64()),
+            ('nie', pa.int64()),
+            ('btax', pa.int64()),
+            ('ni', pa.int64()),
+            ('eps', pa.float64())
+        ])
+    }
+    # Format -> [pyarrow dataset format, file extension]
+    __FORMATS = {
+        'parquet': ['parquet', 'parquet'],
+        'arrow': ['ipc', 'arrow']
+    }
+    __PARTITIONING = ds.partitioning(
+        pa.schema([('year', pa.int64())]), flavor='hive')
+
+    def __init__(self, db_manage, path, file_format='parquet',
+                 pricevolume_buckets=False, workers=4, batch_size=100):
+        self.__db_manage = db_manage
+        self.__path = path
+        self.__format = file_format
+        self.__pricevolume_buckets = pricevolume_buckets
+        self.__workers = workers
+        self.__batch_size = batch_size
+
+    def export(self, full=False):
+        # Every stored day and season when full, or when there is no
+        # export of the same format yet, otherwise the ones out of the
+        # previous exports' watermarks. Returns [days, seasons] exported
+        manifest = self.__load_manifest()
+        if manifest['format'] != self.__format \
+                or self.__is_missing_first(manifest['watermarks']):
+            full = True
+        self.__remove_files(manifest['exports'])
+
+        export_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        exported_watermarks = {} if full else manifest['watermarks']
+        # Read once, so days written while the export runs wait for the
+        # next one instead of being exported twice
+        watermarks = {}
+        ranges = {}
+        for ticker, watermark in self.__db_manage.get_watermarks().items():
+            exported_watermark = exported_watermarks.get(ticker, {})
+            ticker_watermarks = {}
+            ticker_range = []
+            for key in ['date', 'season']:
+                ticker_watermarks.update(self.__merge_watermarks(
+                    key, watermark, exported_watermark))
+                ticker_range.append([
+                    exported_watermark.get(f'first_{key}'),
+                    exported_watermark.get(f'last_{key}'),
+                    watermark.get(f'first_{key}'),
+                    watermark.get(f'last_{key}')])
+            watermarks.update({ticker: ticker_watermarks})
+            if any(self.__has_new_records(key_range)
+                   for key_range in ticker_range):
+                ranges.update({ticker: ticker_range})
+
+        tickers = sorted(ranges)
+        batches = [
+            {ticker: ranges[ticker]
+             for ticker in tickers[i:i + self.__batch_size]}
+            for i in range(0, len(tickers), self.__batch_size)]
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            counts = list(executor.map(
+                self.__export_batch, [export_id] * len(batches),
+                range(len(batches)), batches))
+
+        exports = [export_id] if full \
+            else manifest['exports'] + [export_id]
+        self.__save_manifest({'format': self.__format, 'exports': exports,
+                              'watermarks': watermarks})
+        if full:
+            # Files of the exports the full one replaces
+            self.__remove_files(exports)
+
+        return [sum(count[0] for count in counts),
+                sum(count[1] for count in counts)]
+
+    def __export_batch(self, export_id, number, ranges):
+        # ranges is ticker -> [date range, season range], each [exported
+        # first, exported last, first, last] key, see __is_in_range
+        tickers = list(ranges)
+        print(f'Start export tickers : {tickers[0]} ~ {tickers[-1]}')
+        timer_start = time.time()
+
+        with metrics.timer('db_read', query='export', tickers=len(tickers)):
+            [days, seasons] = self.__read_batch(ranges)
+        self.__write('price_and_vol', export_id, number, days)
+        self.__write('income_statements', export_id, number, seasons)
+        metrics.increment('export_rows', len(days['ticker']),
+                          dataset='price_and_vol')
+        metrics.increment('export_rows', len(seasons['ticker']),
+                          dataset='income_statements')
+
+        timer_end = time.time()
+        pass_time = Decimal(timer_end - timer_start).quantize(
+            Decimal('.1'), rounding=ROUND_HALF_UP)
+        print(f'Export {tickers[0]} ~ {tickers[-1]} completed, '
+              f'{len(days["ticker"])} days, {len(seasons["ticker"])} seasons '
+              f'({pass_time} s)')
+        return [len(days['ticker']), len(seasons['ticker'])]
+
+    def __read_batch(self, ranges):
+        # Columns of the days and seasons of ranges. Out of range records
+        # are dropped on the server against the bounds of the whole batch,
+        # then against the ticker's own range
+        days = {name: [] for name in self.__SCHEMAS['price_and_vol'].names}
+        seasons = {name: []
+                   for name in self.__SCHEMAS['income_statements'].names}
+        tickers = list(ranges)
+        date_bounds = self.__get_bounds(
+            [date_range for [date_range, _] in ranges.values()])
+        season_bounds = self.__get_bounds(
+            [season_range for [_, season_range] in ranges.values()])
+
+        projection = {
+            '_id': 0,
+            'ticker': 1,
+            'income_statements': self.__build_filter(
+                '$income_statements', {'$add': [
+                    {'$multiply': ['$$this.year', 10]}, '$$this.season']},
+                season_bounds)
+        }
+        if not self.__pricevolume_buckets:
+            projection.update({'date_info': self.__build_filter(
+                '$date_info', '$$this.date', date_bounds)})
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.collection_name)
+        for document in collection.aggregate([
+                {'$match': {'ticker': {'$in': tickers}}},
+                {'$project': projection}]):
+            season_range = ranges[document['ticker']][1]
+            for income_statement in document.get('income_statements') or []:
+                if self.__is_in_range(
+                        income_statement['year'] * 10
+                        + income_statement['season'], season_range):
+                    self.__append_row(seasons, income_statement,
+                                      ticker=document['ticker'])
+            for date_info in document.get('date_info') or []:
+                self.__append_day(days, document['ticker'], date_info,
+                                  ranges[document['ticker']])
+
+        if self.__pricevolume_buckets:
+            bucket_collection = self.__db_manage.get_collection(
+                self.__db_manage.bucket_collection_name)
+            query = self.__build_bucket_query(tickers, date_bounds)
+            for bucket in bucket_collection.find(
+                    query, {'ticker': 1, 'days': 1, '_id': 0}):
+                for date, day in bucket['days'].items():
+                    date_info = {'date': date}
+                    date_info.update(day)
+                    self.__append_day(days, bucket['ticker'], date_info,
+                                      ranges[bucket['ticker']])
+
+        return [days, seasons]
+
+    def __append_day(self, days, ticker, date_info, ticker_range):
+        if self.__is_in_range(date_info['date'], ticker_range[0]):
+            self.__append_row(days, date_info, ticker=ticker,
+                              year=int(date_info['date'][:4]))
+
+    def __append_row(self, columns, record, **fields):
+        for name, values in columns.items():
+            values.append(fields[name] if name in fields
+                          else record.get(name))
+
+    def __write(self, dataset, export_id, number, columns):
+        if len(columns['ticker']) <= 0:
+            return
+
+        [dataset_format, extension] = self.__FORMATS[self.__format]
+        with metrics.timer('export_write', dataset=dataset):
+            ds.write_dataset(
+                pa.Table.from_pydict(columns,
+                                     schema=self.__SCHEMAS[dataset]),
+                os.path.join(self.__path, dataset),
+                format=dataset_format,
+                partitioning=self.__PARTITIONING,
+                basename_template=f'part-{export_id}-{number:05d}-{{i}}.'
+                f'{extension}',
+                existing_data_behavior='overwrite_or_ignore')
+
+    def __remove_files(self, export_ids):
+        # Files of exports not in export_ids, i.e. replaced by a full
+        # export or left by a run which did not finish
+        for dataset in self.__SCHEMAS:
+            dataset_path = os.path.join(self.__path, dataset)
+            for directory, _, file_names in os.walk(dataset_path):
+                for file_name in file_names:
+                    if file_name.startswith('part-') \
+                            and file_name.split('-')[1] not in export_ids:
+                        os.remove(os.path.join(directory, file_name))
+
+    def __build_filter(self, field, key_expression, bounds):
+        [before, after, until] = bounds
+        if until is None:
+            return {'$literal': []}
+        conditions = [{'$lte': [key_expression, until]}]
+        if before is not None:
+            conditions.append({'$or': [{'$lt': [key_expression, before]},
+                                       {'$gt': [key_expression, after]}]})
+        return {'$filter': {
+            'input': {'$ifNull': [field, []]},
+            'cond': {'$and': conditions}
+        }}
+
+    def __build_bucket_query(self, tickers, date_bounds):
+        [before, after, until] = date_bounds
+        if until is None:
+            return {'ticker': {'$in': []}}
+        query = {'ticker': {'$in': tickers},
+                 'year': {'$lte': int(until[:4])}}
+        if before is not None:
+            query.update({'$or': [{'year': {'$lte': int(before[:4])}},
+                                  {'year': {'$gte': int(after[:4])}}]})
+        return query
+
+    def __get_bounds(self, key_ranges):
+        # [before, after, until] covering every key range: keys up to until
+        # and, unless before is None, before before or after after. before
+        # is None when any range was never exported, until is None when no
+        # range has records
+        exported_ranges = [[exported_first, exported_last]
+                           for [exported_first, exported_last, _, _]
+                           in key_ranges if exported_last is not None]
+        lasts = [last for [_, _, _, last] in key_ranges if last is not None]
+        if len(exported_ranges) < len(key_ranges):
+            return [None, None, max(lasts) if lasts else None]
+        return [max(exported_first for [exported_first, _]
+                    in exported_ranges),
+                min(exported_last for [_, exported_last] in exported_ranges),
+                max(lasts) if lasts else None]
+
+    def __is_in_range(self, key, key_range):
+        # Stored, and before the first or after the last key exported
+        [exported_first, exported_last, _, last] = key_range
+        return last is not None and key <= last \
+            and (exported_last is None or key < exported_first
+                 or key > exported_last)
+
+    def __has_new_records(self, key_range):
+        [exported_first, exported_last, first, last] = key_range
+        if last is None:
+            return False
+        return exported_last is None or last > exported_last \
+            or first < exported_first
+
+    def __merge_watermarks(self, key, watermark, exported_watermark):
+        # Watermarks of the keys exported once this export is done
+        merged = {}
+        for field, merge in [[f'first_{key}', min], [f'last_{key}', max]]:
+            values = [value for value in [watermark.get(field),
+                                          exported_watermark.get(field)]
+                      if value is not None]
+            if values:
+                merged.update({field: merge(values)})
+        return merged
+
+    def __is_missing_first(self, watermarks):
+        # Manifests written before first_date / first_season were kept
+        # cannot tell which backfilled records were exported
+        return any(f'last_{key}' in watermark
+                   and f'first_{key}' not in watermark
+                   for watermark in watermarks.values()
+                   for key in ['date', 'season'])
+
+    def __load_manifest(self):
+        manifest_path = os.path.join(self.__path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {'format': None, 'exports': [], 'watermarks': {}}
+
+        with open(manifest_path, encoding='utf-8') as input_file:
+            return json.load(input_file)
+
+    def __save_manifest(self, manifest):
+        # Write to a temp file first so a crash never leaves half a
+        # manifest
+        os.makedirs(self.__path, exist_ok=True)
+        manifest_path = os.path.join(self.__path, 'manifest.json')
+        temp_path = f'{manifest_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as output_file:
+            json.dump(manifest, output_file)
+        os.replace(temp_path, manifest_path)
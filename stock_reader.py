@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+
+class StockReader:
+    # Read side of DBManage. Price history of many tickers is read in
+    # batched queries, filtered on the server, and turned straight into
+    # NumPy columns without building any DTO. Cached days of a ticker are
+    # dropped once the DBManage the reader shares writes new or changed
+    # days of it. Writes of other processes or DBManage instances are not
+    # seen, call clear_cache after them
+    __PRICE_FIELDS = ['open', 'close', 'high', 'low']
+
+    def __init__(self, db_manage, pricevolume_buckets=False, batch_size=200,
+                 cache_max_bytes=256 * 1024 * 1024):
+        self.__db_manage = db_manage
+        self.__pricevolume_buckets = pricevolume_buckets
+        self.__batch_size = batch_size
+        # ticker -> [start_date, end_date, write version, columns] of the
+        # range last read, least recently used first, evicted once the
+        # arrays take more than cache_max_bytes. Ranges inside the cached
+        # one are sliced from it
+        self.__cache = OrderedDict()
+        self.__cache_bytes = 0
+        self.__cache_max_bytes = cache_max_bytes
+        self.__lock = threading.Lock()
+
+    def get_prices(self, tickers, start_date, end_date, as_frame=False):
+        # Returns ticker -> {'date', 'open', 'close', 'high', 'low',
+        # 'volume'} NumPy arrays sorted by date, or one DataFrame with a
+        # ticker column when as_frame. Both dates are included, all
+        # tickers are read when tickers is None
+        if tickers is None:
+            tickers = self.get_tickers()
+
+        prices = {}
+        missing_tickers = []
+        for ticker in tickers:
+            columns = self.__get_cached(ticker, start_date, end_date)
+            if columns is None:
+                missing_tickers.append(ticker)
+            else:
+                prices.update({ticker: columns})
+
+        for i in range(0, len(missing_tickers), self.__batch_size):
+            batch = missing_tickers[i:i + self.__batch_size]
+            # Taken before the read, so days written meanwhile are read
+            # again next time
+            write_versions = {
+                ticker: self.__db_manage.get_write_version(ticker)
+                for ticker in batch}
+            with metrics.timer('db_read', query='prices', tickers=len(batch)):
+                date_info_lists = self.__read_buckets(
+                    batch, start_date, end_date) \
+                    if self.__pricevolume_buckets \
+                    else self.__read_date_info(batch, start_date, end_date)
+
+            for ticker in batch:
+                columns = self.__build_columns(
+                    date_info_lists.get(ticker, []))
+                self.__put_cached(ticker, [start_date, end_date,
+                                           write_versions[ticker], columns])
+                prices.update({ticker: columns})
+
+        prices = {ticker: prices[ticker] for ticker in tickers}
+        if not as_frame:
+            return prices
+
+        frames = [pd.DataFrame(columns).assign(ticker=ticker)
+                  for ticker, columns in prices.items()]
+        if len(frames) <= 0:
+            return pd.DataFrame(
+                columns=['ticker', 'date'] + self.__PRICE_FIELDS
+                + ['volume'])
+        frame = pd.concat(frames, ignore_index=True)
+        return frame[['ticker', 'date'] + self.__PRICE_FIELDS + ['volume']]
+
+    def get_price_panel(self, tickers, start_date, end_date, field='close'):
+        # One field of every ticker as a date x ticker DataFrame
+        prices = self.get_prices(tickers, start_date, end_date)
+        return pd.DataFrame({
+            ticker: pd.Series(columns[field], index=columns['date'])
+            for ticker, columns in prices.items()}).sort_index()
+
+    def get_tickers(self):
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.collection_name)
+        return [document['ticker'] for document in
+                collection.find({}, {'ticker': 1, '_id': 0})]
+
+    def clear_cache(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.__cache_bytes = 0
+
+    def __read_date_info(self, tickers, start_date, end_date):
+        # $filter drops the days out of range before they leave the
+        # server
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.collection_name)
+        documents = collection.aggregate([
+            {'$match': {'ticker': {'$in': tickers}}},
+            {'$project': {
+                '_id': 0,
+                'ticker': 1,
+                'date_info': {'$filter': {
+                    'input': '$date_info',
+                    'cond': {'$and': [
+                        {'$gte': ['$$this.date', start_date]},
+                        {'$lte': ['$$this.date', end_date]}
+                    ]}
+                }}
+            }}
+        ])
+
+        return {document['ticker']: document.get('date_info') or []
+                for document in documents}
+
+    def __read_buckets(self, tickers, start_date, end_date):
+        collection = self.__db_manage.get_collection(
+            self.__db_manage.bucket_collection_name)
+        buckets = collection.find(
+            {'ticker': {'$in': tickers},
+             'year': {'$gte': int(start_date[:4]),
+                      '$lte': int(end_date[:4])}},
+            {'ticker': 1, 'days': 1, '_id': 0})
+
+        date_info_lists = {}
+        for bucket in buckets:
+            date_info_list = date_info_lists.setdefault(bucket['ticker'], [])
+            for date, day in bucket['days'].items():
+                if start_date <= date <= end_date:
+                    date_info = {'date': date}
+                    date_info.update(day)
+                    date_info_list.append(date_info)
+
+        return date_info_lists
+
+    def __build_columns(self, date_info_list):
+        dates = np.array([date_info['date'] for date_info in date_info_list],
+                         dtype='datetime64[D]')
+        columns = {
+            field: np.array([date_info.get(field)
+                             for date_info in date_info_list],
+                            dtype='float64')
+            for field in self.__PRICE_FIELDS
+        }
+        columns.update({'volume': np.array(
+            [date_info.get('volume') or 0 for date_info in date_info_list],
+            dtype='int64')})
+
+        # Sorted by date, a date stored more than once keeps the last
+        # value written
+        order = np.argsort(dates, kind='stable')[::-1]
+        [dates, unique_index] = np.unique(dates[order], return_index=True)
+        order = order[unique_index]
+
+        sorted_columns = {'date': dates}
+        sorted_columns.update({field: values[order]
+                               for field, values in columns.items()})
+        # Shared with the cache, so callers must not change them
+        for values in sorted_columns.values():
+            values.flags.writeable = False
+        return sorted_columns
+
+    def __get_cached(self, ticker, start_date, end_date):
+        write_version = self.__db_manage.get_write_version(ticker)
+        with self.__lock:
+            entry = self.__cache.get(ticker)
+            if entry is None:
+                return None
+            [cached_start_date, cached_end_date, cached_write_version,
+             columns] = entry
+            if cached_write_version != write_version:
+                self.__evict(ticker)
+                return None
+            if start_date < cached_start_date or end_date > cached_end_date:
+                return None
+            self.__cache.move_to_end(ticker)
+
+        if [start_date, end_date] == [cached_start_date, cached_end_date]:
+            return columns
+        start = np.searchsorted(columns['date'], np.datetime64(start_date))
+        end = np.searchsorted(columns['date'], np.datetime64(end_date),
+                              side='right')
+        # Views of read-only arrays, read-only as well
+        return {field: values[start:end] for field, values in columns.items()}
+
+    def __put_cached(self, ticker, entry):
+        size = self.__get_size(entry)
+        if size > self.__cache_max_bytes:
+            return
+
+        with self.__lock:
+            cached_entry = self.__cache.get(ticker)
+            # Keep a wider range of the same days
+            if cached_entry is not None and cached_entry[2] == entry[2] \
+                    and cached_entry[0] <= entry[0] \
+                    and cached_entry[1] >= entry[1]:
+                return
+            self.__evict(ticker)
+            self.__cache.update({ticker: entry})
+            self.__cache_bytes += size
+            while self.__cache_bytes > self.__cache_max_bytes:
+                [_, evicted_entry] = self.__cache.popitem(last=False)
+                self.__cache_bytes -= self.__get_size(evicted_entry)
+
+    def __evict(self, ticker):
+        entry = self.__cache.pop(ticker, None)
+        if entry is not None:
+            self.__cache_bytes -= self.__get_size(entry)
+
+    def __get_size(self, entry):
+        return sum(values.nbytes for values in entry[3].values())
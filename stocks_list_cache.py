@@ -0,0 +1,49 @@
+import json
+import os
+import time
+
+
+class StocksListCache:
+    def __init__(self, path, ttl_seconds=86400):
+        self.__path = path
+        self.__ttl_seconds = ttl_seconds
+        self.__entries = self.__load()
+
+    def get(self, url):
+        return self.__entries.get(url)
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.__ttl_seconds
+
+    def put(self, url, stocks, etag=None, last_modified=None,
+            content_hash=None):
+        self.__entries.update({url: {
+            'fetched_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'stocks': stocks
+        }})
+        self.__save()
+
+    def touch(self, url):
+        self.__entries[url]['fetched_at'] = time.time()
+        self.__save()
+
+    def __load(self):
+        if not os.path.exists(self.__path):
+            return {}
+
+        try:
+            with open(self.__path, encoding='utf-8') as input_file:
+                return json.load(input_file)
+        except ValueError:
+            print(f'## Warning: Stocks list cache {self.__path} is broken!')
+            return {}
+
+    def __save(self):
+        # Write to a temp file first so a crash never leaves half a cache
+        temp_path = f'{self.__path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as output_file:
+            json.dump(self.__entries, output_file, ensure_ascii=False)
+        os.replace(temp_path, self.__path)
@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from dto import StockRecords
+from metrics import metrics
+from rate_limiter import ProviderUnavailable
+
+
+class StreamingBackfill:
+    # Price and volume of long ranges, one chunk of years of a ticker at a
+    # time. Each chunk is fetched, parsed and written in batches of
+    # batch_size days before the next one is fetched, so memory only
+    # depends on workers, chunk_years and batch_size, not on the length of
+    # history or the number of tickers
+    __DATE_FORMAT = '%Y-%m-%d'
+    __MAX_ATTEMPTS = 3
+
+    def __init__(self, stock_crawler, db_manage, checkpoint=None,
+                 workers=1, chunk_years=1, batch_size=250):
+        self.__stock_crawler = stock_crawler
+        self.__db_manage = db_manage
+        self.__checkpoint = checkpoint
+        self.__workers = workers
+        self.__chunk_years = chunk_years
+        self.__batch_size = batch_size
+
+    def update(self, date_ranges):
+        # date_ranges is ticker -> [start_date, end_date]. Failed tickers go
+        # to the checkpoint's dead letters when there is one
+        if len(date_ranges) <= 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            # Only as many tickers as workers are in flight at a time
+            for _ in executor.map(self.__update_ticker, date_ranges,
+                                  date_ranges.values()):
+                pass
+
+    def __update_ticker(self, ticker, date_range):
+        print(f'Start stream ticker : {ticker}')
+        timer_start = time.time()
+        day_count = 0
+        try:
+            for [chunk_start, chunk_end] in self.__iter_chunks(*date_range):
+                day_count += self.__update_chunk_with_retry(
+                    ticker, chunk_start, chunk_end)
+        except Exception as e:
+            if not self.__checkpoint:
+                raise
+            self.__checkpoint.record(ticker, e)
+            return
+
+        if self.__checkpoint:
+            self.__checkpoint.record(ticker)
+        timer_end = time.time()
+        pass_time = Decimal(timer_end - timer_start).quantize(
+            Decimal('.1'), rounding=ROUND_HALF_UP)
+        print(f'Stream {ticker} completed, {day_count} days ({pass_time} s)')
+
+    def __update_chunk_with_retry(self, ticker, start_date, end_date):
+        # A retried chunk is written again from its start, the batches
+        # already written are left unchanged
+        attempt = 0
+        while True:
+            try:
+                return self.__update_chunk(ticker, start_date, end_date)
+            except ProviderUnavailable as e:
+                # Wait for the provider without using up an attempt
+                print(e)
+                time.sleep(e.wait_seconds)
+                continue
+            except ValueError as v:
+                print(v)
+                error = v
+            except Exception as e:
+                print(f'Error: {e}')
+                print(f'Ticker {ticker} {start_date} ~ {end_date} retry')
+                error = e
+            metrics.increment('ticker_retries', ticker=ticker)
+            attempt += 1
+            if attempt >= self.__MAX_ATTEMPTS:
+                raise error
+
+    def __update_chunk(self, ticker, start_date, end_date):
+        day_count = 0
+        for batch in self.__iter_batches(ticker, start_date, end_date):
+            with metrics.timer('db_write', ticker=ticker):
+                self.__db_manage.execute(
+                    self.__db_manage.get_pricevolume_operations(batch))
+            day_count += len(batch.date_info)
+
+        return day_count
+
+    def __iter_batches(self, ticker, start_date, end_date):
+        fetch_range = self.__stock_crawler.get_price_and_vol_fetch_range(
+            ticker, start_date, end_date)
+        response = self.__stock_crawler.fetch_price_and_vol(
+            ticker, *fetch_range) if fetch_range else None
+        date_info_list = self.__stock_crawler.parse_price_and_vol(
+            ticker, response, [start_date, end_date], fetch_range).date_info
+        # The response is done with once it is parsed
+        del response
+
+        stock_name = self.__stock_crawler.stocks_list[ticker].stock_name
+        for i in range(0, len(date_info_list), self.__batch_size):
+            yield StockRecords(
+                ticker=ticker, stock_name=stock_name,
+                date_info=date_info_list[i:i + self.__batch_size])
+
+    def __iter_chunks(self, start_date, end_date):
+        # [start_date, end_date] split at the start of every chunk_years
+        # years, both dates of each chunk included
+        chunk_start = start_date
+        while chunk_start <= end_date:
+            next_start = f'{int(chunk_start[:4]) + self.__chunk_years}-01-01'
+            chunk_end = min(end_date, (
+                datetime.strptime(next_start, self.__DATE_FORMAT)
+                - timedelta(days=1)).strftime(self.__DATE_FORMAT))
+            yield [chunk_start, chunk_end]
+            chunk_start = next_start
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from checkpoint import RunCheckpoint
+
+
+class RunCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'update.checkpoint')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_incomplete_tickers_are_resumed(self):
+        checkpoint = RunCheckpoint(self.path)
+        checkpoint.start({'2330': ['2021-01-04', '2021-01-08'],
+                          '2317': ['2021-01-04', '2021-01-08'],
+                          '2454': ['2021-01-04', '2021-01-08']})
+        checkpoint.record('2330')
+        checkpoint.record('2317', error=ValueError('failed'))
+        checkpoint.close()
+
+        checkpoint = RunCheckpoint(self.path)
+        self.assertEqual(checkpoint.resume(),
+                         {'2317': ['2021-01-04', '2021-01-08'],
+                          '2454': ['2021-01-04', '2021-01-08']})
+        checkpoint.close()
+
+    def test_completed_run_is_planned_again(self):
+        checkpoint = RunCheckpoint(self.path)
+        checkpoint.start({'2330': ['2021-01-04', '2021-01-08']})
+        checkpoint.record('2330')
+        checkpoint.close()
+
+        for _ in range(2):
+            checkpoint = RunCheckpoint(self.path)
+            self.assertIsNone(checkpoint.resume())
+            checkpoint.start({'2330': ['2021-01-11', '2021-01-15']})
+            checkpoint.record('2330')
+            checkpoint.close()
+
+    def test_missing_journal_is_planned(self):
+        self.assertIsNone(RunCheckpoint(self.path).resume())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from db_manage import DBManage
+from dto import StockRecords
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class DBManageTest(unittest.TestCase):
+    def setUp(self):
+        self.db_instance = mongomock.MongoClient()['test']
+        self.db_manage = self.__create_db_manage()
+
+    def test_write_counts(self):
+        self.__write_days([['2021-01-04', 10.0], ['2021-01-05', 11.0]])
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 2, 'updated': 0, 'unchanged': 0})
+
+        self.__write_days([['2021-01-05', 12.0], ['2021-01-06', 13.0]])
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 3, 'updated': 1, 'unchanged': 0})
+
+        self.__write_days([['2021-01-04', 10.0], ['2021-01-06', 13.0]])
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 3, 'updated': 1, 'unchanged': 2})
+        self.assertEqual(self.__get_closes(), [
+            ['2021-01-04', 10.0], ['2021-01-05', 12.0],
+            ['2021-01-06', 13.0]])
+
+    def test_float_noise_is_unchanged(self):
+        self.__write_days([['2021-01-04', 10.0], ['2021-01-05', 0.3]])
+        self.db_manage = self.__create_db_manage()
+
+        # The overlapping day of the next run only differs by float noise
+        self.__write_days([['2021-01-05', 0.1 + 0.2], ['2021-01-06', 11.0]])
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 1, 'updated': 0, 'unchanged': 1})
+        self.assertEqual(self.db_manage.get_earliest_writes(),
+                         {'2330': {'first_date': '2021-01-06'}})
+
+    def test_nan_is_unchanged(self):
+        for _ in range(3):
+            self.db_manage = self.__create_db_manage()
+            self.__write_days([['2021-01-04', 10.0],
+                               ['2021-01-05', float('nan')]])
+
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 0, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(self.db_manage.get_earliest_writes(), {})
+
+    def test_duplicate_dates_are_collapsed(self):
+        self.__write_days([['2021-01-04', 10.0], ['2021-01-05', 11.0]])
+        self.db_instance['stock'].update_one(
+            {'ticker': '2330'}, {'$push': {'date_info': {
+                'date': '2021-01-05', 'open': 11.0, 'close': 11.0,
+                'high': 11.0, 'low': 11.0, 'volume': 1}}})
+        self.db_manage = self.__create_db_manage()
+
+        self.__write_days([['2021-01-05', 11.0]])
+        self.assertEqual(self.db_manage.get_write_counts(),
+                         {'inserted': 0, 'updated': 1, 'unchanged': 0})
+        self.assertEqual(self.__get_closes(),
+                         [['2021-01-04', 10.0], ['2021-01-05', 11.0]])
+
+    def __create_db_manage(self):
+        # Write counts are kept per DBManage, i.e. per update run
+        return DBManage(credential={'collection_name': 'stock'},
+                        db_instance=self.db_instance)
+
+    def __write_days(self, closes):
+        self.db_manage.execute(self.db_manage.get_pricevolume_operations(
+            StockRecords(ticker='2330', stock_name='TSMC', date_info=[
+                {'date': day, 'open': close, 'close': close, 'high': close,
+                 'low': close, 'volume': 1}
+                for day, close in closes])))
+
+    def __get_closes(self):
+        stock = self.db_instance['stock'].find_one({'ticker': '2330'})
+        return sorted([date_info['date'], date_info['close']]
+                      for date_info in stock['date_info'])
+
+
+if __name__ == '__main__':
+    unittest.main()
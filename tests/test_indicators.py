@@ -0,0 +1,129 @@
+import unittest
+from datetime import date, timedelta
+
+from db_manage import DBManage
+from dto import IncomeStatementRecord, StockRecords
+from indicators import IndicatorUpdater
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class IndicatorUpdaterTest(unittest.TestCase):
+    def setUp(self):
+        self.db_manage = DBManage(
+            credential={'collection_name': 'stock'},
+            db_instance=mongomock.MongoClient()['test'])
+
+    def test_revised_days_are_computed_again(self):
+        dates = self.__get_dates(200)
+        self.__write_days('2330', dates, [float(i) for i in range(200)])
+        self.__update_pricevolume(['2330'])
+
+        # Days already computed are rewritten in place
+        self.__write_days('2330', dates[150:153], [500.0, 400.0, 300.0])
+        self.__update_pricevolume(['2330'])
+
+        self.assertEqual(self.__get_indicators(),
+                         self.__get_recomputed_indicators())
+        self.assertAlmostEqual(
+            IndicatorUpdater(self.db_manage).get_series(
+                '2330', dates[152], dates[152])[0]['ma_5'],
+            (148 + 149 + 500 + 400 + 300) / 5)
+
+    def test_revised_days_before_the_tail_are_computed_again(self):
+        dates = self.__get_dates(400)
+        self.__write_days('2330', dates, [float(i) for i in range(400)])
+        self.__update_pricevolume(['2330'])
+
+        self.__write_days('2330', dates[10:12], [900.0, 800.0])
+        self.__write_days('2330', dates[-1:], [1.0])
+        self.__update_pricevolume(['2330'])
+
+        self.assertEqual(self.__get_indicators(),
+                         self.__get_recomputed_indicators())
+
+    def test_revised_seasons_are_computed_again(self):
+        seasons = [[year, season] for year in range(2015, 2021)
+                   for season in range(1, 5)]
+        self.__write_seasons('2330', seasons, [1.0] * len(seasons))
+        self.__update_income_statements(['2330'])
+
+        self.__write_seasons('2330', seasons[-3:-2], [5.0])
+        self.__update_income_statements(['2330'])
+
+        latest = IndicatorUpdater(self.db_manage).get_latest(['2330'])
+        self.assertEqual(latest['2330']['ttm_eps'], 8.0)
+
+    def __update_pricevolume(self, tickers):
+        IndicatorUpdater(self.db_manage).update_pricevolume(
+            tickers, self.db_manage.get_earliest_writes())
+        self.__start_run()
+
+    def __update_income_statements(self, tickers):
+        IndicatorUpdater(self.db_manage).update_income_statements(
+            tickers, self.db_manage.get_earliest_writes())
+        self.__start_run()
+
+    def __start_run(self):
+        # Earliest writes are kept per DBManage, i.e. per update run
+        self.db_manage = DBManage(
+            credential={'collection_name': 'stock'},
+            db_instance=self.db_manage.get_collection('stock').database)
+
+    def __get_indicators(self):
+        stock = self.db_manage.get_collection('stock').find_one(
+            {'ticker': '2330'}, {'_id': 0, 'indicators': 1})
+        buckets = list(self.db_manage.get_collection('stock_indicators').find(
+            {'ticker': '2330'}, {'_id': 0}).sort('year'))
+        return [self.__round(stock), self.__round(buckets)]
+
+    def __get_recomputed_indicators(self):
+        self.db_manage.get_collection('stock').update_many(
+            {}, {'$unset': {'indicators': ''}})
+        self.db_manage.get_collection('stock_indicators').delete_many({})
+        IndicatorUpdater(self.db_manage).update_pricevolume(['2330'])
+        return self.__get_indicators()
+
+    def __round(self, value):
+        if isinstance(value, dict):
+            return {key: self.__round(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.__round(item) for item in value]
+        if isinstance(value, float):
+            return round(value, 9)
+        return value
+
+    def __write_days(self, ticker, dates, closes):
+        self.db_manage.execute(self.db_manage.get_pricevolume_operations(
+            StockRecords(ticker=ticker, stock_name=ticker, date_info=[
+                {'date': day, 'open': close, 'close': close, 'high': close,
+                 'low': close, 'volume': 1}
+                for day, close in zip(dates, closes)])))
+
+    def __write_seasons(self, ticker, seasons, eps):
+        income_statements = []
+        for [year, season], season_eps in zip(seasons, eps):
+            income_statement = IncomeStatementRecord(year, season)
+            income_statement.eps = season_eps
+            income_statement.revenue = 100
+            income_statements.append(income_statement)
+        self.db_manage.execute(self.db_manage.get_income_statements_operations(
+            StockRecords(ticker=ticker, stock_name=ticker,
+                         income_statements=income_statements)))
+
+    def __get_dates(self, count):
+        dates = []
+        day = date(2020, 1, 1)
+        while len(dates) < count:
+            if day.weekday() < 5:
+                dates.append(day.isoformat())
+            day += timedelta(days=1)
+        return dates
+
+
+if __name__ == '__main__':
+    unittest.main()
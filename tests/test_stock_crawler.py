@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from stock_crawler import StockCrawler
+from stocks_list_cache import StocksListCache
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StockCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        cache_path = os.path.join(self.temp_dir.name, 'stocks_list.cache')
+        cache = StocksListCache(cache_path)
+        cache.put('http://isin.twse.com.tw/isin/C_public.jsp?strMode=2', {
+            '2330': {'stock_name': 'TSMC', 'sector': None, 'market': 'TWSE'}
+        })
+        cache.put('https://isin.twse.com.tw/isin/C_public.jsp?strMode=4', {})
+        self.crawler = StockCrawler(
+            http_session=object(),
+            api_config={'stocks_list_cache_path': cache_path})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_null_rows_are_dropped(self):
+        stock_dto = self.crawler.parse_price_and_vol('2330', FakeResponse(
+            'Date,Open,High,Low,Close,Adj Close,Volume\n'
+            '2021-01-04,530.0,536.5,529.0,536.0,520.1,39489959\n'
+            '2021-01-05,null,null,null,null,null,null\n'
+            '2021-01-06,555.0,555.0,541.0,549.0,532.7,50279170\n'))
+
+        self.assertEqual(stock_dto.date_info, [
+            {'date': '2021-01-04', 'open': 530.0, 'close': 536.0,
+             'high': 536.5, 'low': 529.0, 'volume': 39490},
+            {'date': '2021-01-06', 'open': 555.0, 'close': 549.0,
+             'high': 555.0, 'low': 541.0, 'volume': 50279}])
+
+    def test_prices_are_rounded_half_up(self):
+        stock_dto = self.crawler.parse_price_and_vol('2330', FakeResponse(
+            'Date,Open,High,Low,Close,Adj Close,Volume\n'
+            '2021-01-04,0.125,1.005,2.675,3.3349999,3.3,1499\n'))
+
+        self.assertEqual(stock_dto.date_info, [
+            {'date': '2021-01-04', 'open': 0.13, 'close': 3.33,
+             'high': 1.0, 'low': 2.67, 'volume': 1}])
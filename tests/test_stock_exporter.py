@@ -0,0 +1,157 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from db_manage import DBManage
+from dto import IncomeStatementRecord, StockRecords
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+try:
+    import pyarrow.dataset as ds
+    from stock_exporter import StockExporter
+except ImportError:
+    ds = None
+
+
+class ExportClock:
+    # Export ids are timestamps in seconds, one second per export keeps
+    # them apart without waiting
+    def __init__(self):
+        self.__now = datetime(2021, 1, 1)
+
+    def utcnow(self):
+        self.__now += timedelta(seconds=1)
+        return self.__now
+
+
+@unittest.skipIf(mongomock is None or ds is None,
+                 'needs mongomock and pyarrow')
+class StockExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'export')
+        self.db_instance = mongomock.MongoClient()['test']
+        clock = mock.patch('stock_exporter.datetime', ExportClock())
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_appended_and_backfilled_records_are_exported(self):
+        for file_format in ['parquet', 'arrow']:
+            with self.subTest(file_format=file_format):
+                self.__check_incremental_export(file_format, False)
+
+    def test_buckets_are_exported(self):
+        self.__check_incremental_export('parquet', True)
+
+    def test_manifest_without_first_watermarks_is_exported_again(self):
+        db_manage = self.__create_db_manage(False)
+        self.__write(db_manage, '2330', self.__get_dates(2020, 3),
+                     [[2020, 1], [2020, 2]])
+        exporter = StockExporter(db_manage, self.path)
+        self.assertEqual(exporter.export(), [3, 2])
+        self.assertEqual(exporter.export(), [0, 0])
+
+        # Written before first_date / first_season were kept
+        manifest_path = os.path.join(self.path, 'manifest.json')
+        with open(manifest_path, encoding='utf-8') as input_file:
+            manifest = json.load(input_file)
+        for watermark in manifest['watermarks'].values():
+            watermark.pop('first_date')
+            watermark.pop('first_season')
+        with open(manifest_path, 'w', encoding='utf-8') as output_file:
+            json.dump(manifest, output_file)
+
+        self.assertEqual(exporter.export(), [3, 2])
+        self.assertEqual(self.__read_keys(self.path, 'parquet'),
+                         self.__get_keys())
+        self.assertEqual(exporter.export(), [0, 0])
+
+    def __check_incremental_export(self, file_format, pricevolume_buckets):
+        self.db_instance.drop_collection('stock')
+        self.db_instance.drop_collection('stock_buckets')
+        db_manage = self.__create_db_manage(pricevolume_buckets)
+        for ticker in ['2317', '2330', '2454']:
+            self.__write(db_manage, ticker, self.__get_dates(2020, 5),
+                         [[2020, 1], [2020, 2]])
+        # Tickers are read in batches of 2
+        path = os.path.join(self.path, file_format)
+        exporter = StockExporter(
+            db_manage, path, file_format=file_format,
+            pricevolume_buckets=pricevolume_buckets, batch_size=2)
+        self.assertEqual(exporter.export(), [15, 6])
+
+        # Appended to one ticker and backfilled to others
+        self.__write(db_manage, '2330', self.__get_dates(2021, 2),
+                     [[2020, 3]])
+        self.__write(db_manage, '2317', self.__get_dates(2019, 3), [])
+        self.__write(db_manage, '2454', [], [[2019, 4]])
+        self.assertEqual(exporter.export(), [5, 2])
+
+        self.assertEqual(self.__read_keys(path, file_format),
+                         self.__get_keys())
+        self.assertEqual(exporter.export(), [0, 0])
+
+        self.assertEqual(exporter.export(full=True), [20, 8])
+        self.assertEqual(self.__read_keys(path, file_format),
+                         self.__get_keys())
+
+    def __create_db_manage(self, pricevolume_buckets):
+        return DBManage(pricevolume_buckets=pricevolume_buckets,
+                        credential={'collection_name': 'stock'},
+                        db_instance=self.db_instance)
+
+    def __write(self, db_manage, ticker, dates, seasons):
+        income_statements = []
+        for [year, season] in seasons:
+            income_statement = IncomeStatementRecord(year, season)
+            income_statement.eps = 1.0
+            income_statements.append(income_statement)
+        db_manage.execute(db_manage.get_insert_stock_operations(
+            StockRecords(ticker=ticker, stock_name=ticker, date_info=[
+                {'date': day, 'open': 1.0, 'close': 1.0, 'high': 1.0,
+                 'low': 1.0, 'volume': 1}
+                for day in dates], income_statements=income_statements)))
+
+    def __get_keys(self):
+        # [days, seasons] stored, sorted by ticker and key
+        days = []
+        seasons = []
+        for stock in self.db_instance['stock'].find():
+            days.extend([stock['ticker'], date_info['date']]
+                        for date_info in stock.get('date_info') or [])
+            seasons.extend(
+                [stock['ticker'], income_statement['year'],
+                 income_statement['season']]
+                for income_statement in stock.get('income_statements') or [])
+        for bucket in self.db_instance['stock_buckets'].find():
+            days.extend([bucket['ticker'], date] for date in bucket['days'])
+        return [sorted(days), sorted(seasons)]
+
+    def __read_keys(self, path, file_format):
+        # [days, seasons] exported, duplicates included
+        dataset_format = 'ipc' if file_format == 'arrow' else 'parquet'
+        days = ds.dataset(os.path.join(path, 'price_and_vol'),
+                          format=dataset_format, partitioning='hive') \
+            .to_table(columns=['ticker', 'date']).to_pylist()
+        seasons = ds.dataset(os.path.join(path, 'income_statements'),
+                             format=dataset_format, partitioning='hive') \
+            .to_table(columns=['ticker', 'year', 'season']).to_pylist()
+        return [sorted([day['ticker'], day['date']] for day in days),
+                sorted([season['ticker'], season['year'], season['season']]
+                       for season in seasons)]
+
+    def __get_dates(self, year, count):
+        return [f'{year}-01-{day:02d}' for day in range(4, 4 + count)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+from db_manage import DBManage
+from dto import StockRecords
+from stock_reader import StockReader
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+@unittest.skipIf(mongomock is None, 'needs mongomock')
+class StockReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.db_instance = mongomock.MongoClient()['test']
+        self.db_manage = self.__create_db_manage()
+        self.__write_days(self.db_manage, [
+            ['2021-01-04', 10.0], ['2021-01-05', 11.0],
+            ['2021-01-06', 12.0], ['2021-01-07', 13.0]])
+
+    def test_written_days_are_read_again(self):
+        reader = StockReader(self.db_manage)
+        self.assertEqual(self.__get_closes(reader, '2021-01-07'),
+                         [10.0, 11.0, 12.0, 13.0])
+
+        # A revised day and an appended one
+        self.__write_days(self.db_manage, [['2021-01-05', 20.0],
+                                           ['2021-01-08', 14.0]])
+        self.assertEqual(self.__get_closes(reader, '2021-01-08'),
+                         [10.0, 20.0, 12.0, 13.0, 14.0])
+        self.assertEqual(self.__get_closes(reader, '2021-01-07'),
+                         [10.0, 20.0, 12.0, 13.0])
+
+    def test_unchanged_days_stay_cached(self):
+        reader = StockReader(self.db_manage)
+        prices = reader.get_prices(['2330'], '2021-01-04', '2021-01-07')
+
+        self.__write_days(self.db_manage, [['2021-01-07', 13.0]])
+        self.assertIs(
+            reader.get_prices(['2330'], '2021-01-04', '2021-01-07')['2330'],
+            prices['2330'])
+
+    def test_ranges_inside_the_cached_one_are_sliced(self):
+        reader = StockReader(self.db_manage)
+        reader.get_prices(['2330'], '2021-01-01', '2021-01-31')
+        self.db_instance['stock'].delete_many({})
+
+        prices = reader.get_prices(['2330'], '2021-01-05', '2021-01-06')
+        self.assertEqual(prices['2330']['close'].tolist(), [11.0, 12.0])
+        self.assertEqual(prices['2330']['date'].astype(str).tolist(),
+                         ['2021-01-05', '2021-01-06'])
+        self.assertFalse(prices['2330']['close'].flags.writeable)
+
+    def test_other_writers_need_clear_cache(self):
+        reader = StockReader(self.db_manage)
+        self.__get_closes(reader, '2021-01-07')
+
+        self.__write_days(self.__create_db_manage(), [['2021-01-05', 20.0]])
+        self.assertEqual(self.__get_closes(reader, '2021-01-07'),
+                         [10.0, 11.0, 12.0, 13.0])
+        reader.clear_cache()
+        self.assertEqual(self.__get_closes(reader, '2021-01-07'),
+                         [10.0, 20.0, 12.0, 13.0])
+
+    def __create_db_manage(self):
+        return DBManage(credential={'collection_name': 'stock'},
+                        db_instance=self.db_instance)
+
+    def __write_days(self, db_manage, closes):
+        db_manage.execute(db_manage.get_pricevolume_operations(
+            StockRecords(ticker='2330', stock_name='TSMC', date_info=[
+                {'date': day, 'open': close, 'close': close, 'high': close,
+                 'low': close, 'volume': 1}
+                for day, close in closes])))
+
+    def __get_closes(self, reader, end_date):
+        return reader.get_prices(
+            ['2330'], '2021-01-04', end_date)['2330']['close'].tolist()
+
+
+if __name__ == '__main__':
+    unittest.main()
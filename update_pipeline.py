@@ -0,0 +1,217 @@
+from functools import partial
+from itertools import zip_longest
+import queue
+import threading
+
+from metrics import metrics
+from rate_limiter import ProviderUnavailable
+
+
+class UpdatePipeline:
+    # Price and volume and income statement jobs share the fetch workers,
+    # each provider's throttle decides how fast its own jobs go
+    __MAX_ATTEMPTS = 3
+
+    def __init__(self, stock_crawler, db_manage, watermarks, workers=4,
+                 bulk_writer=None):
+        self.__stock_crawler = stock_crawler
+        self.__db_manage = db_manage
+        self.__watermarks = watermarks
+        self.__workers = workers
+        self.__bulk_writer = bulk_writer
+        self.__jobs = {}
+
+        # Fetch queue is unbounded since it only holds tickers, the queues
+        # between stages are bounded to keep fetched responses in check
+        self.__fetch_queue = queue.Queue()
+        self.__parse_queue = queue.Queue(maxsize=workers * 2)
+        self.__write_queue = queue.Queue(maxsize=workers * 2)
+
+        self.__state = threading.Condition()
+        self.__pending = 0
+        self.__error = None
+
+    def run(self, jobs):
+        # jobs is job type -> [ranges, checkpoint]. 'pricevolume' ranges
+        # are ticker -> [start_date, end_date], 'income_statements' ranges
+        # are ticker -> [start_year, start_season, end_year, end_season].
+        # Failed tickers go to the job's checkpoint's dead letters instead
+        # of stopping the run when there is one
+        self.__jobs = jobs
+        # Alternate the job types so every provider is busy from the start
+        for items in zip_longest(*[
+                [(job_type, ticker, 0) for ticker in ranges]
+                for job_type, [ranges, _] in jobs.items()]):
+            for item in items:
+                if item is None:
+                    continue
+                self.__pending += 1
+                self.__fetch_queue.put(item)
+
+        threads = [threading.Thread(target=self.__fetch_stage, daemon=True)
+                   for _ in range(self.__workers)]
+        threads.append(
+            threading.Thread(target=self.__parse_stage, daemon=True))
+        threads.append(
+            threading.Thread(target=self.__write_stage, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        with self.__state:
+            self.__state.wait_for(
+                lambda: self.__pending <= 0 or self.__error is not None)
+
+        if self.__error is not None:
+            raise self.__error
+
+        for _ in range(self.__workers):
+            self.__fetch_queue.put(None)
+        self.__parse_queue.put(None)
+        self.__write_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def __fetch_stage(self):
+        while True:
+            item = self.__fetch_queue.get()
+            if item is None:
+                return
+            [job_type, ticker, attempt] = item
+
+            try:
+                watermark = self.__watermarks.get(ticker)
+                ticker_range = self.__jobs[job_type][0][ticker]
+
+                # StockCrawler waits for the provider's rate limit, no
+                # request when the raw data cache has the whole range
+                if job_type == 'pricevolume':
+                    fetch_range = self.__stock_crawler \
+                        .get_price_and_vol_fetch_range(ticker, *ticker_range)
+                    response = self.__stock_crawler.fetch_price_and_vol(
+                        ticker, *fetch_range) if fetch_range else None
+                else:
+                    fetch_range = self.__stock_crawler \
+                        .get_income_statements_fetch_range(
+                            ticker, *ticker_range)
+                    response = self.__stock_crawler.fetch_income_statements(
+                        ticker, *fetch_range) if fetch_range else None
+            except ProviderUnavailable as e:
+                self.__defer(job_type, ticker, attempt, e.wait_seconds)
+                continue
+            except Exception as e:
+                self.__retry(job_type, ticker, attempt, e)
+                continue
+
+            self.__parse_queue.put(
+                (job_type, ticker, attempt, watermark is not None, response,
+                 fetch_range))
+
+    def __parse_stage(self):
+        while True:
+            item = self.__parse_queue.get()
+            if item is None:
+                return
+            [job_type, ticker, attempt, is_existing, response,
+             fetch_range] = item
+
+            try:
+                ticker_range = self.__jobs[job_type][0][ticker]
+                if job_type == 'pricevolume':
+                    dto = self.__stock_crawler.parse_price_and_vol(
+                        ticker, response, ticker_range, fetch_range)
+                else:
+                    dto = self.__stock_crawler.parse_income_statements_dto(
+                        ticker, response, ticker_range, fetch_range)
+            except ValueError as v:
+                # Yahoo finance is parked by the crawler until it is
+                # expected to be back
+                print(v)
+                self.__retry(job_type, ticker, attempt)
+                continue
+            except Exception as e:
+                self.__retry(job_type, ticker, attempt, e)
+                continue
+
+            self.__write_queue.put(
+                (job_type, ticker, attempt, is_existing, dto))
+
+    def __write_stage(self):
+        while True:
+            item = self.__write_queue.get()
+            if item is None:
+                return
+            [job_type, ticker, attempt, is_existing, dto] = item
+
+            try:
+                if self.__bulk_writer:
+                    if not is_existing:
+                        operations = \
+                            self.__db_manage.get_insert_stock_operations(dto)
+                    elif job_type == 'pricevolume':
+                        operations = \
+                            self.__db_manage.get_pricevolume_operations(dto)
+                    else:
+                        operations = self.__db_manage \
+                            .get_income_statements_operations(dto)
+                    self.__bulk_writer.add(
+                        ticker, operations, on_complete=partial(
+                            self.__on_written, job_type, ticker, attempt))
+                    continue
+                elif not is_existing:
+                    self.__db_manage.insert_stock(dto)
+                elif job_type == 'pricevolume':
+                    self.__db_manage.update_pricevolume(dto)
+                else:
+                    self.__db_manage.update_income_statements(dto)
+            except Exception as e:
+                self.__retry(job_type, ticker, attempt, e)
+                continue
+
+            self.__complete(job_type, ticker)
+
+    def __on_written(self, job_type, ticker, attempt, error):
+        if error is not None:
+            self.__retry(job_type, ticker, attempt, error)
+        else:
+            self.__complete(job_type, ticker)
+
+    def __complete(self, job_type, ticker, error=None):
+        checkpoint = self.__jobs[job_type][1]
+        if checkpoint:
+            checkpoint.record(ticker, error)
+        with self.__state:
+            self.__pending -= 1
+            self.__state.notify_all()
+
+    def __fail(self, error):
+        with self.__state:
+            if self.__error is None:
+                self.__error = error
+            self.__state.notify_all()
+
+    def __retry(self, job_type, ticker, attempt, error=None):
+        metrics.increment('ticker_retries', ticker=ticker)
+        if error is not None:
+            print(f'Error: {error}')
+            print(f'Ticker {ticker} retry')
+
+        if attempt + 1 >= self.__MAX_ATTEMPTS:
+            if self.__jobs[job_type][1]:
+                self.__complete(
+                    job_type, ticker, error if error is not None
+                    else Exception('Retried 3 times still fail'))
+            else:
+                self.__fail(Exception('Retried 3 times still fail'))
+            return
+
+        self.__fetch_queue.put((job_type, ticker, attempt + 1))
+
+    def __defer(self, job_type, ticker, attempt, wait_seconds):
+        # The provider is parked, put the ticker back once it is expected
+        # to be back and go on with the other tickers, without using up
+        # an attempt
+        timer = threading.Timer(
+            wait_seconds, self.__fetch_queue.put,
+            args=[(job_type, ticker, attempt)])
+        timer.daemon = True
+        timer.start()
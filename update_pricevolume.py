@@ -1,9 +1,7 @@
 import argparse
-from datetime import datetime, date, timedelta
-import time
 
-from stock_crawler import StockCrawler
-from db_manage import DBManage
+from update_runner import UpdateRunner, add_common_arguments, \
+    add_pricevolume_arguments
 
 
 def arg_parse():
@@ -23,95 +21,16 @@ def arg_parse():
         'format should be "yyyy-mm-dd"'
     )
     parser.add_argument(
-        '-l', '--latest',
-        dest='to_latest',
-        action='store_true',
-        default=False,
-        help='Update to latest info'
+        '--checkpoint',
+        dest='pricevolume_checkpoint_path',
+        type=str,
+        default='.\\update_pricevolume.checkpoint',
+        help='File the run state is saved to for --resume'
     )
+    add_pricevolume_arguments(parser)
+    add_common_arguments(parser)
 
     return parser.parse_args()
 
 
-def get_start_end_date(ticker_obj, arg_options):
-    time_format = '%Y-%m-%d'
-
-    start_date = arg_options.start_date
-    end_date = arg_options.end_date
-
-    if not ticker_obj or len(ticker_obj['date_info']) <= 0:
-        return[arg_options.start_date, arg_options.end_date]
-    ticker_date_info = ticker_obj['date_info']
-    ticker_date_info.sort(key=lambda x: x['date'])
-
-    db_first_date = ticker_date_info[0]['date']
-    db_last_date = ticker_date_info[len(ticker_date_info) - 1]['date']
-
-    if arg_options.to_latest:
-        db_last_datetime = datetime.strptime(db_last_date, time_format)
-        today_date = str((datetime.today() - timedelta(hours=9)).date())
-        if db_last_date == today_date:
-            return [None, None]
-        # Friday (Skip Saturday and Sunday if last day is Friday)
-        if db_last_datetime.weekday() == 4:
-            db_last_plus_two_date = (
-                db_last_datetime + timedelta(days=2)).strftime(time_format)
-            if today_date > db_last_date \
-                    and today_date <= db_last_plus_two_date:
-                return [None, None]
-
-        print(f'The latest date in db is {db_last_date}')
-        return [db_last_date, today_date]
-
-    if end_date > db_last_date:
-        start_date = db_last_date \
-            if start_date >= db_first_date else start_date
-    elif start_date < db_first_date:
-        end_date = db_first_date \
-            if end_date <= db_last_date else end_date
-    else:
-        return [None, None]
-
-    return [start_date, end_date]
-
-
-arg_options = arg_parse()
-stock_crawler = StockCrawler()
-db_manage = DBManage()
-
-pv_collection = db_manage.get_collection(db_manage.collection_name)
-for ticker in stock_crawler.stocks_list:
-    for attempt in range(0, 3):
-        try:
-            ticker_obj = pv_collection.find_one({'ticker': ticker})
-            [start_date, end_date] = get_start_end_date(
-                ticker_obj, arg_options)
-
-            if not start_date or not end_date:
-                break
-
-            dto = stock_crawler.get_price_and_vol(
-                ticker, start_date, end_date)
-
-            if ticker_obj:
-                db_manage.update_pricevolume(dto)
-            else:
-                db_manage.insert_stock(dto)
-
-            time.sleep(300/1000)
-
-        except ValueError as v:
-            print(v)
-            time.sleep(120)
-            continue
-        except Exception as e:
-            print(f'Error: {e}')
-            print(f'Ticker {ticker} wait for 5(s) and retry')
-            time.sleep(5)
-            continue
-        else:
-            break
-    else:
-        raise Exception('Retried 3 times still fail')
-
-print('All price volume update completed')
+UpdateRunner(arg_parse(), ['pricevolume']).run()
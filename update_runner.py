@@ -0,0 +1,533 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import json
+from datetime import datetime, date, timedelta
+from functools import partial
+from itertools import zip_longest
+
+from stock_crawler import StockCrawler
+from db_manage import DBManage
+from bulk_writer import BulkWriter
+from checkpoint import RunCheckpoint
+from work_queue import WorkQueue
+from update_pipeline import UpdatePipeline
+from market_snapshot import MarketSnapshotUpdater
+from streaming_backfill import StreamingBackfill
+from income_statements_bulk import IncomeStatementsBulkUpdater
+from indicators import IndicatorUpdater
+from metrics import metrics
+
+
+def add_common_arguments(parser):
+    parser.add_argument(
+        '-l', '--latest',
+        dest='to_latest',
+        action='store_true',
+        default=False,
+        help='Update to latest info'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='Number of concurrent fetch workers, '
+        'run tickers one by one when set to 1'
+    )
+    parser.add_argument(
+        '--batch-size',
+        dest='batch_size',
+        type=int,
+        default=0,
+        help='Batch writes of many tickers into one bulk write of up to '
+        'this many operations, write each ticker right away when set to 0'
+    )
+    parser.add_argument(
+        '--batch-seconds',
+        dest='batch_seconds',
+        type=float,
+        default=5,
+        help='Max seconds a batched write waits before it is flushed'
+    )
+    parser.add_argument(
+        '-a', '--async',
+        dest='use_async',
+        action='store_true',
+        default=False,
+        help='Update all tickers concurrently on one asyncio event loop, '
+        'needs aiohttp and motor'
+    )
+    parser.add_argument(
+        '--max-connections',
+        dest='max_connections',
+        type=int,
+        default=10,
+        help='Max concurrent connections to each host with --async'
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        default=False,
+        help='Only update the tickers the last interrupted or failed run '
+        'did not complete, with the ranges it planned'
+    )
+    parser.add_argument(
+        '--queue',
+        dest='queue_run',
+        type=str,
+        default=None,
+        help='Share the tickers of this run id with every other node '
+        'started with the same --queue, through a work queue in Mongo'
+    )
+    parser.add_argument(
+        '--queue-batch',
+        dest='queue_batch',
+        type=int,
+        default=100,
+        help='Tickers claimed from the work queue at a time'
+    )
+    parser.add_argument(
+        '--lease-seconds',
+        dest='lease_seconds',
+        type=int,
+        default=300,
+        help='Seconds a claimed ticker is kept from other nodes unless '
+        'this node heartbeats, reclaimed by other nodes afterwards'
+    )
+    parser.add_argument(
+        '--api-config',
+        dest='api_config_path',
+        type=str,
+        default=None,
+        help='api.config to use, e.g. each node\'s own FinMind token'
+    )
+    parser.add_argument(
+        '--raw-cache',
+        dest='raw_cache_path',
+        type=str,
+        default=None,
+        help='Directory of the local Parquet cache of provider records, '
+        'only the ranges missing from it are fetched (needs pyarrow)'
+    )
+    parser.add_argument(
+        '--indicators',
+        dest='update_indicators',
+        action='store_true',
+        default=False,
+        help='Update moving averages, volatility and TTM EPS / revenue of '
+        'the updated tickers once they are written'
+    )
+    parser.add_argument(
+        '--metrics-log',
+        dest='metrics_log',
+        type=str,
+        default=None,
+        help='Append per-stage timings and counters to this JSON-lines '
+        'file and print a summary at the end of the run'
+    )
+    parser.add_argument(
+        '--metrics-prom',
+        dest='metrics_prom',
+        type=str,
+        default=None,
+        help='Write the end of run summary to this Prometheus textfile'
+    )
+
+
+def add_pricevolume_arguments(parser):
+    parser.add_argument(
+        '-r', '--rate',
+        dest='max_rate',
+        type=float,
+        default=None,
+        help='Max Yahoo finance requests per second, lowered on its own '
+        'when Yahoo finance throttles. Default: rate_limits in api.config '
+        'or 3'
+    )
+    parser.add_argument(
+        '-b', '--buckets',
+        dest='use_buckets',
+        action='store_true',
+        default=False,
+        help='Store price and volume in yearly bucket documents'
+    )
+    parser.add_argument(
+        '--snapshot',
+        dest='use_snapshot',
+        action='store_true',
+        default=False,
+        help='Update from TWSE / TPEx market-wide daily quotes, only '
+        'tickers with a longer gap than --max-gap use Yahoo finance'
+    )
+    parser.add_argument(
+        '--max-gap',
+        dest='max_gap',
+        type=int,
+        default=7,
+        help='Max days a ticker can be behind to be updated from '
+        'market snapshots'
+    )
+    parser.add_argument(
+        '--stream',
+        dest='use_streaming',
+        action='store_true',
+        default=False,
+        help='Backfill each ticker one chunk of years at a time with '
+        'bounded memory, written in batches of --stream-batch days'
+    )
+    parser.add_argument(
+        '--chunk-years',
+        dest='chunk_years',
+        type=int,
+        default=1,
+        help='Years of a ticker fetched at a time with --stream'
+    )
+    parser.add_argument(
+        '--stream-batch',
+        dest='stream_batch',
+        type=int,
+        default=250,
+        help='Days written in one bulk write with --stream'
+    )
+
+
+def add_income_statements_arguments(parser):
+    parser.add_argument(
+        '--by-date',
+        dest='by_date',
+        action='store_true',
+        default=False,
+        help='Fetch each reporting date for all tickers in one request '
+        'instead of one request per ticker'
+    )
+
+
+class UpdateRunner:
+    # Runs price and volume and / or income statement updates off one
+    # stock list, one Mongo connection and one range planning query. Job
+    # types are 'pricevolume' (options of add_pricevolume_arguments,
+    # start_date / end_date, pricevolume_checkpoint_path) and
+    # 'income_statements' (options of add_income_statements_arguments,
+    # start_season / end_season, income_statements_checkpoint_path)
+    def __init__(self, arg_options, job_types):
+        self.__arg_options = arg_options
+        self.__job_types = job_types
+        is_pricevolume = 'pricevolume' in job_types
+        self.__use_buckets = is_pricevolume and arg_options.use_buckets
+
+        if arg_options.metrics_log or arg_options.metrics_prom:
+            metrics.configure(log_path=arg_options.metrics_log,
+                              prometheus_path=arg_options.metrics_prom)
+            atexit.register(metrics.close)
+        api_config = None
+        if arg_options.api_config_path:
+            with open(arg_options.api_config_path) as input_file:
+                api_config = json.load(input_file)
+        raw_data_cache = None
+        if arg_options.raw_cache_path:
+            # pyarrow is only needed here
+            from raw_data_cache import RawDataCache
+            raw_data_cache = RawDataCache(arg_options.raw_cache_path)
+        self.__stock_crawler = StockCrawler(
+            api_config=api_config,
+            rate_limits={'query1.finance.yahoo.com': arg_options.max_rate}
+            if is_pricevolume and arg_options.max_rate else None,
+            raw_data_cache=raw_data_cache)
+        self.__db_manage = DBManage(pricevolume_buckets=self.__use_buckets)
+
+        self.__db_manage.ensure_schema()
+        self.__watermarks = self.__db_manage.get_watermarks()
+        self.__bulk_writer = BulkWriter(
+            self.__db_manage, max_batch_size=arg_options.batch_size,
+            max_wait_seconds=arg_options.batch_seconds) \
+            if arg_options.batch_size > 0 else None
+
+    def run(self):
+        arg_options = self.__arg_options
+
+        checkpoints = {}
+        ranges = {}
+        for job_type in self.__job_types:
+            # With --queue the work queue keeps the run state instead of
+            # the local checkpoint
+            checkpoint = WorkQueue(
+                self.__db_manage, f'{arg_options.queue_run}/{job_type}',
+                lease_seconds=arg_options.lease_seconds) \
+                if arg_options.queue_run \
+                else RunCheckpoint(
+                    getattr(arg_options, f'{job_type}_checkpoint_path'))
+            job_ranges = checkpoint.resume() if arg_options.resume else None
+            if job_ranges is None:
+                job_ranges = self.__plan(job_type)
+                checkpoint.start(job_ranges)
+            checkpoints.update({job_type: checkpoint})
+            ranges.update({job_type: job_ranges})
+
+        if arg_options.use_async:
+            # aiohttp and motor are only needed here
+            from async_http_session import AsyncHttpSession
+            from async_stock_crawler import AsyncStockCrawler
+            from async_db_manage import AsyncDBManage
+            from async_ticker_updater import AsyncTickerUpdater
+
+            async_stock_crawler = AsyncStockCrawler(
+                self.__stock_crawler, AsyncHttpSession(
+                    max_connections_per_host=arg_options.max_connections))
+            async_ticker_updater = AsyncTickerUpdater(
+                async_stock_crawler, self.__db_manage,
+                AsyncDBManage(self.__db_manage), self.__watermarks,
+                bulk_writer=self.__bulk_writer)
+
+        # One batch of claimed tickers of each job type at a time with
+        # --queue, all of them at once otherwise
+        ranges_batches = [
+            checkpoints[job_type].claim_batches(arg_options.queue_batch)
+            if arg_options.queue_run else [ranges[job_type]]
+            for job_type in self.__job_types]
+        updated_tickers = {job_type: [] for job_type in self.__job_types}
+        for batch in zip_longest(*ranges_batches, fillvalue={}):
+            jobs = {}
+            bulk_updates = []
+            for job_type, job_ranges in zip(self.__job_types, batch):
+                updated_tickers[job_type].extend(job_ranges)
+                [job_bulk_updates, job_ranges] = self.__plan_bulk_updates(
+                    job_type, job_ranges, checkpoints[job_type])
+                bulk_updates.extend(job_bulk_updates)
+                if len(job_ranges) > 0:
+                    jobs.update({job_type: [job_ranges,
+                                            checkpoints[job_type]]})
+
+            # Market-wide updates run on their own threads beside the per
+            # ticker ones, a parked provider only holds up its own update
+            with ThreadPoolExecutor(
+                    max_workers=max(1, len(bulk_updates))) as executor:
+                futures = [executor.submit(bulk_update)
+                           for bulk_update in bulk_updates]
+                if len(jobs) > 0 and arg_options.use_async:
+                    async_ticker_updater.update(jobs)
+                elif len(jobs) > 0:
+                    UpdatePipeline(
+                        self.__stock_crawler, self.__db_manage,
+                        self.__watermarks, workers=arg_options.workers,
+                        bulk_writer=self.__bulk_writer).run(jobs)
+                for future in futures:
+                    future.result()
+
+        if self.__bulk_writer:
+            self.__bulk_writer.close()
+        if arg_options.update_indicators:
+            self.__update_indicators(updated_tickers, checkpoints)
+        for checkpoint in checkpoints.values():
+            checkpoint.close()
+        write_counts = self.__db_manage.get_write_counts()
+        print(f'Records inserted: {write_counts["inserted"]}, '
+              f'updated: {write_counts["updated"]}, '
+              f'unchanged: {write_counts["unchanged"]}')
+
+        dead_letters = {}
+        for checkpoint in checkpoints.values():
+            dead_letters.update(checkpoint.dead_letters)
+        if dead_letters:
+            raise Exception('Failed tickers: '
+                            f'{", ".join(dead_letters)}, '
+                            'run again with --resume to retry them')
+
+        if 'pricevolume' in self.__job_types:
+            print('All price volume update completed')
+        if 'income_statements' in self.__job_types:
+            print('All income statements update completed')
+
+    def __plan(self, job_type):
+        job_ranges = {}
+        for ticker in self.__stock_crawler.stocks_list:
+            watermark = self.__watermarks.get(ticker)
+            if job_type == 'pricevolume':
+                ticker_range = self.__get_start_end_date(watermark)
+            else:
+                ticker_range = self.__get_start_end_season(watermark)
+            if None in ticker_range:
+                continue
+            job_ranges.update({ticker: ticker_range})
+
+        return job_ranges
+
+    def __plan_bulk_updates(self, job_type, job_ranges, checkpoint):
+        # [updates of tickers from market-wide requests or streamed in
+        # chunks, ranges left for the per ticker update]
+        arg_options = self.__arg_options
+        if job_type == 'income_statements' and arg_options.by_date:
+            if len(job_ranges) <= 0:
+                return [[], {}]
+            return [[partial(
+                IncomeStatementsBulkUpdater(
+                    self.__stock_crawler, self.__db_manage,
+                    self.__bulk_writer, checkpoint).update,
+                job_ranges, self.__watermarks)], {}]
+
+        if job_type != 'pricevolume':
+            return [[], job_ranges]
+
+        bulk_updates = []
+        if arg_options.use_snapshot:
+            snapshot_date_ranges = self.__get_snapshot_date_ranges(
+                job_ranges)
+            if len(snapshot_date_ranges) > 0:
+                bulk_updates.append(partial(
+                    MarketSnapshotUpdater(
+                        self.__stock_crawler, self.__db_manage,
+                        self.__bulk_writer, checkpoint).update,
+                    snapshot_date_ranges))
+            job_ranges = {ticker: date_range
+                          for ticker, date_range in job_ranges.items()
+                          if ticker not in snapshot_date_ranges}
+        if arg_options.use_streaming:
+            if len(job_ranges) > 0:
+                bulk_updates.append(partial(
+                    StreamingBackfill(
+                        self.__stock_crawler, self.__db_manage, checkpoint,
+                        workers=arg_options.workers,
+                        chunk_years=arg_options.chunk_years,
+                        batch_size=arg_options.stream_batch).update,
+                    job_ranges))
+            return [bulk_updates, {}]
+        return [bulk_updates, job_ranges]
+
+    def __get_snapshot_date_ranges(self, job_ranges):
+        # Tickers behind by at most --max-gap days. Only ranges starting at
+        # the last date in db, the snapshot updater skips the start date of
+        # the range
+        arg_options = self.__arg_options
+        snapshot_date_ranges = {}
+        for ticker, [start_date, end_date] in job_ranges.items():
+            watermark = self.__watermarks.get(ticker)
+            if not watermark or start_date != watermark.get('last_date'):
+                continue
+            gap = datetime.strptime(end_date, '%Y-%m-%d') \
+                - datetime.strptime(start_date, '%Y-%m-%d')
+            if gap.days <= arg_options.max_gap:
+                snapshot_date_ranges.update({ticker: [start_date, end_date]})
+
+        return snapshot_date_ranges
+
+    def __update_indicators(self, updated_tickers, checkpoints):
+        indicator_updater = IndicatorUpdater(
+            self.__db_manage, pricevolume_buckets=self.__use_buckets)
+        indicator_updater.ensure_indicators()
+        earliest_writes = self.__db_manage.get_earliest_writes()
+        for job_type, tickers in updated_tickers.items():
+            tickers = [ticker for ticker in tickers
+                       if ticker not in checkpoints[job_type].dead_letters]
+            if job_type == 'pricevolume':
+                indicator_updater.update_pricevolume(
+                    tickers, earliest_writes)
+            else:
+                indicator_updater.update_income_statements(
+                    tickers, earliest_writes)
+
+    def __get_start_end_date(self, watermark):
+        arg_options = self.__arg_options
+        time_format = '%Y-%m-%d'
+
+        start_date = arg_options.start_date
+        end_date = arg_options.end_date
+
+        if not watermark or not watermark.get('last_date'):
+            return[arg_options.start_date, arg_options.end_date]
+
+        db_first_date = watermark['first_date']
+        db_last_date = watermark['last_date']
+
+        if arg_options.to_latest:
+            db_last_datetime = datetime.strptime(db_last_date, time_format)
+            today_date = str((datetime.today() - timedelta(hours=9)).date())
+            if db_last_date == today_date:
+                return [None, None]
+            # Friday (Skip Saturday and Sunday if last day is Friday)
+            if db_last_datetime.weekday() == 4:
+                db_last_plus_two_date = (
+                    db_last_datetime + timedelta(days=2)) \
+                    .strftime(time_format)
+                if today_date > db_last_date \
+                        and today_date <= db_last_plus_two_date:
+                    return [None, None]
+
+            print(f'The latest date in db is {db_last_date}')
+            return [db_last_date, today_date]
+
+        if end_date > db_last_date:
+            start_date = db_last_date \
+                if start_date >= db_first_date else start_date
+        elif start_date < db_first_date:
+            end_date = db_first_date \
+                if end_date <= db_last_date else end_date
+        else:
+            return [None, None]
+
+        return [start_date, end_date]
+
+    def __get_start_end_season(self, watermark):
+        arg_options = self.__arg_options
+        start_season_str = arg_options.start_season
+        end_season_str = arg_options.end_season
+
+        if start_season_str != None or end_season_str != None:
+            [start_year, start_season] = start_season_str.split('-')
+            [end_year, end_season] = end_season_str.split('-')
+
+        if not watermark or not watermark.get('last_season'):
+            return[start_year, start_season, end_year, end_season]
+
+        [db_first_year, db_first_season] = divmod(
+            watermark['first_season'], 10)
+        [db_last_year, db_last_season] = divmod(watermark['last_season'], 10)
+
+        if arg_options.to_latest:
+            [latest_announcement_year, latest_announcement_season] = \
+                self.__get_latest_income_statement_season(date.today()) \
+                .split('-')
+            if db_last_year == int(latest_announcement_year) \
+                    and db_last_season == int(latest_announcement_season):
+                return [None, None, None, None]
+
+            print(f'The latest date in db is '
+                  f'year: {db_last_year}, season: {db_last_season}')
+            return [db_last_year, db_last_season,
+                    latest_announcement_year, latest_announcement_season]
+
+        encode_start_season = int(str(start_year) + str(start_season))
+        encode_end_season = int(str(end_year) + str(end_season))
+        encode_db_first_season = int(
+            str(db_first_year) + str(db_first_season))
+        encode_db_last_season = int(str(db_last_year) + str(db_last_season))
+        if encode_end_season > encode_db_last_season:
+            if encode_start_season >= encode_db_first_season:
+                start_year = db_last_year
+                start_season = db_last_season
+        elif encode_start_season < encode_db_first_season:
+            if encode_end_season <= encode_db_last_season:
+                end_year = db_first_year
+                end_season = db_first_season
+        else:
+            return [None, None, None, None]
+
+        return [start_year, start_season, end_year, end_season]
+
+    def __get_latest_income_statement_season(self, cur_date: date):
+        cur_year = cur_date.year
+        q1_date = date(year=cur_year, month=5, day=15)
+        q2_date = date(year=cur_year, month=8, day=14)
+        q3_date = date(year=cur_year, month=11, day=14)
+        q4_date = date(year=cur_year, month=3, day=31)
+
+        if cur_date > q4_date and cur_date <= q1_date:
+            return f"{cur_year - 1}-4"
+        elif cur_date > q1_date and cur_date <= q2_date:
+            return f"{cur_year}-1"
+        elif cur_date > q2_date and cur_date <= q3_date:
+            return f"{cur_year}-2"
+        elif cur_date > q3_date:
+            return f"{cur_year}-3"
+        # Up to March 31 the last season of the year before last is the
+        # latest one announced
+        return f"{cur_year - 1}-3"
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class WorkQueue:
+    # Tickers of one run shared out to every crawler node through Mongo.
+    # A node claims a batch with a lease it keeps extending while it works
+    # on it, tickers of a node which stops heartbeating are claimed again
+    # once their lease expires. Same record / resume / start interface as
+    # RunCheckpoint
+    __MAX_CLAIMS = 3
+    __DUPLICATE_KEY_ERROR = 11000
+
+    def __init__(self, db_manage, run_id, worker_id=None, lease_seconds=300):
+        self.__collection = db_manage.get_collection(
+            db_manage.work_queue_collection_name)
+        self.__run_id = run_id
+        self.worker_id = worker_id if worker_id \
+            else f'{socket.gethostname()}-{os.getpid()}'
+        self.__lease_seconds = lease_seconds
+        self.dead_letters = {}
+
+        db_manage.ensure_work_queue()
+
+        self.__closed = threading.Event()
+        self.__heartbeat_thread = threading.Thread(
+            target=self.__heartbeat, daemon=True)
+        self.__heartbeat_thread.start()
+
+    def start(self, ranges):
+        # Every node may plan and enqueue the same run, the first one to
+        # insert a ticker decides its range
+        operations = [
+            UpdateOne(
+                {'run': self.__run_id, 'ticker': ticker},
+                {'$setOnInsert': {'range': ticker_range,
+                                  'status': 'pending', 'claims': 0}},
+                upsert=True)
+            for ticker, ticker_range in ranges.items()
+        ]
+        if len(operations) <= 0:
+            return ranges
+
+        try:
+            self.__collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Another node upserted the same tickers at the same time
+            if any(write_error['code'] != self.__DUPLICATE_KEY_ERROR
+                   for write_error in e.details['writeErrors']):
+                raise
+        return ranges
+
+    def resume(self):
+        # Join the run without planning it again, failed tickers are
+        # tried once more
+        self.__collection.update_many(
+            {'run': self.__run_id, 'status': 'failed'},
+            {'$set': {'status': 'pending', 'claims': 0},
+             '$unset': {'error': ''}})
+        remaining = self.__collection.count_documents(
+            {'run': self.__run_id,
+             'status': {'$in': ['pending', 'leased']}})
+        print(f'Join run {self.__run_id} with {remaining} tickers left')
+        return {}
+
+    def claim_batches(self, batch_size):
+        # Yields ticker -> range of each claimed batch until no ticker of
+        # the run is left, waiting for other nodes' leases to be released
+        # or to expire before giving up
+        while True:
+            claimed = self.claim(batch_size)
+            if claimed:
+                yield claimed
+                continue
+
+            if self.__collection.count_documents(
+                    {'run': self.__run_id, 'status': 'leased'}) <= 0:
+                return
+            time.sleep(self.__lease_seconds / 4)
+
+    def claim(self, batch_size):
+        now = datetime.utcnow()
+        # A ticker whose lease expired too often most likely crashes the
+        # nodes working on it
+        self.__collection.update_many(
+            {'run': self.__run_id, 'status': 'leased',
+             'lease_until': {'$lt': now},
+             'claims': {'$gte': self.__MAX_CLAIMS}},
+            {'$set': {'status': 'failed',
+                      'error': 'Lease expired 3 times'}})
+
+        claimable = {
+            'run': self.__run_id,
+            '$or': [{'status': 'pending'},
+                    {'status': 'leased', 'lease_until': {'$lt': now}}]
+        }
+        candidate_ids = [
+            document['_id'] for document in
+            self.__collection.find(claimable, {'_id': 1}).limit(batch_size)]
+        if len(candidate_ids) <= 0:
+            return {}
+
+        # Filtering on claimable again makes a ticker another node just
+        # claimed drop out of this claim
+        claim_id = uuid.uuid4().hex
+        claimable.update({'_id': {'$in': candidate_ids}})
+        self.__collection.update_many(claimable, {
+            '$set': {'status': 'leased', 'owner': self.worker_id,
+                     'claim_id': claim_id,
+                     'lease_until': now + timedelta(
+                         seconds=self.__lease_seconds)},
+            '$inc': {'claims': 1}
+        })
+
+        claimed = {document['ticker']: document['range'] for document in
+                   self.__collection.find({'claim_id': claim_id},
+                                          {'ticker': 1, 'range': 1})}
+        if claimed:
+            print(f'Claimed {len(claimed)} tickers of run {self.__run_id}')
+        return claimed
+
+    def record(self, ticker, error=None):
+        # Also the on_complete callback of BulkWriter.add
+        update = {'status': 'completed'} if error is None \
+            else {'status': 'failed', 'error': str(error)}
+        if error is None:
+            self.dead_letters.pop(ticker, None)
+        else:
+            print(f'## Warning: Ticker {ticker} moved to dead letters: '
+                  f'{error}')
+            self.dead_letters.update({ticker: str(error)})
+
+        self.__collection.update_one(
+            {'run': self.__run_id, 'ticker': ticker,
+             'owner': self.worker_id},
+            {'$set': update, '$unset': {'lease_until': ''}})
+
+    def close(self):
+        self.__closed.set()
+        self.__heartbeat_thread.join()
+
+    def __heartbeat(self):
+        while not self.__closed.wait(self.__lease_seconds / 3):
+            self.__collection.update_many(
+                {'run': self.__run_id, 'status': 'leased',
+                 'owner': self.worker_id},
+                {'$set': {'lease_until': datetime.utcnow() + timedelta(
+                    seconds=self.__lease_seconds)}})